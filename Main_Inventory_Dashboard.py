@@ -13,20 +13,19 @@ https://github.com/jcast6/
 
 """
 import streamlit as st
-import pandas as pd
-import mysql.connector
-import plotly.express as px
-import time
 import datetime
-from mysql.connector import Error
-from dotenv import load_dotenv 
-import os 
-from dateutil.relativedelta import relativedelta
-import plotly.graph_objects as pg
+from inventory_control_charts import comparison_figure, item_count_figure, seasonality_figure, usage_trend_figure
+from inventory_control_frames import count_method
+from inventory_control_loader import as_ready, load
+from inventory_control_metrics import begin_rerun, configure_logging, fragment_rerun, metrics_panel, timed
+from inventory_control_queries import fetch_data, fetch_item_type_space, fetch_item_types, fetch_items_BTN_SKU, fetch_monthly_comparison, fetch_usage_trend
+from inventory_control_search import search_items
 # import streamlit.components.v1 as components
 # import numpy as np
 
 st.set_page_config(layout = "wide", initial_sidebar_state = "collapsed")
+configure_logging()
+begin_rerun("Dashboard")
 st.markdown("""
 <div style="text-align: left; padding: 10px; border-radius: 5px;">
     <span style="position: relative; left: -50px; top: -65px; font-size: 100">↖️ Click the here for more options!</span> 
@@ -37,97 +36,25 @@ current_year = datetime.datetime.now().year
 years = list(range(current_year - 10, current_year + 1))  # Last 10 years and current year
 months = ['January', 'February', 'March', 'April', 'May', 'June', 
           'July', 'August', 'September', 'October', 'November', 'December']
+default_months = months
+preselected_items = ['BSKU-5230', 'BSKU-5350', 'BSKU-5185'] # pre-selected items BTN_SKU for user preview
 
-# Load environment variables from .env file
-load_dotenv()
-
-def create_connection():
-    connection = None
-    try:
-        connection = mysql.connector.connect(
-            host = os.getenv('DB_HOST'),
-            user = os.getenv('DB_USER'),
-            passwd = os.getenv('DB_PASS'),
-            database = os.getenv('DB_NAME')
-        )
-        print("MySQL Database connection successful")
-    except Error as err:
-        print(f"Error: '{err}'")
-    return connection
-
-db_connection = create_connection()
-
-
-def fetch_data(selected_month_year):
-    conn = create_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            query = "SELECT * FROM items_table WHERE Month = %s"
-            cursor.execute(query, (selected_month_year,))
-            columns = [column[0] for column in cursor.description]
-            data = cursor.fetchall()
-            df = pd.DataFrame(data, columns=columns)
-            print("Query successful, fetched data:")
-            print(df.head())
-            return df
-        finally:
-            cursor.close()
-            conn.close()
-    else:
-        return pd.DataFrame()
-
-
-def execute_query(connection, query, params):
-    cursor = connection.cursor(dictionary=True)
-    try:
-        cursor.execute(query, params)
-        result = cursor.fetchall()
-        return result
-    except Error as err:
-        print(f"Error: '{err}'")
-
-
-# get all items BTN_SKU only
-def fetch_items_BTN_SKU():
-    connection = create_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                query = "SELECT Distinct BTN_SKU FROM items_table" 
-                cursor.execute(query)
-                items = cursor.fetchall()
-                return [item[0] for item in items]  # Adjust indexing if necessary based on query
-        except Error as err:
-            print(f"Error: '{err}'")
-            return []
-        finally:
-            if connection:
-                connection.close()
-    else:
-        return []
-    
-# get all items BTN_SKU and description only
-def fetch_items_BTN_SKU_description():
-    connection = create_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                query = "SELECT DISTINCT BTN_SKU, Description FROM items_table" 
-                cursor.execute(query)
-                items = cursor.fetchall()
-                # Combine BTN_SKU and Description for display in dropdown
-                return [f"{item[0]} - {item[1]}" for item in items]  # Adjust indexing if necessary based on query
-        except Error as err:
-            print(f"Error: '{err}'")
-            return []
-        finally:
-            if connection:
-                connection.close()
-    else:
-        return []
 
-    
+def read_comparison_inputs():
+    # The comparison widgets are keyed, so what they hold for this rerun is already in session
+    # state before they are drawn, which lets their query start with the others
+    num_months = st.session_state.get('num_months', 2)
+    selected = [(st.session_state.get(f'month_selection_{i}', default_months[i % len(default_months)]),
+                 st.session_state.get(f'year_selection_{i}', 2024)) for i in range(num_months)]
+    selected = sorted(selected, key=lambda x: (x[1], default_months.index(x[0])))
+    return st.session_state.get('item_selection', preselected_items), [f"{month} {year}" for month, year in selected]
+
+
+# Start the reads that do not depend on widgets further down, they run while the page is drawn
+comparison_inputs = read_comparison_inputs()
+items_future = load(fetch_items_BTN_SKU)
+# The comparison is only read while its expander is open, which it is until the user closes it
+comparison_future = load(fetch_monthly_comparison, *comparison_inputs) if st.session_state.get('comparison_open', True) else None
 
 col1, _ = st.columns([1, 10])   
 with col1:
@@ -187,228 +114,245 @@ st.session_state.selected_month = selected_month
 # Combine the selected month and year
 selected_month_year = f"{selected_month} {selected_year}"
 
-# selected data is inserted into dataframe and displayed
-df = fetch_data(selected_month_year)
-
-# Search Bar asking user to enter either item BTN_SKU or Description
-search_query = st.text_input("Enter BTN_SKU or Description to search for item📦:")
-if search_query:
-    search_results = df[(df['BTN_SKU'] == search_query) | (df['Description'].str.contains(search_query, case = False, na = False))]
+# selected data is read in the background while the rest of the page is laid out
+month_future = load(fetch_data, selected_month_year)
+
+
+# Every section below is a fragment, so a widget inside one only reruns that section. Changing
+# the year or month above still reruns the whole page since every section depends on it.
+@st.fragment
+@fragment_rerun("Dashboard")
+def search_section(month_future):
+    # Search Bar asking user to enter either item BTN_SKU or Description
+    search_query = st.text_input("Enter BTN_SKU or Description to search for item📦:")
+    if not search_query:
+        return
+    # Ranked matches across every month, not just the selected one
+    search_results = search_items(search_query)
     if search_results.empty:
         st.write("Item not found in inventory.")
-    else:
-        # Initialize progress bar
-        progress_bar = st.progress(0)
+        return
+    st.success(f"{len(search_results)} matching item(s) found!")
+    st.dataframe(search_results, use_container_width = True, hide_index = True)
+    df = month_future.result()
+    month_results = df[df['BTN_SKU'].isin(search_results['BTN_SKU'])] if not df.empty else df
+    if not month_results.empty:
+        st.write(f"Item Data for {selected_month_year}:")
+        st.dataframe(month_results)
+
+
+search_section(month_future)
+
+# One container per section in page order, each is filled in as soon as its data arrives
+month_section = st.container()
+comparison_section = st.container()
+
+
+@st.fragment
+@fragment_rerun("Dashboard")
+def item_count_section(df):
+    # Bar graph for each item count, large months are limited to the top items
+    bar_col1, bar_col2 = st.columns([3, 1])
+    bar_mode = bar_col1.radio("Items to show:", ["Top items, rest grouped", "Top items only", "All items"], horizontal = True)
+    top_n = bar_col2.number_input("Number of top items:", min_value = 5, max_value = 500, value = 30, step = 5)
+    fig_bar = item_count_figure(df, f'Inventory Count for Each Item - {selected_month}',
+                                top_n = None if bar_mode == "All items" else top_n,
+                                group_rest = bar_mode == "Top items, rest grouped")
+    st.plotly_chart(fig_bar, use_container_width = True)
+
+
+@st.fragment
+@fragment_rerun("Dashboard")
+def space_section(df):
+    if df.empty:
+        st.error("No data available for the selected period.")
+        return
+
+    # Built only while the expander is open, opening or closing it reruns just this section
+    space = st.expander("**Bar Graph for Inventory Space Distribution📊**", key = 'space_open', on_change = 'rerun')
+    if not space.open:
+        return
+
+    with space:
+        # Total space and item list per 'Type', from the local analytics copy
+        df_grouped = fetch_item_type_space(selected_month_year)
+
+        # Total space for calculating percentages
+        total_space = df_grouped['Total_Space'].sum()
+
+        # bar chart with the updated data frame, Plotly is only imported once a chart is drawn
+        with timed('plotly'):
+            import plotly.express as px
+            fig_type_space = px.bar(df_grouped, x = 'item_type', y = 'Total_Space',
+                                    color = 'item_type',  
+                                    hover_data = {'Item_List'},
+                                    labels = {'Total_Space': 'Total Inventory Space'},
+                                    title = f'Inventory Space by Item Type - {selected_month_year}',
+                                    height = 600)
+            fig_type_space.update_layout(xaxis_tickangle = -45)
+
+        st.plotly_chart(fig_type_space, use_container_width = True)
+
+         # Metrics
+        st.write("\n")
+        st.markdown("**Inventory Space Metrics**")
+
+        # Use columns to display each metric side by side
+        cols = st.columns(len(df_grouped))
+        for col, (index, row) in zip(cols, df_grouped.iterrows()):
+            # Calculate the percentage each item type, (in inventory)
+            percentage = (row['Total_Space'] / total_space) * 100 
+            # markdown to add a hover text over the metric that shows the item list
+            metric_label_html = f"<span title = '{row['Item_List']}' style = 'text-decoration: underline;'>{row['item_type']}</span>"
+            col.markdown(metric_label_html, unsafe_allow_html = True)
+            st.write("""
+                    <style>
+                    [data-testid = "stMetricDelta"] svg {
+                        display: none;
+                    }
+                    </style>
+                    """,
+                    unsafe_allow_html = True,
+            )
+            col.metric(label = "Inventory Space Used", value = f"{row['Total_Space']:.2f}", delta = f"{percentage:.2f}%", delta_color = 'off')
+
+
+def render_month_section(df):
+    st.dataframe(df, use_container_width = True)
+
+    st.markdown("\n")
+    st.markdown("\n")
+    st.markdown("\n")
+
+    # st.markdown("Item count in inventory at the end of each month.")
+    # html and css for underline color
+    st.markdown("""
+    <style>
+    .custom-underline {
+        text-decoration: none;
+        position: relative;
+    }
+    .custom-underline::after {
+        content: '';
+        position: absolute;
+        bottom: -2px;
+        left: 0;
+        width: 100%;
+        border-bottom: 2px solid green; /* for changing underline color */
+        pointer-events: none;
+    }
+    </style>
+
+    <span class='custom-underline' style='font-size: 25px; padding-top: 50px;'>**Bar Graph of Item Count**📉 :</span>
+    """, unsafe_allow_html=True)
 
-        for percent_complete in range(100):
-            time.sleep(0.0030)
-            progress_bar.progress(percent_complete + 1)
+    # the count method is set to 'Rolls' if not set it defaults to 'Bundles/Boxes', one vectorized pass
+    df['Count_Method'] = count_method(df['is_roll'])
 
-        st.success("Item found!")
-        st.write("Item Data:")
-        st.dataframe(search_results)
-st.dataframe(df, use_container_width = True)
+    item_count_section(df)
 
-st.markdown("\n")
-st.markdown("\n")
-st.markdown("\n")
+    st.write("\n")
+    st.write("\n")
+    st.write("\n")
 
-# st.markdown("Item count in inventory at the end of each month.")
-# html and css for underline color
-st.markdown("""
-<style>
-.custom-underline {
-    text-decoration: none;
-    position: relative;
-}
-.custom-underline::after {
-    content: '';
-    position: absolute;
-    bottom: -2px;
-    left: 0;
-    width: 100%;
-    border-bottom: 2px solid green; /* for changing underline color */
-    pointer-events: none;
-}
-</style>
+    space_section(df)
 
-<span class='custom-underline' style='font-size: 25px; padding-top: 50px;'>**Bar Graph of Item Count**📉 :</span>
-""", unsafe_allow_html=True)
 
-# User selection for count method
-all_items = df['Description'].unique()  # Or use 'BTN_SKU' column if better 
-
-# the count method is set to 'Spools' if not set it defaults to 'Bundles/Boxes'. 
-df['Count_Method'] = df['is_roll'].apply(lambda x: 'Rolls' if x else 'Bundles/Boxes')
-
-# Bar graph for each item count
-fig_bar = px.bar(df, x = 'Description', y = 'Bundles_Boxes_Spools', color = 'Count_Method', 
-                 title = f'Inventory Count for Each Item - {selected_month}',
-                 labels = {'Bundles_Boxes_Spools': 'Count'})
-fig_bar.update_layout(height = 600, xaxis_tickangle = -45)
-st.plotly_chart(fig_bar, use_container_width = True)
-
-# Prepare data for the new interactive bar chart
-df_grouped = df.groupby('item_type').agg(
-    Total_Space = pd.NamedAgg(column = 'Bundles_Boxes_Spools', aggfunc = 'sum'),
-    Item_List = pd.NamedAgg(column = 'Description', aggfunc = lambda x: '<br>'.join(x))
-).reset_index()
-
-st.write("\n")
-st.write("\n")
-st.write("\n")
-st.write("\n")
-st.write("\n")
-st.write("\n")
-
-if not df.empty:
-    # Group by 'Type' and aggregate data
-    df_grouped = df.groupby('item_type').agg(
-        Total_Space = pd.NamedAgg(column = 'Bundles_Boxes_Spools', aggfunc = 'sum'),
-        # Handle missing data by using a placeholder if no descriptions are present
-        Item_List = pd.NamedAgg(column = 'Description', aggfunc = lambda x: '<br>'.join(set(x)) if x.any() else 'No data')
-    ).reset_index()
-
-    print(f"Grouped data for {selected_month_year}:")
-    print(df_grouped[df_grouped['item_type'] == 'Chelan PLU'])
-
-    # Total space for calculating percentages
-    total_space = df_grouped['Total_Space'].sum()
-    # bar chart with the updated data frame
-    st.markdown("<span class = 'custom-underline' style = 'font-size: 25px;'>**Bar Graph for Inventory Space Distribution📊 :**</span>", unsafe_allow_html = True)  
-
-    fig_type_space = px.bar(df_grouped, x = 'item_type', y = 'Total_Space',
-                            color = 'item_type',  
-                            hover_data = {'Item_List'},
-                            labels = {'Total_Space': 'Total Inventory Space'},
-                            title = f'Inventory Space by Item Type - {selected_month_year}',
-                            height = 600)
-    fig_type_space.update_layout(xaxis_tickangle = -45)
-
-    st.plotly_chart(fig_type_space, use_container_width = True)
-
-     # Metrics
-    st.write("\n")
-    st.markdown("**Inventory Space Metrics**")
-
-    # Use columns to display each metric side by side
-    cols = st.columns(len(df_grouped))
-    for col, (index, row) in zip(cols, df_grouped.iterrows()):
-        # Calculate the percentage each item type, (in inventory)
-        percentage = (row['Total_Space'] / total_space) * 100 
-        # markdown to add a hover text over the metric that shows the item list
-        metric_label_html = f"<span title = '{row['Item_List']}' style = 'text-decoration: underline;'>{row['item_type']}</span>"
-        col.markdown(metric_label_html, unsafe_allow_html = True)
-        st.write("""
-                <style>
-                [data-testid = "stMetricDelta"] svg {
-                    display: none;
-                }
-                </style>
-                """,
-                unsafe_allow_html = True,
-        )
-        col.metric(label = "Inventory Space Used", value = f"{row['Total_Space']:.2f}", delta = f"{percentage:.2f}%", delta_color = 'off')
-else:
-    st.error("No data available for the selected period.")
 
+@st.fragment
+@fragment_rerun("Dashboard")
+def comparison_usage_section(prefetched):
+    usage = st.expander("**Comparing item monthly usage📈📉**", expanded = True, key = 'comparison_open', on_change = 'rerun')
+    if not usage.open:
+        return
 
-import pandas as pd
-import plotly.graph_objects as pg
+    with usage:
+        num_months = st.number_input("Enter the number of months to compare (up to 12):", min_value = 1, max_value = 12, value = 2, step = 1, key = 'num_months')
 
-st.markdown("<span class = 'custom-underline' style = 'font-size: 25px;'> **Comparing item monthly usage📈📉**</span>", unsafe_allow_html = True)
-num_months = st.number_input("Enter the number of months to compare (up to 12):", min_value = 1, max_value = 12, value = 2, step = 1)
+        # Month and year selection with different prefilled values
+        selected_months_years = []
 
-# Month and year selection with different prefilled values
-selected_months_years = []
-default_months = ['January', 'February', 'March', 'April', 'May', 'June', 
-                  'July', 'August', 'September', 'October', 'November', 'December']
+        # Pre-select months/year to compare
+        for i in range(num_months):
+            compare_year = st.selectbox(f"Select year {i+1}📅:", years, key = f'year_selection_{i}', index = years.index(2024))
+            compare_month = st.selectbox(f"Select month {i+1}🗓️:", default_months, key = f'month_selection_{i}', index = i % len(default_months))
+            selected_months_years.append((compare_month, compare_year))
 
-# Pre-select months/year to compare
-for i in range(num_months):
-    selected_year = st.selectbox(f"Select year {i+1}📅:", years, key = f'year_selection_{i}', index = years.index(2024))
-    selected_month = st.selectbox(f"Select month {i+1}🗓️:", default_months, key = f'month_selection_{i}', index = i % len(default_months))
-    selected_months_years.append((selected_month, selected_year))
+        # Sort selected months/years by year and month
+        sorted_months_years = sorted(selected_months_years, key=lambda x: (x[1], default_months.index(x[0])))
 
-# Sort selected months/years by year and month
-sorted_months_years = sorted(selected_months_years, key=lambda x: (x[1], default_months.index(x[0])))
+        all_items = items_future.result()
+        selected_items = st.multiselect("Select item(s)📦:", all_items, key = 'item_selection', default = preselected_items)
 
-color_palette = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', 
-                 '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+        # Fetch every selected item and month in one query, missing pairs come back as 0
+        sorted_month_years = [f"{month} {year}" for month, year in sorted_months_years]
+        if prefetched is None or (selected_items, sorted_month_years) != comparison_inputs:
+            # Not read with the page, or the widgets changed since, read them again (usually cached)
+            df_results = fetch_monthly_comparison(selected_items, sorted_month_years)
+        else:
+            df_results = prefetched
 
-all_items = fetch_items_BTN_SKU()
-preselected_items = ['BSKU-5230', 'BSKU-5350', 'BSKU-5185'] # pre-selected items BTN_SKU for user preview
-selected_items = st.multiselect("Select item(s)📦:", all_items, key = 'item_selection', default = preselected_items)
-
-# Process data for each selected item
-data_results = []
-rolls_items = [] 
-
-for month, year in sorted_months_years:
-    month_year = f"{month} {year}"
-    for item in selected_items:
-        query2 = "SELECT Month, Bundles_Boxes_Spools, is_roll FROM items_table WHERE BTN_SKU = %s AND Month = %s"
-        data = execute_query(db_connection, query2, (item, month_year))
-        if data:
-            is_roll = data[0]['is_roll']
-            data_results.append({
-                'MonthYear': month_year,
-                'Item': item,
-                'Value': data[0]['Bundles_Boxes_Spools'],
-                'IsRoll': is_roll
-            })
-            if is_roll:
-                rolls_items.append(item)
+        fig = comparison_figure(df_results, selected_items)
+
+        st.plotly_chart(fig, use_container_width = True)
+
+
+@st.fragment
+@fragment_rerun("Dashboard")
+def usage_trend_section():
+    # Queried only while the expander is open, the whole range is summed in one query
+    trend = st.expander("**Year over year usage📈**", key = 'trend_open', on_change = 'rerun')
+    if not trend.open:
+        return
+
+    with trend:
+        first_year, last_year = st.select_slider("Years to compare📅:", options = years, value = (years[-3], years[-1]))
+        col1, col2 = st.columns(2)
+        group_label = col1.radio("Group usage by:", ["Item type", "Item", "All items"], horizontal = True)
+        by_quarter = col2.radio("Totals per:", ["Quarter", "Year"], horizontal = True) == "Quarter"
+
+        if group_label == "Item":
+            group_by, item_types = 'BTN_SKU', None
+            btn_skus = st.multiselect("Select item(s)📦:", items_future.result(), default = preselected_items, key = 'trend_items')
+            if not btn_skus:
+                st.info("Select at least one item.")
+                return
         else:
-            data_results.append({
-                'MonthYear': month_year,
-                'Item': item,
-                'Value': 0,
-                'IsRoll': False
-            })
-
-# Insert extracted results into a dataframe
-df_results = pd.DataFrame(data_results)
-
-fig = pg.Figure()
-for item in selected_items:
-    df_filtered = df_results[df_results['Item'] == item]
-
-    # Prepare hover text based on whether the item is counted as rolls
-    df_filtered['HoverText'] = df_filtered.apply(
-        lambda row: f"Item: {item}<br>Month/Year: {row['MonthYear']}<br>" +
-                    (f"Rolls: {row['Value']}" if item in rolls_items else f"Bundles/Boxes: {row['Value']}"),
-        axis = 1
-    )
-
-    # Define marker style
-    if item in rolls_items:
-        marker_style = dict(color=color_palette[selected_items.index(item) % len(color_palette)], symbol="star")
-        line_style = dict(width = 3)
-    else:
-        marker_style = dict(color=color_palette[selected_items.index(item) % len(color_palette)])
-        line_style  = dict(width = 4)
-
-    # Add trace with custom hover text
-    fig.add_trace(pg.Scatter(
-        name=item,
-        x = df_filtered['MonthYear'],
-        y = df_filtered['Value'],
-        mode = 'lines+markers',
-        marker = marker_style,
-        line = line_style,
-        text = df_filtered['HoverText'], 
-        hoverinfo = 'text' 
-    ))
-
-fig.update_layout(
-    title = 'Monthly data comparison for selected item(s)',
-    xaxis_title = "Month/Year",
-    yaxis_title = "Bundles/Boxes/Spools",
-    height = 800,
-)
-
-fig.update_yaxes(tick0 = 0, dtick = 10)
-
-st.plotly_chart(fig, use_container_width = True)
+            group_by, btn_skus = ('item_type' if group_label == "Item type" else 'total'), None
+            item_types = st.multiselect("Only these item types (all if empty):", fetch_item_types(), key = 'trend_types')
+
+        df_trend = fetch_usage_trend(group_by, first_year, last_year, by_quarter, item_types, btn_skus)
+        if df_trend.empty:
+            st.error("No usage recorded for the selected years.")
+            return
+
+        period = "Quarter" if by_quarter else "Year"
+        st.plotly_chart(usage_trend_figure(df_trend, f'Usage per {period.lower()}, {first_year} to {last_year}'), use_container_width = True)
+        if by_quarter:
+            st.plotly_chart(seasonality_figure(df_trend, 'Seasonality: usage per quarter, one line per year'), use_container_width = True)
+
+        # Year over year changes, the same quarter (or the whole year) against the year before
+        changes = df_trend.rename(columns = {
+            'group_key': 'Group', 'year': 'Year', 'quarter': 'Quarter', 'used': 'Used', 'received': 'Received',
+            'items': 'Items', 'previous_used': 'Used Year Before', 'yoy_pct': 'Change %'
+        })
+        changes.insert(changes.columns.get_loc('Change %'), 'Change', changes['Used'] - changes['Used Year Before'])
+        if not by_quarter:
+            changes = changes.drop(columns = 'Quarter')
+        st.dataframe(changes, use_container_width = True, hide_index = True)
+
+
+sections = {'month': (month_future, month_section, render_month_section)}
+if comparison_future is None:
+    with comparison_section:
+        comparison_usage_section(None)
+else:
+    sections['comparison'] = (comparison_future, comparison_section, comparison_usage_section)
+for name, result in as_ready({name: future for name, (future, _, _) in sections.items()}):
+    _, container, render = sections[name]
+    with container:
+        render(result)
+
+usage_trend_section()
 
+metrics_panel()
@@ -0,0 +1,59 @@
+"""
+Memory report for the typed frames of inventory_control_frames.
+
+Builds a synthetic multi-year items_table frame the way a cursor returns it (one Python value
+per cell, object columns for the text), applies ITEMS_TABLE_SCHEMA and prints the deep memory
+use of every column before and after. It also times the per-row Count_Method apply the
+dashboard used against the vectorized count_method. No database is needed. Run from the
+repository root:
+    python benchmarks/bench_frame_memory.py --skus 500 --months 120
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory_control_frames import ITEMS_TABLE_SCHEMA, apply_schema, count_method, memory_report  # noqa: E402
+from synthetic_data import make_items_table  # noqa: E402
+
+
+def cursor_frame(df):
+    # What pd.DataFrame(cursor.fetchall(), columns = columns) gives for the same rows
+    rows = list(df.astype(object).itertuples(index = False, name = None))
+    return pd.DataFrame(rows, columns = df.columns)
+
+
+def time_it(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the memory use of cursor built and typed items_table frames.")
+    parser.add_argument("--skus", type = int, default = 500, help = "number of synthetic items")
+    parser.add_argument("--months", type = int, default = 120, help = "months of history in the frame")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic data")
+    parser.add_argument("--min-factor", type = float, default = 0.0, help = "exit with status 1 if the frame shrinks less than this")
+    args = parser.parse_args()
+
+    before = cursor_frame(make_items_table(args.skus, args.months, args.seed))
+    after = apply_schema(before, ITEMS_TABLE_SCHEMA)
+    report = memory_report(before, after)
+
+    pd.set_option('display.width', 120)
+    print(f"{len(before):,} rows ({args.skus} items x {args.months} months)")
+    print(report.to_string(formatters = {'bytes_before': '{:,.0f}'.format, 'bytes_after': '{:,.0f}'.format}))
+
+    legacy = time_it(lambda: before['is_roll'].apply(lambda x: 'Rolls' if x else 'Bundles/Boxes'))
+    vectorized = time_it(count_method, after['is_roll'])
+    print(f"Count_Method: apply {legacy * 1000:.1f} ms, vectorized {vectorized * 1000:.1f} ms ({legacy / vectorized:.0f}x)")
+
+    factor = report.loc['Total', 'factor']
+    if factor < args.min_factor:
+        print(f"Frame only shrank {factor}x, expected at least {args.min_factor}x")
+        sys.exit(1)
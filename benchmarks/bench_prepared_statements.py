@@ -0,0 +1,159 @@
+"""
+Compares the busiest parameterized statements run over the text protocol (a plain cursor,
+the server parses the statement on every execution) with server-side prepared statements over
+the binary protocol (prepared once per connection by inventory_control_db.prepared_cursor).
+
+Runs against a throwaway MySQL database like run_benchmarks.py. Each statement is executed
+--executions times per protocol on one pooled connection, alternating the protocols in rounds,
+and the server's Com_stmt_prepare counter is read to show how often it had to prepare.
+Run from the repository root:
+    python benchmarks/bench_prepared_statements.py --executions 2000 --output prepared.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+
+from local_database import seed_database, throwaway_database
+from run_benchmarks import git_commit, quiet
+from synthetic_data import item_skus, make_items_table, make_ledger, month_periods
+
+from inventory_control_db import get_connection, prepared_cursor
+from inventory_control_metrics import configure_logging
+
+# The same statements the pages and inventory_control_stock.py run, with a parameter maker each
+STATEMENTS = [
+    ('snapshot_lookup', """
+    SELECT current_amount, total_boxes, total_units
+    FROM Current_Stock_Snapshot
+    WHERE BTN_SKU = %s;
+    """, lambda rng, skus, periods: (rng.choice(skus),)),
+    ('latest_amount', """
+    SELECT amount_after_change
+    FROM Current_Amount_Items
+    WHERE BTN_SKU = %s
+    ORDER BY Change_Timestamp DESC
+    LIMIT 1;
+    """, lambda rng, skus, periods: (rng.choice(skus),)),
+    ('item_details', """
+    SELECT Description, item_type, Count_Details, Vendor
+    FROM items_table
+    WHERE BTN_SKU = %s
+    ORDER BY period DESC LIMIT 1;
+    """, lambda rng, skus, periods: (rng.choice(skus),)),
+    ('month_rows', "SELECT * FROM items_table WHERE period = %s",
+     lambda rng, skus, periods: (rng.choice(periods),)),
+    ('comparison', """
+    SELECT period, BTN_SKU, Bundles_Boxes_Spools, is_roll
+    FROM items_table
+    WHERE period IN (%s, %s, %s) AND BTN_SKU IN (%s, %s, %s);
+    """, lambda rng, skus, periods: tuple(rng.sample(periods, 3)) + tuple(rng.sample(skus, 3))),
+    ('ledger_insert', """
+    INSERT INTO Current_Amount_Items (BTN_SKU, Amount_Change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll)
+    VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, lambda rng, skus, periods: (rng.choice(skus), 5, 10, 100, 1500, 15, 0)),
+]
+
+
+def prepare_count(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW SESSION STATUS LIKE 'Com_stmt_prepare';")
+        return int(cursor.fetchall()[0][1])
+    finally:
+        cursor.close()
+
+
+def run_batch(connection, query, make_params, executions, rng, skus, periods, prepared):
+    cursor = prepared_cursor(connection, query) if prepared else connection.cursor()
+    timings = []
+    try:
+        for _ in range(executions):
+            params = make_params(rng, skus, periods)
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            if cursor.with_rows:
+                cursor.fetchall()
+            timings.append(time.perf_counter() - start)
+    finally:
+        cursor.close()
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'executions': len(timings),
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95) - 1] * 1000,
+    }
+
+
+def bench_statement(connection, query, make_params, args, skus, periods):
+    rng = random.Random(args.seed)
+    timings = {'text': [], 'prepared': []}
+    prepares = {'text': 0, 'prepared': 0}
+    per_round = max(1, args.executions // args.rounds)
+    for _ in range(args.rounds):
+        for protocol in ('text', 'prepared'):
+            before = prepare_count(connection)
+            timings[protocol] += run_batch(connection, query, make_params, per_round, rng, skus, periods,
+                                           prepared = protocol == 'prepared')
+            prepares[protocol] += prepare_count(connection) - before
+    result = {protocol: dict(summarize(values), server_prepares = prepares[protocol])
+              for protocol, values in timings.items()}
+    result['speedup'] = result['text']['median_ms'] / result['prepared']['median_ms']
+    return result
+
+
+def run(args):
+    skus = item_skus(args.skus)
+    periods = month_periods(args.months)
+    items_df = make_items_table(args.skus, args.months, args.seed)
+    ledger_df = make_ledger(args.skus, args.ledger_depth, args.months, args.seed)
+
+    results = {}
+    with throwaway_database(args.database, keep = args.keep):
+        with quiet():
+            seed_database(items_df, ledger_df)
+        with get_connection() as connection:
+            # Inserts are rolled back at the end so both protocols see the same table
+            connection.start_transaction()
+            for name, query, make_params in STATEMENTS:
+                print(f"Running {name}")
+                results[name] = bench_statement(connection, query, make_params, args, skus, periods)
+            connection.rollback()
+
+    return {
+        'created': datetime.now().isoformat(timespec = 'seconds'),
+        'commit': git_commit(),
+        'config': {'skus': args.skus, 'months': args.months, 'ledger_depth': args.ledger_depth,
+                   'executions': args.executions, 'rounds': args.rounds, 'seed': args.seed},
+        'statements': results,
+    }
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Compare text protocol and server-side prepared statements on a throwaway MySQL database.")
+    parser.add_argument("--skus", type = int, default = 500, help = "number of synthetic items")
+    parser.add_argument("--months", type = int, default = 24, help = "months of items_table history")
+    parser.add_argument("--ledger-depth", type = int, default = 100, help = "adjustments per item in Current_Amount_Items")
+    parser.add_argument("--executions", type = int, default = 2000, help = "executions per statement and protocol")
+    parser.add_argument("--rounds", type = int, default = 10, help = "alternate the protocols this many times")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic data and parameters")
+    parser.add_argument("--database", default = "inventory_control_bench", help = "name of the throwaway database")
+    parser.add_argument("--keep", action = "store_true", help = "keep the database afterwards")
+    parser.add_argument("--output", default = "prepared_statements.json", help = "JSON results file")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print(f"{'statement':<20}{'text':>12}{'prepared':>12}{'speedup':>10}")
+    for name, result in results['statements'].items():
+        print(f"{name:<20}{result['text']['median_ms']:>10.3f}ms{result['prepared']['median_ms']:>10.3f}ms{result['speedup']:>9.2f}x")
+    print(f"Results written to {args.output}")
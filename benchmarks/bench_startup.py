@@ -0,0 +1,84 @@
+"""
+Import time of every page, the part of a first visit spent before the page draws anything.
+
+Streamlit runs a page by executing its script, and the first run in a server process imports
+every module the page imports at the top. This runs the top level imports of each page in a
+fresh interpreter that has already imported streamlit (as the server has), times them, and
+lists the slowest imports of every page with python -X importtime. No database is needed, the
+connection pool is only created on the first query. Run from the repository root:
+    python benchmarks/bench_startup.py --budget-ms 750
+and it exits with status 1 when any page takes longer than the budget to import.
+"""
+import argparse
+import ast
+import glob
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['Main_Inventory_Dashboard.py'] + sorted(os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, 'pages', '*.py')))
+
+# Runs in the child interpreter, {source} holds the page's import statements
+CHILD = """
+import sys, time
+import streamlit
+sys.stderr.write('-- page imports --\\n')
+start = time.perf_counter()
+exec(compile({source!r}, {page!r}, 'exec'), {{'__name__': '__page__'}})
+print(time.perf_counter() - start)
+"""
+
+
+def page_imports(page):
+    """The import statements at the top level of a page script, as source."""
+    with open(os.path.join(ROOT, page), encoding = 'utf-8') as f:
+        tree = ast.parse(f.read(), page)
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return ast.unparse(ast.Module(body = nodes, type_ignores = []))
+
+
+def run_child(page, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD.format(source = page_imports(page), page = page)]
+    env = dict(os.environ, PYTHONPATH = ROOT)
+    result = subprocess.run(command, cwd = ROOT, env = env, capture_output = True, text = True, check = True)
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    # -X importtime lines are "import time: self [us] | cumulative | name", nested imports are indented
+    lines = stderr.split('-- page imports --\n', 1)[-1].splitlines()
+    modules = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  ') and cumulative.strip().isdigit():
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse = True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Measure how long every page takes to import its modules.")
+    parser.add_argument("--pages", nargs = "+", default = PAGES, help = "page scripts, relative to the repository root")
+    parser.add_argument("--repeat", type = int, default = 5, help = "fresh interpreters per page, the median is reported")
+    parser.add_argument("--top", type = int, default = 5, help = "slowest imports to list per page")
+    parser.add_argument("--budget-ms", type = float, default = 0.0, help = "exit with status 1 if a page takes longer than this")
+    args = parser.parse_args()
+
+    over_budget = []
+    for page in args.pages:
+        median = statistics.median(run_child(page)[0] for _ in range(args.repeat)) * 1000
+        status = ""
+        if args.budget_ms and median > args.budget_ms:
+            over_budget.append(page)
+            status = f"  over the {args.budget_ms:.0f} ms budget"
+        print(f"{page:<40}{median:>8.1f} ms{status}")
+        if args.top:
+            for ms, name in slowest_imports(run_child(page, importtime = True)[1], args.top):
+                print(f"    {ms:>8.1f} ms  {name}")
+
+    if over_budget:
+        print(f"{len(over_budget)} page(s) over budget: {', '.join(over_budget)}")
+        sys.exit(1)
@@ -0,0 +1,185 @@
+"""
+Load test for concurrent adjustments: several threads, each standing in for a terminal, adjust
+the same few items at the same time through adjust_item_amount (and, with --batch-share, through
+adjust_item_amounts) on a throwaway MySQL database like run_benchmarks.py.
+
+Afterwards every item's snapshot balance is checked against its starting balance plus every
+change that was reported as saved, and its new ledger rows are checked to form one unbroken
+chain (each row's amount_before_change is the previous row's amount_after_change). A lost
+update fails either check and the script exits with status 1. It reports adjustments per
+second, latencies and how many transactions were retried after a deadlock.
+Run from the repository root:
+    python benchmarks/load_test_adjustments.py --threads 8 --adjustments 200 --hot-skus 5
+"""
+import argparse
+import json
+import logging
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+from local_database import seed_database, throwaway_database
+from run_benchmarks import git_commit, quiet
+from synthetic_data import item_skus, make_items_table, make_ledger
+
+import inventory_control_db_config as db_config
+from inventory_control_db import execute_query, execute_read_query
+from inventory_control_metrics import configure_logging
+from inventory_control_stock import adjust_item_amount, adjust_item_amounts, get_stock_snapshot
+
+
+class RetryCounter(logging.Handler):
+    """Counts the retries run_in_transaction logs."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        if record.getMessage().startswith("Retrying"):
+            with self._lock:
+                self.retries += 1
+
+
+def terminal(number, args, hot_skus, start, applied, latencies, errors):
+    rng = random.Random(args.seed + number)
+    start.wait()
+    for _ in range(args.adjustments):
+        if rng.random() < args.batch_share:
+            batch = [(btn_sku, rng.randint(-5, 20), rng.randint(100, 5000), False)
+                     for btn_sku in rng.sample(hot_skus, min(args.pallet_size, len(hot_skus)))]
+        else:
+            batch = [(rng.choice(hot_skus), rng.randint(-5, 20), rng.randint(100, 5000), False)]
+        began = time.perf_counter()
+        try:
+            if len(batch) == 1:
+                adjust_item_amount(*batch[0])
+            else:
+                adjust_item_amounts(batch)
+        except Exception as err:
+            errors.append(repr(err))
+            continue
+        latencies.append(time.perf_counter() - began)
+        applied.extend(batch)
+
+
+def check_balances(hot_skus, before, applied, first_ledger_id):
+    """Problems found in the snapshot and ledger of every hot item, an empty list if none."""
+    problems = []
+    for btn_sku in hot_skus:
+        changes = [(change, units) for sku, change, units, _ in applied if sku == btn_sku]
+        expected_amount = before[btn_sku]['current_amount'] + sum(change for change, _ in changes)
+        expected_units = before[btn_sku]['total_units'] + sum(change * units for change, units in changes)
+        after = get_stock_snapshot(btn_sku)
+        if (after['current_amount'], after['total_units']) != (expected_amount, expected_units):
+            problems.append(f"{btn_sku}: snapshot has {after['current_amount']} boxes / {after['total_units']} units, "
+                            f"expected {expected_amount} / {expected_units}")
+
+        # Ledger ids follow the order the adjustments held the item's lock in
+        rows = execute_read_query("""
+        SELECT amount_before_change, Amount_Change, amount_after_change
+        FROM Current_Amount_Items
+        WHERE BTN_SKU = %s AND id >= %s
+        ORDER BY id;
+        """, (btn_sku, first_ledger_id)) or []
+        if len(rows) != len(changes):
+            problems.append(f"{btn_sku}: {len(rows)} new ledger rows for {len(changes)} saved adjustments")
+        amount = before[btn_sku]['current_amount']
+        for amount_before, change, amount_after in rows:
+            if amount_before != amount or amount_after != amount_before + change:
+                problems.append(f"{btn_sku}: ledger chain broken at {amount_before} -> {amount_after} (expected to start from {amount})")
+                break
+            amount = amount_after
+    return problems
+
+
+def run(args):
+    skus = item_skus(args.skus)
+    hot_skus = skus[:args.hot_skus]
+    items_df = make_items_table(args.skus, args.months, args.seed)
+    ledger_df = make_ledger(args.skus, args.ledger_depth, args.months, args.seed)
+
+    counter = RetryCounter()
+    logging.getLogger('inventory_control_db').addHandler(counter)
+    with throwaway_database(args.database, keep = args.keep):
+        with quiet():
+            seed_database(items_df, ledger_df)
+        if args.unseeded:
+            # The first adjustments of these items race to create their snapshot rows
+            placeholders = ", ".join(["%s"] * len(hot_skus))
+            execute_query(f"DELETE FROM Current_Stock_Snapshot WHERE BTN_SKU IN ({placeholders});", tuple(hot_skus))
+        before = {btn_sku: get_stock_snapshot(btn_sku) for btn_sku in hot_skus}
+        first_ledger_id = execute_read_query("SELECT COALESCE(MAX(id), 0) + 1 FROM Current_Amount_Items;")[0][0]
+
+        applied, latencies, errors = [], [], []
+        start = threading.Barrier(args.threads + 1)
+        threads = [threading.Thread(target = terminal, args = (number, args, hot_skus, start, applied, latencies, errors))
+                   for number in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        print(f"Running {args.threads} terminals x {args.adjustments} adjustments on {len(hot_skus)} items")
+        with quiet():
+            start.wait()
+            began = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - began
+
+        problems = check_balances(hot_skus, before, applied, first_ledger_id)
+    logging.getLogger('inventory_control_db').removeHandler(counter)
+
+    latencies.sort()
+    return {
+        'created': datetime.now().isoformat(timespec = 'seconds'),
+        'commit': git_commit(),
+        'config': {'threads': args.threads, 'adjustments': args.adjustments, 'hot_skus': len(hot_skus),
+                   'batch_share': args.batch_share, 'pallet_size': args.pallet_size, 'unseeded': args.unseeded,
+                   'pool_size': db_config.pool_size, 'seed': args.seed},
+        'seconds': seconds,
+        'transactions': len(latencies),
+        'adjustments': len(applied),
+        'adjustments_per_second': len(applied) / seconds if seconds > 0 else 0.0,
+        'median_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+        'deadlock_retries': counter.retries,
+        'errors': errors,
+        'problems': problems,
+    }
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Adjust the same items from many threads at once and check that no change is lost.")
+    parser.add_argument("--threads", type = int, default = 8, help = "concurrent terminals, more than DB_POOL_SIZE wait for a connection")
+    parser.add_argument("--adjustments", type = int, default = 200, help = "adjustments (or batches) per terminal")
+    parser.add_argument("--hot-skus", type = int, default = 5, help = "items every terminal adjusts, fewer means more contention")
+    parser.add_argument("--batch-share", type = float, default = 0.0, help = "share of operations that are adjust_item_amounts batches")
+    parser.add_argument("--pallet-size", type = int, default = 3, help = "items per batch")
+    parser.add_argument("--unseeded", action = "store_true", help = "start the hot items without snapshot rows")
+    parser.add_argument("--skus", type = int, default = 100, help = "number of synthetic items")
+    parser.add_argument("--months", type = int, default = 6, help = "months of items_table history")
+    parser.add_argument("--ledger-depth", type = int, default = 20, help = "adjustments per item in Current_Amount_Items")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic data and adjustments")
+    parser.add_argument("--database", default = "inventory_control_load_test", help = "name of the throwaway database")
+    parser.add_argument("--keep", action = "store_true", help = "keep the database afterwards")
+    parser.add_argument("--output", default = "load_test_adjustments.json", help = "JSON results file")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print(f"{results['adjustments']} adjustments in {results['transactions']} transactions, {results['seconds']:.2f} s "
+          f"({results['adjustments_per_second']:.0f} adjustments/second)")
+    if results['median_ms'] is not None:
+        print(f"Latency median {results['median_ms']:.1f} ms, p95 {results['p95_ms']:.1f} ms, {results['deadlock_retries']} deadlock retries")
+    for error in results['errors']:
+        print(f"Failed: {error}")
+    for problem in results['problems']:
+        print(f"Lost update: {problem}")
+    print(f"Results written to {args.output}")
+    if results['problems'] or results['errors']:
+        sys.exit(1)
@@ -0,0 +1,132 @@
+"""
+Throwaway MySQL database for the benchmarks.
+
+The data layer uses MySQL only SQL (ON DUPLICATE KEY UPDATE, window functions,
+information_schema, STR_TO_DATE), so the benchmarks run against a scratch database on a local
+MySQL server rather than an emulation of one. The server and credentials come from the same
+.env file as the app, the database is created with the pre-migration schema of items_table and
+Current_Amount_Items, seeded, migrated, and dropped again afterwards.
+
+A local server for benchmarking can be started with, for example:
+    docker run -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench mysql:8
+"""
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inventory_control_db_config as db_config  # noqa: E402
+from inventory_control_db import get_connection  # noqa: E402
+from inventory_control_migrations import apply_migrations  # noqa: E402
+from inventory_control_stock import rebuild_stock_snapshot  # noqa: E402
+
+# The tables as they were before inventory_control_migrations.py, the migrations add the rest,
+# including items_table.id and its period column, the way they do on an existing install
+BASE_SCHEMA = [
+    """
+    CREATE TABLE items_table (
+        BTN_SKU VARCHAR(50) NOT NULL,
+        Description VARCHAR(255),
+        item_type VARCHAR(100),
+        Count_Details VARCHAR(100),
+        Vendor VARCHAR(100),
+        Pallets INT DEFAULT 0,
+        Bundles_Boxes_Spools INT DEFAULT 0,
+        Units_Pieces_Each INT DEFAULT 0,
+        Month VARCHAR(20),
+        is_roll TINYINT(1) DEFAULT 0,
+        Spools TINYINT(1) DEFAULT 0,
+        Amount_Used_Monthly INT DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE Current_Amount_Items (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        BTN_SKU VARCHAR(50) NOT NULL,
+        Amount_Change INT NOT NULL,
+        amount_before_change INT NOT NULL,
+        units_per_box INT NOT NULL,
+        new_total_units BIGINT NOT NULL,
+        amount_after_change INT NOT NULL,
+        is_roll TINYINT(1) DEFAULT 0,
+        Change_Timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+]
+
+SEED_BATCH_SIZE = 2000
+
+
+def _server_connection():
+    return mysql.connector.connect(
+        host = db_config.host_name,
+        user = db_config.user_name,
+        passwd = db_config.user_password
+    )
+
+
+@contextmanager
+def throwaway_database(name, keep=False):
+    """
+    Create database name, point the app's connection pool at it for the duration of the block
+    and drop it afterwards unless keep is set. Refuses to touch the app's own database.
+    """
+    if name == db_config.db_name:
+        raise ValueError(f"Refusing to use the application database '{name}' for benchmarks")
+    server = _server_connection()
+    cursor = server.cursor()
+    store_dir = tempfile.mkdtemp(prefix = 'inventory_control_store_')
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{name}`;")
+        cursor.execute(f"CREATE DATABASE `{name}`;")
+        # The pool is created on first use, so it connects to the scratch database
+        db_config.db_name = name
+        # and the analytics copy of the scratch data stays out of the app's own store
+        db_config.analytics_store_dir = store_dir
+        with get_connection() as connection:
+            schema_cursor = connection.cursor()
+            try:
+                for statement in BASE_SCHEMA:
+                    schema_cursor.execute(statement)
+            finally:
+                schema_cursor.close()
+        yield name
+    finally:
+        if not keep:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`;")
+        shutil.rmtree(store_dir, ignore_errors = True)
+        cursor.close()
+        server.close()
+
+
+def insert_frame(table, df, batch_size=SEED_BATCH_SIZE):
+    """Insert every row of df into table (columns named like the frame) in batches."""
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype.kind == 'M':
+            df[column] = df[column].dt.strftime("%Y-%m-%d %H:%M:%S")
+    # Object dtype turns NumPy scalars into Python values, which the connector can bind
+    rows = df.astype(object).to_numpy().tolist()
+    query = f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({', '.join(['%s'] * len(df.columns))});"
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(query, rows[start:start + batch_size])
+            connection.commit()
+        finally:
+            cursor.close()
+    return len(rows)
+
+
+def seed_database(items_df, ledger_df):
+    """Load the synthetic data, then bring the schema up to date the way production is."""
+    insert_frame('items_table', items_df)
+    insert_frame('Current_Amount_Items', ledger_df)
+    apply_migrations()
+    rebuild_stock_snapshot()
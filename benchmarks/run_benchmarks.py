@@ -0,0 +1,292 @@
+"""
+Benchmarks for the hot paths of every page, run against a throwaway MySQL database filled
+with synthetic data (see local_database.py and synthetic_data.py).
+
+Scenarios:
+    fetch_data          dashboard month load, with an empty and with a warm query cache, and
+                        the memory its frame takes
+    comparison          monthly comparison for a small and a large selection of items/months,
+                        with the number of statements each run needs
+    usage_trend         quarterly usage per item type over the whole history, in one query
+    history             counting and paging through the adjustment history of one item
+    adjust_item_amount  single adjustments on random items
+    adjust_item_amounts the same number of adjustments applied as pallets of --pallet-size items
+    analytics_store     syncing the local analytics copy from scratch, when nothing changed, and
+                        the daily sync that checksums every month
+    forecast            loading the usage history and forecasting every item
+    excel_import        cleaning, validating and inserting a synthetic spreadsheet
+
+Results are written as JSON, and a previous results file can be passed to --compare to print
+the change in median time per scenario. Run from the repository root:
+    python benchmarks/run_benchmarks.py --skus 500 --months 24 --ledger-depth 100 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from local_database import seed_database, throwaway_database
+from synthetic_data import item_skus, make_items_table, make_ledger, make_sheet, month_periods
+
+from inventory_control_cache import query_cache
+from inventory_control_db import get_connection
+from inventory_control_forecast import forecast_usage
+from inventory_control_import import clean_dataframe, insert_data_from_excel, prepare_items_dataframe
+from inventory_control_metrics import configure_logging, registry
+from inventory_control_queries import (count_adjustment_history, fetch_adjustment_history_page, fetch_data,
+                                       fetch_monthly_comparison, fetch_usage_history, fetch_usage_trend, period_to_month)
+from inventory_control_stock import adjust_item_amount, adjust_item_amounts
+from inventory_control_store import rebuild as rebuild_store, sync as sync_store
+
+
+def measure(func, repeat, setup=None):
+    """Run func repeat times and return timing statistics in seconds, plus func's last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'runs': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+    }, result
+
+
+def statements_run():
+    """Statements executed so far in this process, from the query metrics."""
+    with registry._lock:
+        return sum(totals[0] for totals in registry.queries.values())
+
+
+@contextlib.contextmanager
+def quiet():
+    # The write paths print verification lines for every call
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_fetch_data(args, months):
+    latest = period_to_month(months[-1])
+    cold, df = measure(lambda: fetch_data(latest), args.repeat, setup = query_cache.clear)
+    cold['rows'] = len(df)
+    cold['bytes'] = int(df.memory_usage(deep = True).sum())
+    fetch_data(latest)
+    warm, _ = measure(lambda: fetch_data(latest), args.repeat)
+    return {'cold_cache': cold, 'warm_cache': warm}
+
+
+def bench_comparison(args, skus, months):
+    results = {}
+    selections = {
+        'small': (skus[:3], months[-3:]),
+        'large': (skus[:min(50, len(skus))], months[-min(24, len(months)):]),
+    }
+    for name, (items, periods) in selections.items():
+        month_years = [period_to_month(period) for period in periods]
+        before = statements_run()
+        stats, df = measure(lambda: fetch_monthly_comparison(items, month_years), args.repeat,
+                            setup = query_cache.clear)
+        stats.update({'items': len(items), 'months': len(month_years), 'rows': len(df),
+                      'queries_per_run': (statements_run() - before) / args.repeat})
+        results[name] = stats
+    return results
+
+
+def bench_usage_trend(args, months):
+    first_year, last_year = months[0].year, months[-1].year
+    before = statements_run()
+    stats, df = measure(lambda: fetch_usage_trend('item_type', first_year, last_year), args.repeat,
+                        setup = query_cache.clear)
+    stats.update({'years': last_year - first_year + 1, 'rows': len(df),
+                  'queries_per_run': (statements_run() - before) / args.repeat})
+    return stats
+
+
+def bench_history(args, skus):
+    btn_sku = skus[0]
+
+    def page_through():
+        pages, rows, cursor = 0, 0, None
+        while True:
+            page, cursor = fetch_adjustment_history_page(btn_sku, page_size = args.page_size, before = cursor)
+            pages += 1
+            rows += len(page)
+            if cursor is None:
+                return pages, rows
+
+    count, total = measure(lambda: count_adjustment_history(btn_sku), args.repeat)
+    first_page, _ = measure(lambda: fetch_adjustment_history_page(btn_sku, page_size = args.page_size), args.repeat)
+    all_pages, (pages, rows) = measure(page_through, args.repeat)
+    all_pages.update({'pages': pages, 'rows': rows})
+    return {'count': dict(count, total = total), 'first_page': first_page, 'all_pages': all_pages}
+
+
+def bench_adjustments(args, skus):
+    rng = random.Random(args.seed)
+    with quiet():
+        stats, _ = measure(lambda: adjust_item_amount(rng.choice(skus), rng.randint(-5, 20),
+                                                      rng.randint(100, 5000), rng.random() < 0.3),
+                           args.adjustments)
+    stats['adjustments_per_second'] = 1 / stats['mean']
+    return stats
+
+
+def bench_batch_adjustments(args, skus):
+    rng = random.Random(args.seed)
+    pallet_size = min(args.pallet_size, len(skus))
+
+    def pallet():
+        return [(btn_sku, rng.randint(-5, 20), rng.randint(100, 5000), rng.random() < 0.3)
+                for btn_sku in rng.sample(skus, pallet_size)]
+
+    with quiet():
+        stats, _ = measure(lambda: adjust_item_amounts(pallet()), max(1, args.adjustments // pallet_size))
+    stats['pallet_size'] = pallet_size
+    stats['adjustments_per_second'] = pallet_size / stats['mean']
+    return stats
+
+
+def bench_analytics_store(args):
+    full, changed = measure(rebuild_store, 1)
+    full['partitions'] = changed
+    incremental, _ = measure(sync_store, args.repeat)
+    checked, _ = measure(lambda: sync_store(full = True), args.repeat)
+    return {'full_sync': full, 'incremental_sync': incremental, 'checksum_sync': checked}
+
+
+def bench_forecast(args):
+    load, df = measure(lambda: fetch_usage_history(), args.repeat, setup = query_cache.clear)
+    load['rows'] = len(df)
+    fit, forecast = measure(lambda: forecast_usage(df, horizon = 3), args.repeat)
+    fit['items'] = forecast['BTN_SKU'].nunique()
+    return {'load': load, 'forecast': fit}
+
+
+def bench_excel_import(args, skus, months):
+    # A month after the synthetic history, so the inserted rows do not mix with it
+    next_month = period_to_month((pd.Timestamp(months[-1]) + pd.offsets.MonthBegin(1)).date())
+    sheet = make_sheet(args.import_rows, seed = args.seed, months = [next_month], skus = skus)
+
+    with quiet():
+        prepare, (valid, errors) = measure(lambda: prepare_items_dataframe(clean_dataframe(sheet)), 1)
+        with get_connection() as connection:
+            insert, report = measure(lambda: insert_data_from_excel(connection, valid, args.batch_size), 1)
+    insert.update({'rows': report['rows'], 'rows_per_second': report['rows_per_second']})
+    return {'prepare': dict(prepare, errors = len(errors)), 'insert': insert}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    skus = item_skus(args.skus)
+    months = month_periods(args.months)
+    print(f"Generating {args.skus} items x {args.months} months and {args.ledger_depth} adjustments per item")
+    items_df = make_items_table(args.skus, args.months, args.seed)
+    ledger_df = make_ledger(args.skus, args.ledger_depth, args.months, args.seed)
+
+    scenarios = {}
+    with throwaway_database(args.database, keep = args.keep):
+        with quiet():
+            seed_stats, _ = measure(lambda: seed_database(items_df, ledger_df), 1)
+        print(f"Seeded database '{args.database}' in {seed_stats['median']:.1f} s")
+
+        # Read scenarios first, the write scenarios change the data they read
+        benches = [
+            ('fetch_data', lambda: bench_fetch_data(args, months)),
+            ('comparison', lambda: bench_comparison(args, skus, months)),
+            ('usage_trend', lambda: bench_usage_trend(args, months)),
+            ('history', lambda: bench_history(args, skus)),
+            ('analytics_store', lambda: bench_analytics_store(args)),
+            ('forecast', lambda: bench_forecast(args)),
+            ('adjust_item_amount', lambda: bench_adjustments(args, skus)),
+            ('adjust_item_amounts', lambda: bench_batch_adjustments(args, skus)),
+            ('excel_import', lambda: bench_excel_import(args, skus, months)),
+        ]
+        for name, bench in benches:
+            if args.only and name not in args.only:
+                continue
+            print(f"Running {name}")
+            scenarios[name] = bench()
+
+    return {
+        'created': datetime.now().isoformat(timespec = 'seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'skus': args.skus, 'months': args.months, 'ledger_depth': args.ledger_depth,
+            'repeat': args.repeat, 'adjustments': args.adjustments, 'pallet_size': args.pallet_size, 'import_rows': args.import_rows,
+            'page_size': args.page_size, 'batch_size': args.batch_size, 'seed': args.seed,
+        },
+        'scenarios': scenarios,
+    }
+
+
+def _medians(node, prefix=''):
+    # Flattens {'scenario': {'case': {'median': ...}}} into {'scenario.case': median}
+    if 'median' in node:
+        return {prefix: node['median']}
+    medians = {}
+    for key, value in node.items():
+        if isinstance(value, dict):
+            medians.update(_medians(value, f"{prefix}.{key}" if prefix else key))
+    return medians
+
+
+def compare(baseline, results):
+    old, new = _medians(baseline['scenarios']), _medians(results['scenarios'])
+    print(f"{'scenario':<40}{'before':>12}{'after':>12}{'change':>10}")
+    for name in sorted(new):
+        if name in old and old[name] > 0:
+            print(f"{name:<40}{old[name] * 1000:>10.2f}ms{new[name] * 1000:>10.2f}ms{new[name] / old[name]:>9.2f}x")
+        else:
+            print(f"{name:<40}{'-':>12}{new[name] * 1000:>10.2f}ms{'new':>10}")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Benchmark the Inven Control hot paths on a throwaway MySQL database.")
+    parser.add_argument("--skus", type = int, default = 500, help = "number of synthetic items")
+    parser.add_argument("--months", type = int, default = 24, help = "months of items_table history")
+    parser.add_argument("--ledger-depth", type = int, default = 100, help = "adjustments per item in Current_Amount_Items")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs per read scenario")
+    parser.add_argument("--adjustments", type = int, default = 200, help = "adjustments made by adjust_item_amount")
+    parser.add_argument("--pallet-size", type = int, default = 20, help = "items per adjust_item_amounts batch")
+    parser.add_argument("--import-rows", type = int, default = 10000, help = "rows in the synthetic spreadsheet")
+    parser.add_argument("--page-size", type = int, default = 50, help = "adjustment history page size")
+    parser.add_argument("--batch-size", type = int, default = 500, help = "Excel import batch size")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic data")
+    parser.add_argument("--only", nargs = "+", help = "run only these scenarios")
+    parser.add_argument("--database", default = "inventory_control_bench", help = "name of the throwaway database")
+    parser.add_argument("--keep", action = "store_true", help = "keep the database afterwards")
+    parser.add_argument("--output", default = "bench_results.json", help = "JSON results file")
+    parser.add_argument("--compare", help = "previous JSON results file to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,120 @@
+"""
+Synthetic data for the benchmarks.
+
+Generates items_table month counts and Current_Amount_Items ledger rows for a configurable
+number of items, months of history and ledger depth, plus spreadsheets in the layout the
+Excel import expects. Everything is generated from a seed, so two runs with the same
+settings benchmark the same data.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+ITEM_TYPES = ['Chelan PLU', 'Borton PLU', 'Bags', 'Labels', 'Tape', 'Trays']
+VENDORS = ['Vendor A', 'Vendor B', 'Vendor C', 'Vendor D']
+FRUITS = ['Gala', 'Fuji', 'Honeycrisp', 'Granny Smith', 'Pink Lady', 'Cosmic Crisp', 'Bartlett', 'Anjou']
+PACKAGING = ['PLU Labels', 'Bag Labels', 'Poly Bags', 'Tray Pack', 'Box Liner', 'Carton Tape']
+
+
+def item_skus(skus):
+    return [f"BSKU-{n:05d}" for n in range(1, skus + 1)]
+
+
+def month_periods(months, end=None):
+    """The first day of each of the last months months, oldest first, ending at end's month."""
+    end = end or date.today()
+    return list(pd.date_range(end=pd.Timestamp(end.year, end.month, 1), periods=months, freq='MS').date)
+
+
+def make_items_table(skus=500, months=24, seed=0, end=None):
+    """One items_table row per item per month, Month as text like the pages write it."""
+    rng = np.random.default_rng(seed)
+    sku_list = item_skus(skus)
+    periods = month_periods(months, end)
+    rows = skus * months
+
+    # Item attributes are fixed per item, counts change month to month
+    is_roll = rng.random(skus) < 0.3
+    descriptions = [f"{fruit} {packaging} {n}" for n, (fruit, packaging) in
+                    enumerate(zip(rng.choice(FRUITS, skus), rng.choice(PACKAGING, skus)), start=1)]
+    base_usage = rng.integers(5, 200, skus)
+
+    def per_item(values):
+        return np.tile(np.asarray(values), months)
+
+    trend = np.repeat(np.arange(months), skus) * per_item(rng.normal(0.5, 1.0, skus))
+    usage = np.maximum(0, per_item(base_usage) + trend + rng.normal(0, 10, rows)).round().astype(int)
+    return pd.DataFrame({
+        'BTN_SKU': per_item(sku_list),
+        'Description': per_item(descriptions),
+        'item_type': per_item(rng.choice(ITEM_TYPES, skus)),
+        'Count_Details': per_item(np.where(is_roll, 'Rolls', 'Boxes')),
+        'Vendor': per_item(rng.choice(VENDORS, skus)),
+        'Pallets': rng.integers(0, 12, rows),
+        'Bundles_Boxes_Spools': rng.integers(0, 400, rows),
+        'Units_Pieces_Each': rng.integers(0, 100000, rows),
+        'Month': np.repeat([period.strftime("%B %Y") for period in periods], skus),
+        'is_roll': per_item(is_roll.astype(int)),
+        'Spools': per_item(is_roll.astype(int)),
+        'Amount_Used_Monthly': usage,
+    })
+
+
+def make_ledger(skus=500, depth=100, months=24, seed=0, end=None):
+    """
+    depth adjustments per item spread over the last months months, with running balances
+    (amount_before_change, amount_after_change, new_total_units) that add up like the app's.
+    """
+    rng = np.random.default_rng(seed + 1)
+    rows = skus * depth
+    sku_index = np.repeat(np.arange(skus), depth)
+
+    amount_change = rng.integers(-20, 60, rows)
+    units_per_box = np.repeat(rng.integers(100, 5000, skus), depth)
+    # Running totals restart for every item
+    amount_after = pd.Series(amount_change).groupby(sku_index).cumsum().to_numpy()
+    total_units = pd.Series(amount_change * units_per_box).groupby(sku_index).cumsum().to_numpy()
+
+    end = datetime.combine(end or date.today(), datetime.min.time())
+    span = int(timedelta(days=30 * months).total_seconds())
+    offsets = np.sort(rng.integers(0, span, (skus, depth)), axis=1).ravel()
+    timestamps = pd.to_datetime(end) - pd.to_timedelta(span - offsets, unit='s')
+
+    is_roll = np.repeat(rng.random(skus) < 0.3, depth).astype(int)
+    return pd.DataFrame({
+        'BTN_SKU': np.repeat(item_skus(skus), depth),
+        'Amount_Change': amount_change,
+        'amount_before_change': amount_after - amount_change,
+        'units_per_box': units_per_box,
+        'new_total_units': total_units,
+        'amount_after_change': amount_after,
+        'is_roll': is_roll,
+        'Change_Timestamp': timestamps,
+    })
+
+
+def make_sheet(rows, seed=0, months=None, skus=None):
+    """
+    A spreadsheet as uploaded on the Insert Monthly Data page, with the stray spaces and
+    "12 rolls" style counts the import has to clean up.
+    """
+    rng = np.random.default_rng(seed)
+    months = months or ['January 2024', 'February 2024', 'March 2024']
+    units = rng.integers(1, 500, rows).astype(str)
+    kinds = rng.choice([' boxes', ' rolls', ' spools', ' bundles', ''], rows)
+    if skus is None:
+        sku_values = pd.Series(rng.integers(1000, 9999, rows)).map(lambda n: f" BSKU-{n} ")
+    else:
+        sku_values = pd.Series(rng.choice(skus, rows)).map(lambda sku: f" {sku} ")
+    return pd.DataFrame({
+        'BTN_SKU': sku_values,
+        'Description': rng.choice(['Chelan PLU 4015 ', ' Gala PLU 4133', 'Fuji PLU 4131', 'Bag Labels'], rows),
+        'item_type': rng.choice(['Chelan PLU', 'Borton PLU', 'Bags'], rows),
+        'Count_Details': rng.choice(['Boxes', 'Rolls'], rows),
+        'Vendor': rng.choice(['Vendor A', 'Vendor B '], rows),
+        'Pallets': rng.integers(0, 10, rows),
+        'Bundles_Boxes_Spools': np.char.add(units, kinds),
+        'Units_Pieces_Each': rng.integers(0, 100000, rows),
+        'Month': rng.choice(months, rows),
+    })
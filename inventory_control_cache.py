@@ -0,0 +1,137 @@
+"""
+In-memory cache for dashboard read queries.
+
+Results are kept per server process with a TTL and a least recently used size bound. Every
+entry is tagged with the tables it reads, and the write paths call invalidate() with the
+tables they change after committing, so a user never sees an older result after their own
+write. A read that was running while a write committed is not stored, nor is one whose
+reader called do_not_cache().
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import inventory_control_db_config as db_config
+
+_MISSING = object()
+_local = threading.local()
+
+
+def _freeze(value):
+    # Cache keys have to be hashable, the readers take lists of SKUs and months
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def _copy(value):
+    # Pages add columns to the frames they get back, never hand out the cached object itself
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _is_empty(value):
+    if isinstance(value, pd.DataFrame):
+        return value.empty
+    return value is None or value == []
+
+
+class QueryCache:
+    """Thread safe LRU cache with a TTL whose entries are invalidated by table name."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, tables, value)
+        self._generations = {}  # table -> number of invalidations so far
+        self._lock = threading.Lock()
+
+    def generation(self, tables):
+        with self._lock:
+            return tuple(self._generations.get(table, 0) for table in tables)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, tables, generation, value):
+        with self._lock:
+            if generation != tuple(self._generations.get(table, 0) for table in tables):
+                return  # one of the tables was written while this result was being read
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, tables, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tables):
+        """Drop every entry that reads any of the given tables."""
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key, (_, entry_tables, _) in self._entries.items() if set(entry_tables) & set(tables)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+query_cache = QueryCache(db_config.cache_max_entries, db_config.cache_ttl)
+
+
+def cached_query(*tables):
+    """
+    Cache a read function's result by its arguments. tables are the tables the query reads,
+    used for invalidation. Empty results are not cached, so a failed read is retried.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, _freeze(args), _freeze(kwargs))
+            value = query_cache.get(key)
+            if value is not _MISSING:
+                return _copy(value)
+            generation = query_cache.generation(tables)
+            outer, _local.skip = getattr(_local, 'skip', False), False
+            try:
+                value = func(*args, **kwargs)
+            finally:
+                skip, _local.skip = _local.skip, outer or _local.skip
+            if not _is_empty(value) and not skip:
+                query_cache.set(key, tables, generation, value)
+            return _copy(value)
+        return wrapper
+    return decorator
+
+
+def do_not_cache():
+    """
+    Called from inside a cached read whose result must not be stored, such as one served from a
+    copy older than the last write; the cached reads it was called under are not stored either.
+    """
+    _local.skip = True
+
+
+def invalidate(*tables):
+    """Called by the write paths after they commit."""
+    query_cache.invalidate(*tables)
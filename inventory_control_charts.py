@@ -0,0 +1,140 @@
+"""
+Plotly figure builders for the dashboard charts.
+
+Hover text and styles are computed for all rows in one vectorized pass, the comparison chart
+switches to WebGL traces (Scattergl) once it has many points, and the per-item bar chart can be
+limited to the top items with the rest combined into one bar, so the figure sent to the browser
+stays small however large the catalogue gets. The usage trend and seasonality charts draw the
+quarterly and yearly totals of fetch_usage_trend.
+
+Plotly is imported by the builders themselves, so the pages only load it once they draw a chart.
+"""
+import numpy as np
+import pandas as pd
+
+from inventory_control_metrics import timed
+
+COLOR_PALETTE = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                 '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+WEBGL_POINT_THRESHOLD = 1000  # above this many points the comparison chart uses Scattergl
+
+
+@timed('plotly')
+def comparison_figure(df_results, selected_items, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """
+    Line chart of monthly counts per item from a MonthYear, Item, Value, IsRoll frame.
+    Items counted as rolls in any of the months get star markers and "Rolls" hover text.
+    """
+    import plotly.graph_objects as pg
+
+    df_results = df_results.copy()
+    item_is_roll = df_results.groupby('Item')['IsRoll'].transform('any').astype(bool)
+    unit = np.where(item_is_roll, "Rolls: ", "Bundles/Boxes: ")
+    df_results['HoverText'] = ("Item: " + df_results['Item'].astype(str)
+                               + "<br>Month/Year: " + df_results['MonthYear'].astype(str)
+                               + "<br>" + unit + df_results['Value'].astype(str))
+    df_results['ItemIsRoll'] = item_is_roll
+
+    scatter = pg.Scattergl if len(df_results) > webgl_threshold else pg.Scatter
+    groups = dict(tuple(df_results.groupby('Item', sort=False)))
+
+    fig = pg.Figure()
+    for position, item in enumerate(selected_items):
+        df_filtered = groups.get(item)
+        if df_filtered is None:
+            continue
+        is_roll = bool(df_filtered['ItemIsRoll'].iat[0])
+        color = COLOR_PALETTE[position % len(COLOR_PALETTE)]
+
+        # Add trace with custom hover text
+        fig.add_trace(scatter(
+            name = item,
+            x = df_filtered['MonthYear'],
+            y = df_filtered['Value'],
+            mode = 'lines+markers',
+            marker = dict(color = color, symbol = "star") if is_roll else dict(color = color),
+            line = dict(width = 3 if is_roll else 4),
+            text = df_filtered['HoverText'],
+            hoverinfo = 'text'
+        ))
+
+    fig.update_layout(
+        title = 'Monthly data comparison for selected item(s)',
+        xaxis_title = "Month/Year",
+        yaxis_title = "Bundles/Boxes/Spools",
+        height = 800,
+    )
+    fig.update_yaxes(tick0 = 0, dtick = 10)
+    return fig
+
+
+def top_items(df, top_n, group_rest=True, value_column='Bundles_Boxes_Spools'):
+    """
+    Keep the top_n rows by count. With group_rest the remaining rows are summed into one
+    "Other" bar per Count_Method, so the chart total still matches the month.
+    """
+    if top_n is None or len(df) <= top_n:
+        return df
+    ranked = df.sort_values(value_column, ascending=False)
+    top, rest = ranked.iloc[:top_n], ranked.iloc[top_n:]
+    if not group_rest or rest.empty:
+        return top
+    other = rest.groupby('Count_Method', as_index=False, observed=True).agg(
+        **{value_column: pd.NamedAgg(column=value_column, aggfunc='sum'),
+           'Items': pd.NamedAgg(column='Description', aggfunc='size')}
+    )
+    other['Description'] = "Other (" + other['Items'].astype(str) + " items)"
+    return pd.concat([top, other.drop(columns='Items')], ignore_index=True)
+
+
+@timed('plotly')
+def item_count_figure(df, title, top_n=None, group_rest=True):
+    """Bar chart of every item's count for a month, optionally limited to the top_n items."""
+    import plotly.express as px
+
+    fig_bar = px.bar(top_items(df, top_n, group_rest), x = 'Description', y = 'Bundles_Boxes_Spools', color = 'Count_Method',
+                     title = title,
+                     labels = {'Bundles_Boxes_Spools': 'Count'})
+    fig_bar.update_layout(height = 600, xaxis_tickangle = -45)
+    return fig_bar
+
+
+def _period_labels(df):
+    # "2024 Q1" per quarter, "2024" for yearly totals (quarter 0)
+    year = df['year'].astype(int).astype(str)
+    return year.where(df['quarter'] == 0, year + " Q" + df['quarter'].astype(int).astype(str))
+
+
+@timed('plotly')
+def usage_trend_figure(df, title):
+    """Line chart of usage over the years from a fetch_usage_trend frame, one line per group."""
+    import plotly.express as px
+
+    df = df.assign(Period = _period_labels(df))
+    fig = px.line(df, x = 'Period', y = 'used', color = 'group_key', markers = True,
+                  title = title,
+                  custom_data = ['previous_used', 'yoy_pct'],
+                  labels = {'used': 'Amount Used', 'group_key': ''})
+    fig.update_traces(hovertemplate = "%{x}<br>Used: %{y}<br>Year before: %{customdata[0]}<br>Change: %{customdata[1]}%<extra></extra>")
+    fig.update_layout(height = 600, xaxis_type = 'category')
+    return fig
+
+
+@timed('plotly')
+def seasonality_figure(df, title):
+    """
+    Quarterly usage from a fetch_usage_trend frame summed over its groups, with one line per
+    year drawn over the same Q1 to Q4 axis, so seasonal patterns of different years line up.
+    """
+    import plotly.express as px
+
+    by_quarter = df[df['quarter'] > 0].groupby(['year', 'quarter'], as_index = False)['used'].sum()
+    by_quarter['Quarter'] = "Q" + by_quarter['quarter'].astype(int).astype(str)
+    by_quarter['Year'] = by_quarter['year'].astype(int).astype(str)
+    fig = px.line(by_quarter, x = 'Quarter', y = 'used', color = 'Year', markers = True,
+                  title = title,
+                  category_orders = {'Quarter': ['Q1', 'Q2', 'Q3', 'Q4']},
+                  labels = {'used': 'Amount Used'})
+    fig.update_layout(height = 500)
+    return fig
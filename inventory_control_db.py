@@ -0,0 +1,260 @@
+"""
+Shared data access layer for Inven Control.
+
+Every page checks its connections out of one bounded MySQL connection pool that is created
+once per server process, instead of opening a new connection (TCP + auth handshake) on every
+Streamlit rerun. Pool size, checkout timeout and recycle age are read from
+inventory_control_db_config.py, which in turn reads the .env file. Connections are handed out
+wrapped by inventory_control_metrics, so every statement's latency and row count is recorded.
+
+The busiest parameterized queries run as server-side prepared statements (binary protocol).
+Each pooled connection keeps its statements prepared between checkouts, so the server parses
+them once per connection instead of on every execution.
+
+Write paths that lock rows run through run_in_transaction(), which retries the whole
+transaction when InnoDB picks it as a deadlock victim.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from mysql.connector import Error, pooling
+from mysql.connector.errors import DatabaseError, PoolError
+
+import inventory_control_db_config as db_config
+from inventory_control_metrics import InstrumentedConnection, InstrumentedCursor
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+# mysql-connector raises straight away when the pool is empty, this makes callers wait instead
+_pool_slots = threading.BoundedSemaphore(db_config.pool_size)
+# monotonic time each underlying connection was (re)connected, used for recycling
+_connected_at = {}
+# prepared statements of each underlying connection: id -> (server connection id, {(query, dictionary): (query, cursor)})
+_statements = {}
+
+ER_UNKNOWN_STMT_HANDLER = 1243  # the server no longer knows the statement, e.g. after a session reset
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213  # InnoDB rolled the transaction back to break a deadlock
+
+
+def get_pool():
+    """Create the process wide connection pool on first use and return it."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name = db_config.pool_name,
+                    pool_size = db_config.pool_size,
+                    # Resetting the session on return would deallocate the prepared statements
+                    pool_reset_session = not db_config.prepared_statements,
+                    host = db_config.host_name,
+                    user = db_config.user_name,
+                    passwd = db_config.user_password,
+                    database = db_config.db_name
+                )
+                logger.info("MySQL connection pool '%s' created with %s connections", db_config.pool_name, db_config.pool_size)
+    return _pool
+
+
+def _recycle_if_stale(connection):
+    # The pool pings every connection on checkout and reconnects dead ones. Connections older
+    # than pool_recycle are reconnected as well, so the server never drops one on wait_timeout.
+    cnx = connection._cnx
+    now = time.monotonic()
+    connected_at = _connected_at.get(id(cnx))
+    if connected_at is not None and now - connected_at > db_config.pool_recycle:
+        _statements.pop(id(cnx), None)  # prepared on the old session
+        cnx.reconnect(attempts = 3, delay = 1)
+        connected_at = None
+    if connected_at is None:
+        _connected_at[id(cnx)] = now
+
+
+@contextmanager
+def get_connection():
+    """
+    Check a healthy connection out of the pool and hand it back when the block exits.
+    Any open transaction is rolled back if the block raises.
+    """
+    if not _pool_slots.acquire(timeout = db_config.pool_timeout):
+        raise PoolError(f"No free connection in pool '{db_config.pool_name}' after {db_config.pool_timeout} seconds")
+    try:
+        connection = get_pool().get_connection()
+    except Error:
+        _pool_slots.release()
+        raise
+    try:
+        _recycle_if_stale(connection)
+        yield InstrumentedConnection(connection)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        _end_transaction(connection)
+        connection.close()  # returns the connection to the pool
+        _pool_slots.release()
+
+
+def _end_transaction(connection):
+    # Without a session reset a read left open here would keep its snapshot for the next
+    # checkout, so end it before the connection goes back to the pool
+    cnx = connection._cnx
+    if db_config.prepared_statements and cnx is not None:
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+        except Error as err:
+            logger.warning("Could not end the transaction of a returned connection: '%s'", err)
+
+
+def run_in_transaction(work, *args):
+    """
+    Run work(connection, *args) in one transaction on a pooled connection, commit it and return
+    what work returned. When the transaction is rolled back because of a deadlock or a lock wait
+    timeout it is run again from the start, up to DB_DEADLOCK_RETRIES times with a growing random
+    pause, so work must not have side effects outside the transaction.
+    """
+    for attempt in range(db_config.deadlock_retries + 1):
+        try:
+            with get_connection() as connection:
+                connection.start_transaction()
+                result = work(connection, *args)
+                connection.commit()
+                return result
+        except DatabaseError as err:
+            if err.errno not in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT) or attempt == db_config.deadlock_retries:
+                raise
+            logger.warning("Retrying %s after '%s' (retry %d of %d)", work.__name__, err, attempt + 1, db_config.deadlock_retries)
+            time.sleep(random.uniform(0, db_config.deadlock_backoff * 2 ** attempt))
+
+
+def _statement_cache(cnx):
+    entry = _statements.get(id(cnx))
+    if entry is None or entry[0] != cnx.connection_id:
+        # A new or reconnected session, statements prepared on the old one are gone
+        entry = (cnx.connection_id, OrderedDict())
+        _statements[id(cnx)] = entry
+    return entry[1]
+
+
+def _prepared_statement(cnx, query, dictionary):
+    statements = _statement_cache(cnx)
+    key = (query, dictionary)
+    statement = statements.get(key)
+    if statement is None:
+        statement = (query, cnx.cursor(prepared = True, dictionary = dictionary))
+        statements[key] = statement
+        if len(statements) > db_config.prepared_cache_size:
+            _, (_, evicted) = statements.popitem(last = False)
+            try:
+                evicted.close()  # deallocates the statement on the server
+            except Error:
+                pass
+    else:
+        statements.move_to_end(key)
+    return statement
+
+
+class PreparedCursor(InstrumentedCursor):
+    """
+    Cursor for one server-side prepared statement that stays prepared on its pooled connection.
+    close() keeps the statement for the next checkout instead of deallocating it.
+    """
+
+    def __init__(self, cnx, query, dictionary=False):
+        self._cnx = cnx
+        self._key = (query, dictionary)
+        # The connector only skips preparing when it is given the very string it prepared
+        self._query, cursor = _prepared_statement(cnx, query, dictionary)
+        super().__init__(cursor)
+
+    def execute(self, query, params=None):
+        try:
+            return super().execute(self._query, params)
+        except DatabaseError as err:
+            if err.errno != ER_UNKNOWN_STMT_HANDLER:
+                raise
+            # Prepare it again on the current session and retry once
+            _statement_cache(self._cnx).pop(self._key, None)
+            self._query, self._cursor = _prepared_statement(self._cnx, *self._key)
+            return super().execute(self._query, params)
+
+    def close(self):
+        self._finish()
+
+
+def prepared_cursor(connection, query, dictionary=False):
+    """
+    Cursor that runs query as a server-side prepared statement on connection (from
+    get_connection). Execute it with the same query text and close it as usual. Falls back to
+    a plain cursor when DB_PREPARED_STATEMENTS is off.
+    """
+    if not db_config.prepared_statements:
+        return connection.cursor(dictionary = dictionary)
+    return PreparedCursor(connection._cnx, query, dictionary)
+
+
+def _cursor(connection, query, dictionary=False, prepared=False):
+    if prepared:
+        return prepared_cursor(connection, query, dictionary)
+    return connection.cursor(dictionary = dictionary)
+
+
+def execute_read_query(query, params=None, dictionary=False, prepared=False):
+    """
+    Run a SELECT on a pooled connection and return all rows, or None if the query fails.
+    prepared runs it as a server-side prepared statement, for queries that run over and over.
+    """
+    try:
+        with get_connection() as connection:
+            cursor = _cursor(connection, query, dictionary, prepared)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+    except Error as err:
+        logger.error("Error: '%s'", err)
+        return None
+
+
+def execute_query(query, params=None, prepared=False):
+    """Run a single INSERT/UPDATE/DELETE on a pooled connection and commit it. Returns True on success."""
+    try:
+        with get_connection() as connection:
+            cursor = _cursor(connection, query, prepared = prepared)
+            try:
+                cursor.execute(query, params)
+                connection.commit()
+                return True
+            finally:
+                cursor.close()
+    except Error as err:
+        logger.error("Error: '%s'", err)
+        return False
+
+
+def fetch_dataframe(query, params=None, prepared=False):
+    """Run a SELECT and return the rows as a DataFrame, empty if the query fails."""
+    # pandas is imported on first use, the pages that only run plain queries start without it
+    import pandas as pd
+
+    try:
+        with get_connection() as connection:
+            cursor = _cursor(connection, query, prepared = prepared)
+            try:
+                cursor.execute(query, params)
+                columns = [column[0] for column in cursor.description]
+                return pd.DataFrame(cursor.fetchall(), columns = columns)
+            finally:
+                cursor.close()
+    except Error as err:
+        logger.error("Error: '%s'", err)
+        return pd.DataFrame()
@@ -7,3 +7,31 @@ host_name = os.getenv('DB_HOST')
 user_name = os.getenv('DB_USER')
 user_password = os.getenv('DB_PASS')
 db_name = os.getenv('DB_NAME')
+
+# Connection pool settings shared by every page
+pool_name = os.getenv('DB_POOL_NAME', 'inventory_control_pool')
+pool_size = int(os.getenv('DB_POOL_SIZE', '5'))  # mysql-connector allows at most 32
+pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # seconds to wait for a free connection
+pool_recycle = int(os.getenv('DB_POOL_RECYCLE', '3600'))  # seconds, keep below the server's wait_timeout
+# Server-side prepared statements, kept open per pooled connection for the busiest queries
+prepared_statements = os.getenv('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+prepared_cache_size = int(os.getenv('DB_PREPARED_CACHE_SIZE', '64'))  # statements per connection, keep total below max_prepared_stmt_count
+# Write transactions that lose a deadlock (or time out waiting for a row lock) are retried
+deadlock_retries = int(os.getenv('DB_DEADLOCK_RETRIES', '5'))
+deadlock_backoff = float(os.getenv('DB_DEADLOCK_BACKOFF', '0.05'))  # seconds, doubled after every retry
+
+# Dashboard sections are read in parallel on this many threads, each with its own pooled connection
+loader_workers = int(os.getenv('LOADER_WORKERS', str(min(4, pool_size))))
+
+# Query result cache for dashboard reads
+cache_ttl = int(os.getenv('CACHE_TTL', '300'))  # seconds an entry is served before it is read again
+cache_max_entries = int(os.getenv('CACHE_MAX_ENTRIES', '256'))  # least recently used entries are evicted past this
+
+# Local Arrow copy of the history that the analytics views read instead of MySQL
+analytics_store_dir = os.getenv('ANALYTICS_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics_store'))
+analytics_sync_seconds = int(os.getenv('ANALYTICS_SYNC_SECONDS', str(cache_ttl)))  # seconds before the copy is checked against MySQL again
+analytics_full_sync_seconds = int(os.getenv('ANALYTICS_FULL_SYNC_SECONDS', '86400'))  # seconds between syncs that compare every month, to pick up deleted rows
+
+# Query metrics and logging
+metrics_port = int(os.getenv('METRICS_PORT', '0'))  # serve Prometheus text metrics on this port, 0 turns it off
+log_level = os.getenv('LOG_LEVEL', 'WARNING')  # DEBUG logs every statement with its latency
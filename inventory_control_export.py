@@ -0,0 +1,225 @@
+"""
+Streaming export of the items_table month counts and the Current_Amount_Items ledger.
+
+Rows are read from an unbuffered cursor, so the server sends them as they are fetched, in
+chunks of EXPORT_CHUNK_ROWS, and every chunk is written to the output file before the next one
+is read. Memory use stays the same whether the export holds a month or ten years; no DataFrame
+of the whole result is ever built. Exports can be limited to a date range (period for the
+month counts, Change_Timestamp for the ledger), a list of BTN_SKUs and a list of item types,
+and are written as CSV, Excel (split over several sheets past Excel's row limit) or Parquet
+(one row group per chunk).
+
+The Export Data page uses this module, and full-year dumps can be written without the app:
+    python inventory_control_export.py Current_Amount_Items --start 2024-01-01 --end 2024-12-31 --format csv --output ledger_2024.csv
+"""
+import argparse
+import csv
+import datetime
+import sys
+
+from mysql.connector import Error
+
+from inventory_control_db import execute_read_query, get_connection
+from inventory_control_metrics import configure_logging
+
+# Columns as (name, pyarrow type name), pyarrow is only imported by the Parquet writer
+EXPORTS = {
+    'items_table': {
+        'columns': [
+            ('id', 'int64'), ('BTN_SKU', 'string'), ('Description', 'string'), ('item_type', 'string'),
+            ('Count_Details', 'string'), ('Vendor', 'string'), ('Pallets', 'int64'),
+            ('Bundles_Boxes_Spools', 'int64'), ('Units_Pieces_Each', 'int64'), ('Month', 'string'),
+            ('is_roll', 'int8'), ('Spools', 'int8'), ('Amount_Used_Monthly', 'int64'), ('period', 'date32'),
+        ],
+        # idx_items_period_sku returns the rows in this order, the server never sorts them
+        'order_by': 'period, BTN_SKU, id',
+    },
+    'Current_Amount_Items': {
+        'columns': [
+            ('id', 'int64'), ('BTN_SKU', 'string'), ('Amount_Change', 'int64'), ('amount_before_change', 'int64'),
+            ('units_per_box', 'int64'), ('new_total_units', 'int64'), ('amount_after_change', 'int64'),
+            ('is_roll', 'int8'), ('Change_Timestamp', 'timestamp[s]'),
+        ],
+        'order_by': 'id',
+    },
+}
+FORMATS = {'csv': '.csv', 'xlsx': '.xlsx', 'parquet': '.parquet'}
+EXPORT_CHUNK_ROWS = 10000
+EXCEL_MAX_ROWS = 1048576  # per sheet, including the header row
+# What export() raises when the rows cannot be read or the file cannot be written
+EXPORT_ERRORS = (Error, OSError, ValueError)
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _export_filters(table, start_date, end_date, btn_skus, item_types):
+    conditions, params = [], []
+    if table == 'items_table':
+        if start_date:
+            conditions.append("period >= %s")
+            params.append(start_date.replace(day = 1))  # the month start_date falls in
+        if end_date:
+            conditions.append("period <= %s")
+            params.append(end_date)
+    else:
+        if start_date:
+            conditions.append("Change_Timestamp >= %s")
+            params.append(start_date)
+        if end_date:
+            conditions.append("Change_Timestamp < %s")  # end date is inclusive
+            params.append(end_date + datetime.timedelta(days = 1))
+    if btn_skus:
+        conditions.append(f"BTN_SKU IN ({_placeholders(btn_skus)})")
+        params.extend(btn_skus)
+    if item_types:
+        if table == 'items_table':
+            conditions.append(f"item_type IN ({_placeholders(item_types)})")
+        else:
+            # The ledger has no item_type, take it from the items' counts
+            conditions.append(f"BTN_SKU IN (SELECT BTN_SKU FROM items_table WHERE item_type IN ({_placeholders(item_types)}))")
+        params.extend(item_types)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, tuple(params)
+
+
+def count_export_rows(table, start_date=None, end_date=None, btn_skus=None, item_types=None):
+    """Number of rows an export with these filters holds, used for its progress."""
+    where, params = _export_filters(table, start_date, end_date, btn_skus, item_types)
+    result = execute_read_query(f"SELECT COUNT(*) FROM {table} {where};", params)
+    return result[0][0] if result else 0
+
+
+def export_rows(table, start_date=None, end_date=None, btn_skus=None, item_types=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Yield the rows of table that match the filters as lists of up to chunk_size tuples, in the
+    column order of EXPORTS[table]. The rows are streamed from the server on a pooled connection
+    that is held until the generator is exhausted or closed.
+    """
+    names = [name for name, _ in EXPORTS[table]['columns']]
+    where, params = _export_filters(table, start_date, end_date, btn_skus, item_types)
+    query = f"SELECT {', '.join(names)} FROM {table} {where} ORDER BY {EXPORTS[table]['order_by']};"
+    with get_connection() as connection:
+        # Unbuffered, so only the chunk being written is held in memory
+        cursor = connection.cursor(buffered = False)
+        finished = False
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    finished = True
+                    break
+                yield rows
+        finally:
+            if not finished:
+                # Stopped early, the rest of the result has to be read before the connection is reused
+                connection.consume_results()
+            cursor.close()
+
+
+def write_csv(chunks, path, columns):
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+def write_xlsx(chunks, path, columns):
+    # openpyxl is only needed for Excel exports, it is the engine pandas reads the uploads with
+    from openpyxl import Workbook
+    from openpyxl.utils.exceptions import IllegalCharacterError
+
+    # A write-only workbook streams its rows to a temporary file instead of keeping them as cells
+    workbook = Workbook(write_only = True)
+    header = [name for name, _ in columns]
+    sheet, sheet_rows = None, EXCEL_MAX_ROWS
+    for rows in chunks:
+        for row in rows:
+            if sheet_rows == EXCEL_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Export {len(workbook.worksheets) + 1}")
+                sheet.append(header)
+                sheet_rows = 1
+            try:
+                sheet.append(row)
+            except IllegalCharacterError as err:
+                btn_sku = row[header.index('BTN_SKU')]
+                raise ValueError(f"A row of {btn_sku} holds a character Excel cannot store, export it as CSV or Parquet") from err
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet("Export 1").append(header)
+    workbook.save(path)
+
+
+def write_parquet(chunks, path, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Every chunk becomes one row group, an export without rows still has the schema
+    schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in columns])
+    try:
+        with pq.ParquetWriter(path, schema) as writer:
+            for rows in chunks:
+                values = list(zip(*rows))
+                writer.write_table(pa.table([pa.array(column, type = field.type)
+                                             for column, field in zip(values, schema)], schema = schema))
+    except pa.ArrowException as err:
+        if isinstance(err, EXPORT_ERRORS):
+            raise  # ArrowInvalid is a ValueError, ArrowIOError an OSError
+        raise ValueError(f"The rows cannot be written as Parquet: {err}") from err
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+
+
+def export(table, path, file_format, start_date=None, end_date=None, btn_skus=None, item_types=None,
+           chunk_size=EXPORT_CHUNK_ROWS, progress=None):
+    """
+    Write the rows of table that match the filters to path as 'csv', 'xlsx' or 'parquet'.
+    progress(rows_written, total_rows) is called before the first chunk and after every chunk.
+    Returns the number of rows written. Raises one of EXPORT_ERRORS when it fails, path may then
+    hold a partly written file.
+    """
+    if table not in EXPORTS:
+        raise ValueError(f"Unknown export table '{table}'")
+    if file_format not in WRITERS:
+        raise ValueError(f"Unknown export format '{file_format}'")
+    total = count_export_rows(table, start_date, end_date, btn_skus, item_types) if progress else 0
+    written = 0
+
+    def chunks():
+        nonlocal written
+        if progress:
+            progress(written, total)
+        for rows in export_rows(table, start_date, end_date, btn_skus, item_types, chunk_size):
+            yield rows
+            # The writer asks for the next chunk once this one is written
+            written += len(rows)
+            if progress:
+                progress(written, max(total, written))
+
+    WRITERS[file_format](chunks(), path, EXPORTS[table]['columns'])
+    return written
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Export month counts or the adjustment ledger without loading them into memory.")
+    parser.add_argument("table", choices = list(EXPORTS), help = "table to export")
+    parser.add_argument("--start", type = datetime.date.fromisoformat, help = "first date, YYYY-MM-DD")
+    parser.add_argument("--end", type = datetime.date.fromisoformat, help = "last date (inclusive), YYYY-MM-DD")
+    parser.add_argument("--sku", nargs = "+", help = "only these BTN_SKUs")
+    parser.add_argument("--item-type", nargs = "+", help = "only items of these types")
+    parser.add_argument("--format", choices = list(FORMATS), default = "csv", help = "output format")
+    parser.add_argument("--chunk-size", type = int, default = EXPORT_CHUNK_ROWS, help = "rows fetched and written at a time")
+    parser.add_argument("--output", required = True, help = "file to write")
+    args = parser.parse_args()
+
+    def report(written, total):
+        print(f"\r{written:,} of {total:,} rows", end = "", file = sys.stderr, flush = True)
+
+    rows = export(args.table, args.output, args.format, args.start, args.end, args.sku, args.item_type,
+                  args.chunk_size, report)
+    print(f"\nExported {rows:,} rows to {args.output}", file = sys.stderr)
@@ -0,0 +1,74 @@
+"""
+Compact column types for the frames the pages keep in memory.
+
+A cursor hands back plain Python values, so every text column of a frame built from it is an
+object column holding one string per row, even though Description, item_type, Vendor,
+Count_Details and Month repeat the same few values month after month. apply_schema turns
+those into category columns, downcasts the integer columns to the smallest type that holds
+their values and the 0/1 flags to bool. memory_report shows what that saves per column.
+"""
+import pandas as pd
+
+# column -> 'category', 'integer' or 'bool'
+ITEMS_TABLE_SCHEMA = {
+    'BTN_SKU': 'category',
+    'Description': 'category',
+    'item_type': 'category',
+    'Count_Details': 'category',
+    'Vendor': 'category',
+    'Month': 'category',
+    'id': 'integer',
+    'Pallets': 'integer',
+    'Bundles_Boxes_Spools': 'integer',
+    'Units_Pieces_Each': 'integer',
+    'Amount_Used_Monthly': 'integer',
+    'is_roll': 'bool',
+    'Spools': 'bool',
+}
+
+USAGE_HISTORY_SCHEMA = {
+    'BTN_SKU': 'category',
+    'Description': 'category',
+    'Amount_Used_Monthly': 'integer',
+}
+
+COUNT_METHODS = ['Bundles/Boxes', 'Rolls']
+
+
+def apply_schema(df, schema):
+    """Return df with the columns named in schema converted, columns it does not have are skipped."""
+    df = df.copy()
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        if kind == 'category':
+            df[column] = df[column].astype('category')
+        elif kind == 'integer':
+            # Columns with NULLs stay float, the integer types cannot hold NaN
+            df[column] = pd.to_numeric(df[column], downcast = 'integer')
+        elif kind == 'bool':
+            df[column] = df[column].fillna(0).astype(bool)
+        else:
+            raise ValueError(f"Unknown column kind '{kind}' for {column}")
+    return df
+
+
+def count_method(is_roll):
+    """'Rolls' or 'Bundles/Boxes' for every row of an is_roll column, as a category column."""
+    return pd.Categorical.from_codes(is_roll.fillna(0).astype('int8'), categories = COUNT_METHODS)
+
+
+def memory_report(before, after):
+    """
+    Deep memory use of every column of two versions of a frame, with its dtype before and after
+    and how many times smaller it got, plus a Total row.
+    """
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.reindex(before.columns).astype(str),
+        'bytes_before': before.memory_usage(index = False, deep = True),
+        'bytes_after': after.memory_usage(index = False, deep = True).reindex(before.columns),
+    })
+    report.loc['Total'] = ['', '', report['bytes_before'].sum(), report['bytes_after'].sum()]
+    report['factor'] = (report['bytes_before'] / report['bytes_after']).round(1)
+    return report
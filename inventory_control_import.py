@@ -0,0 +1,261 @@
+"""
+Spreadsheet import for items_table, used by the Insert Monthly Data page, the whole month
+count grid of the New End of Month Count page, and parsing of the batch adjustments (a grid or
+a CSV) used by the Add or Remove Item page.
+
+Rows are written with batched executemany calls (mysql-connector turns each batch into one
+multi-row INSERT) inside a single transaction, so an import either lands completely or not at all.
+The Monthly_Usage roll-up is refreshed from the earliest inserted month in the same transaction.
+"""
+import logging
+import time
+from typing import Dict, Tuple
+
+import pandas as pd
+from mysql.connector import MySQLConnection
+
+from inventory_control_cache import invalidate
+from inventory_control_usage import refresh_monthly_usage
+
+logger = logging.getLogger(__name__)
+
+ITEMS_TABLE_IMPORT_COLUMNS = ['BTN_SKU', 'Description', 'item_type', 'Count_Details', 'Vendor', 'Pallets',
+                              'Bundles_Boxes_Spools', 'Units_Pieces_Each', 'Month', 'period', 'Spools']
+
+DEFAULT_BATCH_SIZE = 500
+
+ADJUSTMENT_COLUMNS = ['BTN_SKU', 'Amount_Change', 'units_per_box', 'is_roll']
+
+MONTH_COUNT_COLUMNS = ['BTN_SKU', 'Description', 'item_type', 'Count_Details', 'Vendor', 'Pallets',
+                       'Bundles_Boxes_Spools', 'Units_Pieces_Each', 'Month', 'period', 'is_roll']
+# (column, label, largest value) of the counted numbers, the same limits as the single item form
+MONTH_COUNT_NUMBERS = [('Pallets', 'Pallets', 10), ('Units_Pieces_Each', 'Units/Pieces Each', 1000000000),
+                       ('Bundles_Boxes_Spools', 'Bundles/Boxes/Spools', 10000)]
+MONTH_COUNT_TEXT = [('Description', 'Description'), ('item_type', 'Type'), ('Count_Details', 'Count Details'), ('Vendor', 'Vendor')]
+
+_TRUE_TEXT = {'1', '1.0', 'true', 'yes', 'y', 'roll', 'rolls'}
+_FALSE_TEXT = {'', '0', '0.0', 'false', 'no', 'n', 'nan', 'none', 'box', 'boxes'}
+
+
+class _ErrorReport:
+    """
+    Problems found while validating a frame, one (row, column, value, error) entry per bad
+    cell with rows numbered from first_row. first_only keeps only the first problem of a row.
+    """
+
+    def __init__(self, df: pd.DataFrame, first_row: int, first_only: bool = False):
+        self.df = df
+        self.first_row = first_row
+        self.first_only = first_only
+        self.bad_rows = pd.Series(False, index=df.index)
+        self.problems = []
+
+    def add(self, mask, column, error):
+        if self.first_only:
+            mask = mask & ~self.bad_rows
+        if mask.any():
+            self.bad_rows |= mask
+            self.problems.append(pd.DataFrame({
+                'Row': self.df.index[mask] + self.first_row,
+                'Column': column,
+                'Value': self.df.loc[mask, column].astype(str),
+                'Error': error,
+            }))
+
+    def frame(self) -> pd.DataFrame:
+        if self.problems:
+            return pd.concat(self.problems, ignore_index=True).sort_values(['Row', 'Column'], ignore_index=True)
+        return pd.DataFrame(columns=['Row', 'Column', 'Value', 'Error'])
+
+
+def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if values.dtype != object and not pd.api.types.is_string_dtype(values):
+            continue  # already numeric, boolean or dates
+
+        # Strip leading/trailing spaces from string cells, other cells are left as they are
+        if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'mixed', 'mixed-integer'):
+            values = values.str.strip().fillna(values)
+
+        # Convert numerical columns to appropriate types, only if every value is a number
+        numbers = pd.to_numeric(values, errors='coerce')
+        df[col] = numbers if numbers.notna().sum() == values.notna().sum() else values
+
+    return df
+
+
+def prepare_items_dataframe(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Normalize a cleaned sheet for items_table. Returns the rows that parsed and an error
+    report (sheet row, column, value, error) for the rows that did not.
+    """
+    missing_columns = [col for col in ITEMS_TABLE_IMPORT_COLUMNS if col not in df.columns and col not in ('period', 'Spools')]
+    if missing_columns:
+        raise ValueError(f"Missing columns in the uploaded file: {', '.join(missing_columns)}")
+
+    df = df.reset_index(drop=True)
+    errors = _ErrorReport(df, 2)  # sheet rows, the header is row 1
+    report = errors.add
+
+    for col in ['BTN_SKU', 'Month']:
+        report(df[col].isna() | (df[col].astype(str).str.strip() == ''), col, "Value is required")
+
+    # Month is stored as text for display and as the first day of the month in period
+    if pd.api.types.is_datetime64_any_dtype(df['Month']):
+        periods = df['Month'].dt.to_period('M').dt.to_timestamp()
+    else:
+        periods = pd.to_datetime(df['Month'].astype(str).str.strip(), format='%B %Y', errors='coerce')
+        report(df['Month'].notna() & periods.isna(), 'Month', "Not a month such as January 2024")
+    df['Month'] = periods.dt.strftime('%B %Y')
+    df['period'] = periods.dt.date
+
+    for col in ['Pallets', 'Units_Pieces_Each']:
+        numbers = pd.to_numeric(df[col], errors='coerce')
+        report(df[col].notna() & numbers.isna(), col, "Not a number")
+        df[col] = numbers.fillna(0)
+
+    # Bundles_Boxes_Spools holds text such as "12 rolls", keep the number and flag spools/rolls
+    counts = df['Bundles_Boxes_Spools'].fillna(0).astype(str).str.lower()
+    df['Spools'] = counts.str.contains('spools|roll', regex=True).astype(int)
+    numbers = counts.str.extract(r'(\d+)', expand=False)
+    report(numbers.isna(), 'Bundles_Boxes_Spools', "No count found")
+    df['Bundles_Boxes_Spools'] = pd.to_numeric(numbers).fillna(0).astype(int)
+
+    # replace the remaining NaN values with 0 as before
+    for col in ['Description', 'item_type', 'Count_Details', 'Vendor']:
+        df[col] = df[col].astype(object).where(df[col].notna(), 0)
+
+    return df[~errors.bad_rows], errors.frame()
+
+
+def prepare_adjustments_dataframe(df: pd.DataFrame, known_skus, first_row: int = 2) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate batch adjustments with the ADJUSTMENT_COLUMNS for adjust_item_amounts. Returns
+    the rows that are valid and an error report (row, column, value, error) like
+    prepare_items_dataframe, rows numbered from first_row (2 for a CSV with a header row).
+    """
+    missing_columns = [col for col in ADJUSTMENT_COLUMNS if col not in df.columns and col != 'is_roll']
+    if missing_columns:
+        raise ValueError(f"Missing columns in the adjustments: {', '.join(missing_columns)}")
+
+    df = df.reset_index(drop=True)
+    if 'is_roll' not in df.columns:
+        df['is_roll'] = False
+    errors = _ErrorReport(df, first_row, first_only=True)
+    report = errors.add
+
+    skus = df['BTN_SKU'].astype('string').str.strip()
+    report(skus.isna() | (skus == ''), 'BTN_SKU', "Value is required")
+    report(skus.notna() & (skus != '') & ~skus.isin(list(known_skus)), 'BTN_SKU', "Unknown BTN_SKU")
+    report(skus.duplicated(keep=False) & skus.notna(), 'BTN_SKU', "Listed more than once, combine these rows")
+    df['BTN_SKU'] = skus
+
+    for col, minimum, error in [('Amount_Change', None, "Must be a whole number other than 0"),
+                                ('units_per_box', 1, "Must be a whole number of at least 1")]:
+        numbers = pd.to_numeric(df[col], errors='coerce')
+        invalid = numbers.isna() | (numbers.mod(1) != 0)
+        invalid |= (numbers == 0) if minimum is None else (numbers < minimum)
+        report(invalid, col, error)
+        df[col] = numbers.where(~invalid, 0).astype(int)
+
+    roll_text = df['is_roll'].astype(str).str.strip().str.lower()
+    report(~roll_text.isin(_TRUE_TEXT | _FALSE_TEXT), 'is_roll', "Not yes or no")
+    df['is_roll'] = roll_text.isin(_TRUE_TEXT)
+
+    return df.loc[~errors.bad_rows, ADJUSTMENT_COLUMNS], errors.frame()
+
+
+def validate_month_counts(df: pd.DataFrame, first_row: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Check every row of the month count grid with the rules of the single item form, all rows at
+    once. Returns the valid rows and an error report like prepare_items_dataframe, with the
+    same messages the form shows. Rows keep their grid position: row = index + first_row.
+    """
+    df = df.copy()
+    errors = _ErrorReport(df, first_row)
+
+    for col, label in MONTH_COUNT_TEXT:
+        text = df[col].astype('string').str.strip()
+        errors.add(text.isna() | (text == ''), col, f"{label} cannot be empty.")
+
+    for col, label, largest in MONTH_COUNT_NUMBERS:
+        numbers = pd.to_numeric(df[col], errors='coerce')
+        errors.add(numbers.isna() | (numbers.mod(1) != 0), col, f"{label} must be a whole number.")
+        errors.add(numbers < 0, col, f"{label} cannot be negative.")
+        errors.add(numbers > largest, col, f"{label} is too large.")
+        df[col] = numbers.fillna(0).astype(int)
+
+    return df[~errors.bad_rows], errors.frame()
+
+
+def _insert_rows(connection: MySQLConnection, query: str, rows, batch_size: int, from_period) -> Dict[str, float]:
+    # One transaction, batch_size rows per executemany, nothing is kept if any batch fails
+    start = time.perf_counter()
+    cursor = connection.cursor()
+    try:
+        connection.start_transaction()
+        for offset in range(0, len(rows), batch_size):
+            cursor.executemany(query, rows[offset:offset + batch_size])
+        if rows:
+            # Only the imported items have new counts, BTN_SKU is the first column of every insert
+            refresh_monthly_usage(connection, from_period, sorted({row[0] for row in rows}))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    seconds = time.perf_counter() - start
+    invalidate('items_table', 'Monthly_Usage')
+
+    logger.info("Inserted %d rows in %.2f seconds", len(rows), seconds)
+    return {
+        'rows': len(rows),
+        'seconds': seconds,
+        'rows_per_second': len(rows) / seconds if seconds > 0 else 0.0,
+    }
+
+
+def insert_data_from_excel(connection: MySQLConnection, df: pd.DataFrame,
+                           batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, float]:
+    """
+    Insert every row of an uploaded sheet into items_table in one transaction, batch_size rows
+    per round-trip. Nothing is kept if any batch fails, the error is raised to the caller.
+    Raises ValueError without writing anything if any row fails to parse.
+    Returns the number of rows written, the seconds spent and the rows per second.
+    """
+    df, errors = prepare_items_dataframe(df)
+    if not errors.empty:
+        raise ValueError(f"{errors['Row'].nunique()} rows could not be parsed, nothing was inserted")
+
+    # insert data query, matching the columns to the DataFrame's columns
+    query = """
+    INSERT INTO items_table (BTN_SKU, Description, item_type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, period, Spools)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """
+    # Column wise tolist() gives native Python values, mysql-connector cannot bind numpy scalars
+    rows = list(zip(*(df[col].tolist() for col in ITEMS_TABLE_IMPORT_COLUMNS)))
+    return _insert_rows(connection, query, rows, batch_size, df['period'].min() if rows else None)
+
+
+def insert_month_counts(connection: MySQLConnection, df: pd.DataFrame, month_year: str, period,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, float]:
+    """
+    Insert the counted rows of the month count grid into items_table for month_year ("January
+    2024") and period (its first day) in one transaction, batch_size rows per round-trip.
+    Raises ValueError without writing anything if any row fails validate_month_counts.
+    Returns the number of rows written, the seconds spent and the rows per second.
+    """
+    df, errors = validate_month_counts(df)
+    if not errors.empty:
+        raise ValueError(f"{errors['Row'].nunique()} rows are not valid, nothing was inserted")
+
+    query = """
+    INSERT INTO items_table (BTN_SKU, Description, item_type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, period, is_roll)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """
+    df = df.assign(Month=month_year, period=period, is_roll=df['is_roll'].fillna(False).astype(bool))
+    rows = list(zip(*(df[col].tolist() for col in MONTH_COUNT_COLUMNS)))
+    return _insert_rows(connection, query, rows, batch_size, period)
@@ -0,0 +1,46 @@
+"""
+Parallel loading of independent page sections.
+
+A page starts the reads its sections need with load() as early as it knows their arguments,
+and each read runs on a small process wide thread pool with its own pooled connection. The
+page then draws every section as soon as its data is ready with as_ready(), so a rerun takes
+about as long as its slowest read instead of the sum of all of them. The loaders only run
+queries and pandas code; everything that calls Streamlit stays on the script thread.
+"""
+import concurrent.futures
+import contextvars
+import threading
+
+import inventory_control_db_config as db_config
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Create the process wide loader pool on first use and return it."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers = db_config.loader_workers,
+                    thread_name_prefix = 'section-loader'
+                )
+    return _executor
+
+
+def load(func, *args, **kwargs):
+    """
+    Start func(*args, **kwargs) on the loader pool and return its Future. It runs in a copy of
+    the caller's context, so its queries are counted toward the caller's rerun.
+    """
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, func, *args, **kwargs)
+
+
+def as_ready(futures):
+    """Yield (name, result) for a dict of name -> Future in the order they finish."""
+    names = {future: name for name, future in futures.items()}
+    for future in concurrent.futures.as_completed(names):
+        yield names[future], future.result()
@@ -0,0 +1,399 @@
+"""
+Query and page timing metrics for Inven Control.
+
+Every statement run through inventory_control_db is recorded with its SQL fingerprint (the text
+with literals and IN lists collapsed), the rows it returned or changed, its latency and the page
+rerun it ran in. Pages call begin_rerun() at the top and metrics_panel() at the end, and wrap
+their pandas and Plotly work in timed(), so each rerun knows how long it spent in the database,
+in pandas and in Plotly; st.fragment sections that rerun on their own are wrapped in
+fragment_rerun(). Set METRICS_PORT to serve the totals as Prometheus text for scraping.
+"""
+import contextvars
+import functools
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import inventory_control_db_config as db_config
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('db', 'pandas', 'plotly')
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def configure_logging():
+    """
+    Send log records to stderr at LOG_LEVEL. The Streamlit pages and the command line scripts
+    call this, importing the module leaves the logging setup of the caller alone.
+    """
+    logging.basicConfig(level = db_config.log_level, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def fingerprint(query):
+    """SQL text with literals and parameters as ? and IN lists of any length collapsed, on one line."""
+    text = query.decode() if isinstance(query, bytes) else str(query)
+    text = _STRING_LITERAL.sub('?', text)
+    text = text.replace('%s', '?')
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _PLACEHOLDER_LIST.sub('(?+)', text)
+    return ' '.join(text.split()).rstrip(';').strip()
+
+
+class Rerun:
+    """Timings and statements of one script run of one page."""
+
+    def __init__(self, page, number):
+        self.page = page
+        self.number = number
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.queries = []  # (fingerprint, rows, seconds, error)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def add_query(self, statement, rows, seconds, error):
+        with self._lock:
+            self.queries.append((statement, rows, seconds, error))
+            self.stage_seconds['db'] += seconds
+
+
+class MetricsRegistry:
+    """Process wide totals per page and statement fingerprint."""
+
+    def __init__(self):
+        self.queries = {}  # (page, fingerprint) -> [count, errors, rows, seconds, max_seconds]
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.reruns = {}  # page -> [count, seconds, {stage: seconds}]
+        self._lock = threading.Lock()
+
+    def record_query(self, page, statement, rows, seconds, error):
+        with self._lock:
+            totals = self.queries.setdefault((page, statement), [0, 0, 0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += int(error)
+            totals[2] += rows
+            totals[3] += seconds
+            totals[4] = max(totals[4], seconds)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            self.latency_buckets[bucket] += 1
+
+    def record_rerun(self, rerun):
+        with self._lock:
+            totals = self.reruns.setdefault(rerun.page, [0, 0.0, dict.fromkeys(STAGES, 0.0)])
+            totals[0] += 1
+            totals[1] += rerun.seconds
+            for stage, seconds in rerun.stage_seconds.items():
+                totals[2][stage] = totals[2].get(stage, 0.0) + seconds
+
+    def slowest(self, limit=10):
+        """(page, fingerprint, count, mean seconds, max seconds) for the statements with the most total time."""
+        with self._lock:
+            ranked = sorted(self.queries.items(), key=lambda item: -item[1][3])[:limit]
+        return [(page, statement, count, seconds / count, max_seconds)
+                for (page, statement), (count, _, _, seconds, max_seconds) in ranked]
+
+
+registry = MetricsRegistry()
+_rerun_numbers = itertools.count(1)
+_current_rerun = contextvars.ContextVar('current_rerun', default=None)
+# Time spent in nested stages, so an outer timed() block only counts its own time
+_stage_stack = contextvars.ContextVar('stage_stack', default=())
+
+
+def begin_rerun(page):
+    """Start timing a script run of page, called at the top of every page."""
+    rerun = Rerun(page, next(_rerun_numbers))
+    _current_rerun.set(rerun)
+    _stage_stack.set(())
+    start_metrics_server()
+    return rerun
+
+
+def end_rerun():
+    """Finish the current rerun, add it to the totals and return it (None outside a page)."""
+    rerun = _current_rerun.get()
+    if rerun is not None and rerun.seconds is None:
+        rerun.seconds = time.perf_counter() - rerun.started
+        registry.record_rerun(rerun)
+    return rerun
+
+
+def fragment_rerun(page):
+    """
+    Decorator for st.fragment sections of page. A fragment that reruns on its own skips the
+    page's begin_rerun() and metrics_panel(), so it is timed as a rerun of its own, named after
+    the page and the function. Run as part of the whole page it is simply part of that rerun.
+    """
+    def decorator(func):
+        name = f"{page}: {func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rerun = _current_rerun.get()
+            if rerun is not None and rerun.seconds is None:
+                return func(*args, **kwargs)
+            rerun_token = _current_rerun.set(Rerun(name, next(_rerun_numbers)))
+            stack_token = _stage_stack.set(())
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_rerun()
+                _stage_stack.reset(stack_token)
+                _current_rerun.reset(rerun_token)
+        return wrapper
+    return decorator
+
+
+def _charge_parent(seconds):
+    stack = _stage_stack.get()
+    if stack:
+        stack[-1][0] += seconds
+
+
+@contextmanager
+def timed(stage):
+    """Count the time spent in the block against stage ('pandas', 'plotly') for the current rerun."""
+    rerun = _current_rerun.get()
+    child = [0.0]
+    token = _stage_stack.set(_stage_stack.get() + (child,))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage_stack.reset(token)
+        if rerun is not None:
+            rerun.add(stage, elapsed - child[0])
+        _charge_parent(elapsed)
+
+
+def record_query(query, rows, seconds, error=False):
+    """Record one executed statement, called by the instrumented cursors."""
+    statement = fingerprint(query)
+    rerun = _current_rerun.get()
+    registry.record_query(rerun.page if rerun is not None else '', statement, rows, seconds, error)
+    if rerun is not None:
+        rerun.add_query(statement, rows, seconds, error)
+    _charge_parent(seconds)
+    logger.debug("%.1f ms, %d rows: %s", seconds * 1000, rows, statement)
+
+
+class InstrumentedCursor:
+    """
+    Wraps a mysql-connector cursor and records every statement it runs. A SELECT is recorded
+    once its rows are fetched, with the fetch time included in its latency.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None  # [query, seconds, rows] of a statement whose rows may still be fetched
+
+    def _finish(self):
+        if self._pending is not None:
+            query, seconds, rows = self._pending
+            self._pending = None
+            record_query(query, rows, seconds)
+
+    def _run(self, method, query, args):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            result = method(query, *args)
+        except Exception:
+            record_query(query, 0, time.perf_counter() - start, error=True)
+            raise
+        seconds = time.perf_counter() - start
+        if self._cursor.with_rows:
+            self._pending = [query, seconds, 0]
+        else:
+            record_query(query, max(self._cursor.rowcount, 0), seconds)
+        return result
+
+    def execute(self, query, params=None, *args, **kwargs):
+        return self._run(lambda q, *a: self._cursor.execute(q, *a, **kwargs), query, (params,) + args)
+
+    def executemany(self, query, seq_params, *args, **kwargs):
+        return self._run(lambda q, *a: self._cursor.executemany(q, *a, **kwargs), query, (seq_params,) + args)
+
+    def _fetch(self, method, *args, finish=False):
+        start = time.perf_counter()
+        result = method(*args)
+        if self._pending is not None:
+            self._pending[1] += time.perf_counter() - start
+            if isinstance(result, list):
+                self._pending[2] += len(result)
+            elif result is not None:
+                self._pending[2] += 1
+            if finish or result is None or result == []:
+                self._finish()
+        return result
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall, finish=True)
+
+    def fetchmany(self, size=1):
+        return self._fetch(self._cursor.fetchmany, size)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Wraps a pooled connection so that its cursors and commits are recorded."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self._connection.commit()
+        except Exception:
+            record_query('COMMIT', 0, time.perf_counter() - start, error=True)
+            raise
+        record_query('COMMIT', 0, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def prometheus_text():
+    """All totals in the Prometheus text exposition format."""
+    from inventory_control_cache import query_cache
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_label(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    with registry._lock:
+        queries = sorted(registry.queries.items())
+        buckets = list(registry.latency_buckets)
+        reruns = sorted(registry.reruns.items())
+
+    def per_query(index):
+        return [({'page': page, 'query': statement}, totals[index]) for (page, statement), totals in queries]
+
+    metric('inventory_db_queries_total', 'counter', "Statements executed.", per_query(0))
+    metric('inventory_db_query_errors_total', 'counter', "Statements that raised an error.", per_query(1))
+    metric('inventory_db_query_rows_total', 'counter', "Rows returned or changed by statements.", per_query(2))
+    metric('inventory_db_query_seconds_total', 'counter', "Time spent executing statements and fetching their rows.", per_query(3))
+    metric('inventory_db_query_seconds_max', 'gauge', "Slowest execution of a statement.", per_query(4))
+
+    cumulative = list(itertools.accumulate(buckets))
+    lines.append("# HELP inventory_db_query_duration_seconds Statement latency.")
+    lines.append("# TYPE inventory_db_query_duration_seconds histogram")
+    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), cumulative):
+        lines.append(f'inventory_db_query_duration_seconds_bucket{{le="{bound}"}} {count}')
+    lines.append(f"inventory_db_query_duration_seconds_sum {sum(totals[3] for _, totals in queries)}")
+    lines.append(f"inventory_db_query_duration_seconds_count {cumulative[-1]}")
+
+    metric('inventory_page_reruns_total', 'counter', "Script runs per page.",
+           [({'page': page}, totals[0]) for page, totals in reruns])
+    metric('inventory_page_rerun_seconds_total', 'counter', "Time spent in script runs per page.",
+           [({'page': page}, totals[1]) for page, totals in reruns])
+    metric('inventory_page_stage_seconds_total', 'counter', "Time spent per page in the database, pandas and Plotly.",
+           [({'page': page, 'stage': stage}, seconds) for page, totals in reruns for stage, seconds in totals[2].items()])
+
+    metric('inventory_query_cache_hits_total', 'counter', "Query cache hits.", [({}, query_cache.hits)])
+    metric('inventory_query_cache_misses_total', 'counter', "Query cache misses.", [({}, query_cache.misses)])
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    """Serve prometheus_text() on port (METRICS_PORT by default) from a background thread, once per process."""
+    global _server
+    port = db_config.metrics_port if port is None else port
+    if not port or _server is not None:
+        return _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(('', port), _MetricsHandler)
+            except OSError as err:
+                logger.error("Error: could not serve metrics on port %s: '%s'", port, err)
+                _server = False
+                return _server
+            threading.Thread(target = _server.serve_forever, name = 'metrics-server', daemon = True).start()
+            logger.info("Serving metrics on port %s", port)
+    return _server
+
+
+def metrics_panel():
+    """
+    End the current rerun and, when switched on in the sidebar, show its query count and the
+    time it spent in the database, pandas and Plotly. Called at the bottom of every page.
+    """
+    import pandas as pd
+    import streamlit as st
+
+    rerun = end_rerun()
+    if rerun is None or not st.sidebar.toggle("Show performance metrics", key = 'show_metrics'):
+        return
+    with st.sidebar.expander(f"Rerun {rerun.number} of {rerun.page}", expanded = True):
+        col1, col2 = st.columns(2)
+        col1.metric("Queries", len(rerun.queries))
+        col2.metric("Total", f"{rerun.seconds * 1000:.0f} ms")
+        col1.metric("Database", f"{rerun.stage_seconds['db'] * 1000:.0f} ms")
+        col2.metric("pandas", f"{rerun.stage_seconds['pandas'] * 1000:.0f} ms")
+        col1.metric("Plotly", f"{rerun.stage_seconds['plotly'] * 1000:.0f} ms")
+        if rerun.queries:
+            queries = pd.DataFrame(rerun.queries, columns = ['Query', 'Rows', 'Seconds', 'Error'])
+            queries['ms'] = (queries['Seconds'] * 1000).round(1)
+            st.dataframe(queries[['Query', 'Rows', 'ms']], hide_index = True, use_container_width = True)
+        slowest = pd.DataFrame(registry.slowest(), columns = ['Page', 'Query', 'Count', 'Mean s', 'Max s'])
+        if not slowest.empty:
+            st.write("Most time in the database since the server started:")
+            st.dataframe(slowest, hide_index = True, use_container_width = True)
+        st.download_button("Download metrics", prometheus_text(), file_name = "inventory_metrics.txt")
@@ -0,0 +1,198 @@
+"""
+Schema migrations for the Inven Control database.
+
+Each migration runs once and is recorded in the schema_migrations table. Steps check the
+current schema before changing it, so a migration that stopped half way can be run again.
+
+Apply every pending migration with:
+    python inventory_control_migrations.py
+List the migrations and whether they are applied with:
+    python inventory_control_migrations.py --list
+"""
+import argparse
+
+from inventory_control_db import get_connection
+from inventory_control_metrics import configure_logging
+from inventory_control_stock import STOCK_SNAPSHOT_TABLE_QUERY
+from inventory_control_usage import create_monthly_usage
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s;
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s;
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def _create_index(cursor, table, index, columns):
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"CREATE INDEX {index} ON {table} ({columns});")
+
+
+def add_items_table_period(cursor):
+    # items_table.Month is text such as "January 2024", period is the first day of that month
+    if not _column_exists(cursor, 'items_table', 'period'):
+        cursor.execute("ALTER TABLE items_table ADD COLUMN period DATE NULL AFTER Month;")
+    cursor.execute("""
+    UPDATE items_table
+    SET period = STR_TO_DATE(CONCAT('1 ', TRIM(Month)), '%d %M %Y')
+    WHERE period IS NULL;
+    """)
+    _create_index(cursor, 'items_table', 'idx_items_period_sku', 'period, BTN_SKU')
+    _create_index(cursor, 'items_table', 'idx_items_sku_period', 'BTN_SKU, period')
+
+
+def add_ledger_sku_timestamp_index(cursor):
+    # Serves the latest-amount lookups and the keyset paginated adjustment history
+    _create_index(cursor, 'Current_Amount_Items', 'idx_ledger_sku_timestamp', 'BTN_SKU, Change_Timestamp')
+
+
+def _columns(cursor, table):
+    cursor.execute("""
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ORDER BY ORDINAL_POSITION;
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _auto_increment_column(cursor, table):
+    cursor.execute("""
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND EXTRA LIKE '%%auto_increment%%';
+    """, (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def add_items_table_id(cursor):
+    # The roll-up, the analytics store and the exports tell rows of the same item and month
+    # apart by id, the roll-up takes the row with the lowest id as the month's count
+    if _column_exists(cursor, 'items_table', 'id'):
+        return
+    existing = _auto_increment_column(cursor, 'items_table')
+    if existing:
+        # A table has one AUTO_INCREMENT column, which already numbers the rows in insert order
+        cursor.execute(f"ALTER TABLE items_table RENAME COLUMN `{existing}` TO id;")
+        return
+
+    # InnoDB numbers the rows of an added AUTO_INCREMENT column in no defined order, so the rows
+    # are copied to a numbered table in period, BTN_SKU order, ties broken by the other columns
+    # in table order, and it replaces items_table. Run with the app stopped, writes made during
+    # the copy are lost. Leftovers of a copy that stopped half way are dropped first
+    cursor.execute("DROP TABLE IF EXISTS items_table_numbered, items_table_unnumbered;")
+    names = _columns(cursor, 'items_table')
+    columns = ", ".join(f"`{name}`" for name in names)
+    order = ", ".join(f"`{name}`" for name in ['period', 'BTN_SKU'] + [name for name in names if name not in ('period', 'BTN_SKU')])
+    cursor.execute("CREATE TABLE items_table_numbered LIKE items_table;")
+    cursor.execute("""
+    ALTER TABLE items_table_numbered
+        ADD COLUMN id INT NOT NULL AUTO_INCREMENT FIRST,
+        ADD UNIQUE KEY uq_items_table_id (id);
+    """)
+    cursor.execute(f"""
+    INSERT INTO items_table_numbered ({columns})
+    SELECT {columns} FROM items_table
+    ORDER BY {order};
+    """)
+    cursor.execute("RENAME TABLE items_table TO items_table_unnumbered, items_table_numbered TO items_table;")
+    cursor.execute("DROP TABLE items_table_unnumbered;")
+
+
+def add_monthly_usage(cursor):
+    # The per item monthly usage roll-up, filled from the existing history. It picks the first
+    # count of each item and month by id, so id is added first
+    add_items_table_id(cursor)
+    create_monthly_usage(cursor)
+
+
+def add_stock_snapshot(cursor):
+    # Created here so the read paths never run DDL, items without a row yet are read from
+    # their ledger until their next adjustment seeds it
+    cursor.execute(STOCK_SNAPSHOT_TABLE_QUERY)
+
+
+def add_updated_at(cursor):
+    # Lets an analytics store sync find the months written since the previous one through an
+    # index instead of checksumming the whole history
+    for table, index in (('items_table', 'idx_items_updated_at'), ('Monthly_Usage', 'idx_usage_updated_at')):
+        if not _column_exists(cursor, table, 'updated_at'):
+            cursor.execute(f"""
+            ALTER TABLE {table}
+                ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+            """)
+        _create_index(cursor, table, index, 'updated_at')
+
+
+# (name, function) in the order they are applied, never reorder or rename applied entries
+MIGRATIONS = [
+    ('0001_items_table_period', add_items_table_period),
+    ('0002_ledger_sku_timestamp_index', add_ledger_sku_timestamp_index),
+    ('0003_monthly_usage', add_monthly_usage),
+    ('0004_stock_snapshot', add_stock_snapshot),
+    ('0005_updated_at', add_updated_at),
+]
+
+
+def _applied_migrations(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR(100) NOT NULL PRIMARY KEY,
+        applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cursor.execute("SELECT name FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_migrations():
+    """Apply every pending migration in order. Returns the names that were applied."""
+    applied_now = []
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            applied = _applied_migrations(cursor)
+            for name, migrate in MIGRATIONS:
+                if name in applied:
+                    continue
+                print(f"Applying migration {name}")
+                migrate(cursor)
+                cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (name,))
+                connection.commit()
+                applied_now.append(name)
+        finally:
+            cursor.close()
+    return applied_now
+
+
+def list_migrations():
+    """Return (name, applied) for every known migration."""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            applied = _applied_migrations(cursor)
+        finally:
+            cursor.close()
+    return [(name, name in applied) for name, _ in MIGRATIONS]
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Apply Inven Control schema migrations.")
+    parser.add_argument("--list", action = "store_true", help = "list migrations without applying them")
+    args = parser.parse_args()
+    if args.list:
+        for name, applied in list_migrations():
+            print(f"{'applied' if applied else 'pending'}  {name}")
+    else:
+        applied_now = apply_migrations()
+        print(f"Applied {len(applied_now)} migration(s)" if applied_now else "Database schema is up to date")
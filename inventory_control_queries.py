@@ -0,0 +1,301 @@
+"""
+Read queries shared by the dashboard pages.
+
+These sit outside the page scripts so they can be reused across pages and timed without
+running the Streamlit UI. Readers that run on every rerun are cached with
+inventory_control_cache and invalidated by the write paths. The analytics readers (usage
+history, monthly comparison, item type space) read the local Arrow copy kept by
+inventory_control_store instead of MySQL, which is only imported by them, so the pages that
+never draw an analytics view start without pyarrow.dataset.
+"""
+import datetime
+
+import pandas as pd
+
+from inventory_control_cache import cached_query
+from inventory_control_db import execute_read_query, fetch_dataframe, get_connection
+from inventory_control_frames import ITEMS_TABLE_SCHEMA, USAGE_HISTORY_SCHEMA, apply_schema
+from inventory_control_metrics import timed
+
+
+def month_to_period(month_year):
+    """Turn a "January 2024" style month into the items_table.period date (first of the month)."""
+    return datetime.datetime.strptime(month_year.strip(), "%B %Y").date()
+
+
+def period_to_month(period):
+    """Turn an items_table.period date back into its "January 2024" display text."""
+    return period.strftime("%B %Y")
+
+
+@cached_query('items_table')
+def fetch_data(selected_month_year):
+    query = "SELECT * FROM items_table WHERE period = %s"
+    return apply_schema(fetch_dataframe(query, (month_to_period(selected_month_year),), prepared = True), ITEMS_TABLE_SCHEMA)
+
+
+# get all items BTN_SKU only
+@cached_query('items_table')
+def fetch_items_BTN_SKU():
+    query = "SELECT Distinct BTN_SKU FROM items_table"
+    items = execute_read_query(query)
+    return [item[0] for item in items] if items else []
+
+
+# get all item types, for the export filters
+@cached_query('items_table')
+def fetch_item_types():
+    query = "SELECT DISTINCT item_type FROM items_table WHERE item_type IS NOT NULL ORDER BY item_type"
+    types = execute_read_query(query)
+    return [item_type[0] for item_type in types] if types else []
+
+
+# get all items BTN_SKU and description only
+@cached_query('items_table')
+def fetch_items_BTN_SKU_description():
+    query = "SELECT DISTINCT BTN_SKU, Description FROM items_table"
+    items = execute_read_query(query)
+    # Combine BTN_SKU and Description for display in dropdown
+    return [f"{item[0]} - {item[1]}" for item in items] if items else []
+
+
+@cached_query('items_table', 'Current_Amount_Items')
+def fetch_month_count_prefill():
+    """
+    One row per item for the end of month count grid: its most recent details in items_table
+    and its current balance, in one query. The balance comes from the stock snapshot, or from the
+    item's ledger like an adjustment would seed it when the item has no snapshot row yet (0 for
+    items that were never adjusted).
+    """
+    query = """
+    SELECT latest.BTN_SKU, latest.Description, latest.item_type, latest.Count_Details, latest.Vendor,
+           COALESCE(snapshot.current_amount, ledger.current_amount, 0) AS Bundles_Boxes_Spools,
+           COALESCE(snapshot.total_units, ledger.total_units, 0) AS Units_Pieces_Each,
+           COALESCE(latest.is_roll, 0) AS is_roll
+    FROM (
+        SELECT BTN_SKU, Description, item_type, Count_Details, Vendor, is_roll,
+               ROW_NUMBER() OVER (PARTITION BY BTN_SKU ORDER BY period DESC) AS row_num
+        FROM items_table
+    ) AS latest
+    LEFT JOIN Current_Stock_Snapshot AS snapshot ON snapshot.BTN_SKU = latest.BTN_SKU
+    LEFT JOIN (
+        -- Only the ledgers of items without a snapshot row are read
+        SELECT BTN_SKU,
+               MAX(CASE WHEN row_num = 1 THEN amount_after_change END) AS current_amount,
+               SUM(Amount_Change * units_per_box) AS total_units
+        FROM (
+            SELECT BTN_SKU, Amount_Change, units_per_box, amount_after_change,
+                   ROW_NUMBER() OVER (PARTITION BY BTN_SKU ORDER BY Change_Timestamp DESC) AS row_num
+            FROM Current_Amount_Items
+            WHERE BTN_SKU NOT IN (SELECT BTN_SKU FROM Current_Stock_Snapshot)
+        ) AS ordered
+        GROUP BY BTN_SKU
+    ) AS ledger ON ledger.BTN_SKU = latest.BTN_SKU
+    WHERE latest.row_num = 1
+    ORDER BY latest.BTN_SKU;
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query)
+            columns = [column[0] for column in cursor.description]
+            df = pd.DataFrame(cursor.fetchall(), columns = columns)
+        finally:
+            cursor.close()
+    df['is_roll'] = df['is_roll'].astype(bool)
+    return df
+
+
+@cached_query('Monthly_Usage')
+def fetch_usage_history():
+    """
+    Every item's monthly usage in period order, for the forecast page, from the local copy of
+    the Monthly_Usage roll-up. An item's first counted month has no usage and is left out.
+    """
+    import pyarrow.dataset as ds
+    from inventory_control_store import read_table
+
+    df = read_table('Monthly_Usage', ['BTN_SKU', 'Description', 'period', 'used'], filter = ds.field('used').is_valid())
+    df = df.rename(columns = {'used': 'Amount_Used_Monthly'}).sort_values(['period', 'BTN_SKU'], ignore_index = True)
+    return apply_schema(df, USAGE_HISTORY_SCHEMA)
+
+
+@cached_query('Monthly_Usage')
+@timed('pandas')
+def fetch_monthly_comparison(items, month_years):
+    """
+    Fetch the end of month count for every selected item and month from the local copy of the
+    Monthly_Usage roll-up, which holds the first count of every item and month.
+
+    items is a list of BTN_SKU values and month_years a list of "January 2024" style strings.
+    Returns one row per (month, item) pair, in month then item order, with the columns
+    MonthYear, Item, Value and IsRoll. Pairs with no count get a Value of 0.
+    """
+    columns = ['MonthYear', 'Item', 'Value', 'IsRoll']
+    if not items or not month_years:
+        return pd.DataFrame(columns = columns)
+
+    import pyarrow.dataset as ds
+    from inventory_control_store import read_table
+
+    periods = [month_to_period(month_year) for month_year in month_years]
+    # Only the files of the selected months are opened
+    data = read_table('Monthly_Usage', ['period', 'BTN_SKU', 'end_count', 'is_roll'], periods = periods,
+                      filter = ds.field('BTN_SKU').isin(items))
+    data = data.rename(columns = {
+        'BTN_SKU': 'Item', 'end_count': 'Value', 'is_roll': 'IsRoll'
+    })
+
+    # Every requested pair, so missing combinations show up as zero on the chart
+    grid = pd.DataFrame(
+        [(period_to_month(period), period, item) for period in periods for item in items],
+        columns = ['MonthYear', 'period', 'Item']
+    )
+    results = grid.merge(data, how = 'left', on = ['period', 'Item'])
+
+    results['Value'] = pd.to_numeric(results['Value']).fillna(0)
+    if results['Value'].mod(1).eq(0).all():
+        results['Value'] = results['Value'].astype(int)
+    results['IsRoll'] = results['IsRoll'].fillna(False).astype(bool)
+    return results[columns]
+
+
+@cached_query('items_table')
+@timed('pandas')
+def fetch_item_type_space(selected_month_year):
+    """
+    The inventory space roll-up of one month from the local copy of items_table: one row per
+    item_type with Total_Space (its Bundles_Boxes_Spools) and Item_List (its descriptions).
+    """
+    from inventory_control_store import read_table
+
+    df = read_table('items_table', ['item_type', 'Description', 'Bundles_Boxes_Spools'],
+                    periods = [month_to_period(selected_month_year)])
+    return df.groupby('item_type').agg(
+        Total_Space = pd.NamedAgg(column = 'Bundles_Boxes_Spools', aggfunc = 'sum'),
+        # Handle missing data by using a placeholder if no descriptions are present
+        Item_List = pd.NamedAgg(column = 'Description', aggfunc = lambda x: '<br>'.join(set(x)) if x.any() else 'No data')
+    ).reset_index()
+
+
+# What fetch_usage_trend groups the usage by
+TREND_GROUPS = {
+    'item_type': "COALESCE(item_type, 'Unknown')",
+    'BTN_SKU': "BTN_SKU",
+    'total': "'All items'",
+}
+
+
+@cached_query('Monthly_Usage')
+def fetch_usage_trend(group_by, first_year, last_year, by_quarter=True, item_types=None, btn_skus=None):
+    """
+    Usage per group ('item_type', 'BTN_SKU' or 'total') and quarter, or per year when by_quarter
+    is off, from first_year through last_year, optionally limited to some item types or items.
+
+    The whole range is summed in MySQL from the Monthly_Usage roll-up in one GROUP BY query that
+    also looks up the same quarter (or year) of the year before, so only the aggregated rows come
+    back. Returns the columns group_key, year, quarter (0 per year), used, received, items,
+    previous_used and yoy_pct; previous_used is missing where the year before has no usage.
+    """
+    conditions = ["period >= %s", "period < %s"]
+    # The year before first_year is read as well, for first_year's changes
+    params = [datetime.date(first_year - 1, 1, 1), datetime.date(last_year + 1, 1, 1)]
+    if item_types:
+        conditions.append(f"item_type IN ({', '.join(['%s'] * len(item_types))})")
+        params.extend(item_types)
+    if btn_skus:
+        conditions.append(f"BTN_SKU IN ({', '.join(['%s'] * len(btn_skus))})")
+        params.extend(btn_skus)
+
+    query = f"""
+    SELECT group_key, year, quarter, used, received, items, previous_used,
+           ROUND(100.0 * (used - previous_used) / NULLIF(ABS(previous_used), 0), 1) AS yoy_pct
+    FROM (
+        SELECT group_key, year, quarter, used, received, items,
+               CASE WHEN LAG(year) OVER w = year - 1 THEN LAG(used) OVER w END AS previous_used
+        FROM (
+            SELECT {TREND_GROUPS[group_by]} AS group_key, YEAR(period) AS year,
+                   {"QUARTER(period)" if by_quarter else "0"} AS quarter,
+                   SUM(used) AS used, SUM(received) AS received, COUNT(DISTINCT BTN_SKU) AS items
+            FROM Monthly_Usage
+            WHERE {" AND ".join(conditions)}
+            GROUP BY group_key, year, quarter
+        ) AS totals
+        WINDOW w AS (PARTITION BY group_key, quarter ORDER BY year)
+    ) AS trend
+    WHERE year >= %s
+    ORDER BY group_key, year, quarter;
+    """
+    df = fetch_dataframe(query, tuple(params) + (first_year,))
+    if df.empty:
+        return pd.DataFrame(columns = ['group_key', 'year', 'quarter', 'used', 'received', 'items', 'previous_used', 'yoy_pct'])
+    with timed('pandas'):
+        # MySQL returns the sums as DECIMAL
+        numeric = ['year', 'quarter', 'used', 'received', 'items', 'previous_used', 'yoy_pct']
+        df[numeric] = df[numeric].apply(pd.to_numeric)
+        df['group_key'] = df['group_key'].astype(str)
+    return df
+
+
+def _history_filters(btn_sku, start_date, end_date):
+    conditions, params = ["BTN_SKU = %s"], [btn_sku]
+    if start_date:
+        conditions.append("Change_Timestamp >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("Change_Timestamp < %s")  # end date is inclusive
+        params.append(end_date + datetime.timedelta(days = 1))
+    return conditions, params
+
+
+def count_adjustment_history(btn_sku, start_date=None, end_date=None):
+    """Number of Current_Amount_Items rows for an item, optionally between two dates."""
+    conditions, params = _history_filters(btn_sku, start_date, end_date)
+    query = f"SELECT COUNT(*) FROM Current_Amount_Items WHERE {' AND '.join(conditions)};"
+    result = execute_read_query(query, tuple(params), prepared = True)
+    return result[0][0] if result else 0
+
+
+def fetch_adjustment_history_page(btn_sku, page_size=50, before=None, start_date=None, end_date=None):
+    """
+    One page of an item's adjustment history, newest first, read with keyset pagination on
+    (BTN_SKU, Change_Timestamp) so every page is an index range scan whatever its depth.
+
+    Pass the returned cursor back as before to read the next, older page; the cursor is None
+    once there are no older rows. Adjustments that share a timestamp are never split across
+    pages, so a page can be slightly longer than page_size. Returns (rows, cursor).
+    """
+    conditions, params = _history_filters(btn_sku, start_date, end_date)
+    if before is not None:
+        conditions.append("Change_Timestamp < %s")
+        params.append(before)
+    columns = "BTN_SKU, amount_before_change, Amount_Change, amount_after_change, units_per_box, new_total_units, Change_Timestamp, is_roll"
+    where = " AND ".join(conditions)
+
+    query = f"""
+    SELECT {columns}
+    FROM Current_Amount_Items
+    WHERE {where}
+    ORDER BY Change_Timestamp DESC
+    LIMIT %s;
+    """
+    rows = execute_read_query(query, tuple(params) + (page_size + 1,), prepared = True) or []
+    if len(rows) <= page_size:
+        return rows, None
+
+    page, last_timestamp = rows[:page_size], rows[page_size - 1][6]
+    if rows[page_size][6] == last_timestamp:
+        # The next row shares the last timestamp, finish that group on this page
+        tie_query = f"""
+        SELECT {columns}
+        FROM Current_Amount_Items
+        WHERE {where} AND Change_Timestamp = %s;
+        """
+        ties = execute_read_query(tie_query, tuple(params) + (last_timestamp,)) or []
+        page = [row for row in page if row[6] != last_timestamp] + ties
+        older = execute_read_query(
+            f"SELECT 1 FROM Current_Amount_Items WHERE {where} AND Change_Timestamp < %s LIMIT 1;",
+            tuple(params) + (last_timestamp,)
+        )
+        return page, (last_timestamp if older else None)
+    return page, last_timestamp
@@ -0,0 +1,160 @@
+"""
+Item search over BTN_SKU and Description across every month in items_table.
+
+The distinct items are loaded once into an in-memory trigram index, so a lookup only touches
+the posting lists of the query's trigrams instead of scanning a month's DataFrame, and its cost
+depends on the number of items, not on how many months of history are kept. Matches are
+ranked exact SKU first, then SKU or word prefix, then substring, then fuzzy (typo tolerant)
+matches by the share of the query's trigrams they contain; fuzzy matches are only offered when
+nothing matches otherwise. Every item that contains the query is found, however few of its
+trigrams it shares. Queries without a word of three letters are matched by a plain scan over
+the items. The index is rebuilt after a write to items_table invalidates the query cache, or once
+the cache TTL has passed.
+"""
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+import inventory_control_db_config as db_config
+from inventory_control_cache import query_cache
+from inventory_control_db import execute_read_query
+
+EXACT, PREFIX, SUBSTRING, FUZZY = 3, 2, 1, 0
+MATCH_NAMES = {EXACT: 'Exact SKU', PREFIX: 'Prefix', SUBSTRING: 'Contains', FUZZY: 'Similar'}
+_NO_ITEMS = np.array([], dtype=np.int32)
+
+
+def _trigrams(text):
+    # Words are padded so that the first letters of a word form their own trigrams,
+    # which lets one and two letter queries match word prefixes
+    grams = []
+    for word in text.split():
+        padded = f"  {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """Trigram index over (BTN_SKU, Description, last period) rows."""
+
+    def __init__(self, items, generation=None):
+        # Sorted by SKU so that equally ranked matches come back in SKU order
+        self.items = sorted(items, key=lambda item: str(item[0]))
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.skus = [str(sku).lower() for sku, _, _ in self.items]
+        # Words joined by single spaces, led by one, so " " + query finds a word that starts with it
+        self.texts = [" " + " ".join(f"{sku} {description or ''}".lower().split()) for sku, description, _ in self.items]
+        postings = defaultdict(list)
+        for doc_id, text in enumerate(self.texts):
+            for gram in set(_trigrams(text)):
+                postings[gram].append(doc_id)
+        self.postings = {gram: np.array(doc_ids, dtype=np.int32) for gram, doc_ids in postings.items()}
+
+    def _classify(self, doc_id, query):
+        if self.skus[doc_id] == query:
+            return EXACT
+        position = self.texts[doc_id].find(query)
+        if position < 0:
+            return None
+        if self.texts[doc_id][position - 1] == " " or self.texts[doc_id].find(" " + query, position) >= 0:
+            return PREFIX
+        return SUBSTRING
+
+    def _scan(self, query, limit):
+        # One and two letter queries have no trigram of their own inside a word, so "52" would
+        # never find BSKU-5230 through the index; the items are few enough to check one by one
+        results = []
+        for doc_id in range(len(self.items)):
+            match = self._classify(doc_id, query)
+            if match is not None:
+                results.append((float(match), match, doc_id))
+        results.sort(key=lambda result: -result[0])
+        return results[:limit]
+
+    def search(self, query, limit=20, min_similarity=0.5):
+        """
+        Return up to limit (score, match, doc_id) tuples, best first. Fuzzy matches are only
+        returned when nothing matches exactly, as a prefix or as a substring.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        if len(query) < 3:
+            return self._scan(query, limit)
+        # Every item that contains the query holds each trigram inside the query's words, so only
+        # the items on all of those posting lists are checked, however many trigrams they share
+        inner_grams = {word[i:i + 3] for word in query.split() for i in range(len(word) - 2)}
+        if not inner_grams:
+            return self._scan(query, limit)
+        query_grams = set(_trigrams(query))
+        postings = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        if not postings:
+            return []
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.items))
+
+        candidates = reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True),
+                            [self.postings.get(gram, _NO_ITEMS) for gram in inner_grams])
+        results = []
+        for doc_id, count in zip(candidates.tolist(), shared[candidates].tolist()):
+            match = self._classify(doc_id, query)
+            if match is not None:
+                results.append((match + count / len(query_grams), match, doc_id))
+
+        if not results:
+            # Typo tolerant matches by the share of the query's trigrams they contain. Every SKU
+            # shares the "bsku-" trigrams, so they would only list unrelated items next to a real match
+            for doc_id in np.argsort(-shared, kind='stable')[:limit * 5].tolist():
+                similarity = int(shared[doc_id]) / len(query_grams)
+                if similarity < min_similarity:
+                    break
+                results.append((FUZZY + similarity, FUZZY, doc_id))
+        results.sort(key=lambda result: -result[0])
+        return results[:limit]
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def build_search_index():
+    """Load every distinct item with the last month it was counted and index it."""
+    generation = query_cache.generation(('items_table',))
+    query = """
+    SELECT BTN_SKU, Description, MAX(period) AS last_period
+    FROM items_table
+    GROUP BY BTN_SKU, Description;
+    """
+    return SearchIndex(execute_read_query(query) or [], generation)
+
+
+def get_search_index():
+    """The process wide index, rebuilt when items_table has changed or the cache TTL has passed."""
+    global _index
+    with _index_lock:
+        stale = (_index is None
+                 or not _index.items
+                 or _index.generation != query_cache.generation(('items_table',))
+                 or time.monotonic() - _index.built_at > db_config.cache_ttl)
+        if stale:
+            _index = build_search_index()
+        return _index
+
+
+def search_items(query, limit=20):
+    """Ranked matches for a SKU or description search as a DataFrame."""
+    index = get_search_index()
+    rows = []
+    for score, match, doc_id in index.search(query, limit):
+        sku, description, last_period = index.items[doc_id]
+        rows.append({
+            'BTN_SKU': sku,
+            'Description': description,
+            'Last Counted': last_period.strftime("%B %Y") if last_period else '',
+            'Match': MATCH_NAMES[match],
+            'Score': round(score, 2),
+        })
+    return pd.DataFrame(rows, columns=['BTN_SKU', 'Description', 'Last Counted', 'Match', 'Score'])
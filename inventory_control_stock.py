@@ -0,0 +1,437 @@
+"""
+Per BTN_SKU stock snapshot kept next to the Current_Amount_Items ledger.
+
+Current_Stock_Snapshot holds the running balance of every item (current boxes/rolls, total
+boxes, total units and the weighted average units per box), so reading an item's stock is a
+primary key lookup instead of scanning its whole ledger. adjust_item_amount writes the ledger
+row and the snapshot row in the same transaction, and adjust_item_amounts does the same for a
+whole batch of items, such as a pallet being received, in one transaction.
+
+An adjustment reads the balance it builds on with SELECT ... FOR UPDATE on the item's snapshot
+row, so adjustments of the same item from several terminals wait for each other instead of
+reading the same balance and losing one of the changes. Transactions that deadlock are retried.
+
+Rebuild the snapshot from the ledger with:
+    python inventory_control_stock.py --rebuild
+"""
+import argparse
+import datetime
+
+from inventory_control_cache import invalidate
+from inventory_control_db import execute_read_query, get_connection, prepared_cursor, run_in_transaction
+from inventory_control_metrics import configure_logging
+from inventory_control_usage import refresh_monthly_usage
+
+STOCK_SNAPSHOT_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS Current_Stock_Snapshot (
+    BTN_SKU VARCHAR(50) NOT NULL PRIMARY KEY,
+    current_amount INT NOT NULL DEFAULT 0,
+    total_boxes INT NOT NULL DEFAULT 0,
+    total_units BIGINT NOT NULL DEFAULT 0,
+    average_units_per_box DECIMAL(14, 4) NOT NULL DEFAULT 0,
+    is_roll TINYINT(1) NOT NULL DEFAULT 0,
+    last_change DATETIME NULL
+);
+"""
+
+# Items rewritten per transaction by rebuild_stock_snapshot
+REBUILD_BATCH_SKUS = 500
+
+_table_ready = False
+_usage_table_ready = False
+
+
+def ensure_stock_snapshot_table(connection):
+    """
+    Create Current_Stock_Snapshot if it does not exist yet (once per server process). Migration
+    0004 creates it for the read paths, the write paths call this in case it has not run yet.
+    """
+    global _table_ready
+    if not _table_ready:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(STOCK_SNAPSHOT_TABLE_QUERY)
+        finally:
+            cursor.close()
+        _table_ready = True
+
+
+def _average_units_per_box(total_units, total_boxes):
+    return total_units / total_boxes if total_boxes > 0 else 0
+
+
+def _ensure_table():
+    if not _table_ready:
+        with get_connection() as connection:
+            ensure_stock_snapshot_table(connection)
+
+
+def _run(connection, query, params, prepared=True):
+    # The statements that run for every adjustment stay prepared on the connection
+    cursor = prepared_cursor(connection, query) if prepared else connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall() if cursor.with_rows else None
+    finally:
+        cursor.close()
+
+
+def _usage_table_exists(connection):
+    # Monthly_Usage is created by migration 0003, adjustments keep working before it has run
+    global _usage_table_ready
+    if not _usage_table_ready:
+        rows = _run(connection, """
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Monthly_Usage';
+        """, (), prepared=False)
+        _usage_table_ready = rows[0][0] > 0
+    return _usage_table_ready
+
+
+def _refresh_receipts(connection, btn_skus):
+    # Receipts count toward the usage of the month they arrive in, so a counted month that gets
+    # one is recomputed for these items. The month before is included in case the server's
+    # clock is already, or still, in another month than this one
+    if btn_skus and _usage_table_exists(connection):
+        this_month = datetime.date.today().replace(day = 1)
+        refresh_monthly_usage(connection, (this_month - datetime.timedelta(days = 1)).replace(day = 1), btn_skus)
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _read_stock(connection, btn_sku):
+    # Primary key lookup on the snapshot, falling back to the ledger for items that have
+    # not been adjusted since the snapshot table was created or rebuilt
+    query = """
+    SELECT current_amount, total_boxes, total_units
+    FROM Current_Stock_Snapshot
+    WHERE BTN_SKU = %s;
+    """
+    rows = _run(connection, query, (btn_sku,))
+    if rows:
+        return int(rows[0][0]), int(rows[0][1]), int(rows[0][2])
+
+    rows = _run(connection, """
+    SELECT amount_after_change
+    FROM Current_Amount_Items
+    WHERE BTN_SKU = %s
+    ORDER BY Change_Timestamp DESC
+    LIMIT 1;
+    """, (btn_sku,))
+    current_amount = rows[0][0] if rows and rows[0][0] is not None else 0
+
+    rows = _run(connection, """
+    SELECT SUM(Amount_Change * units_per_box), SUM(Amount_Change)
+    FROM Current_Amount_Items
+    WHERE BTN_SKU = %s;
+    """, (btn_sku,))
+    total_units, total_boxes = rows[0]
+    return int(current_amount), int(total_boxes or 0), int(total_units or 0)
+
+
+def get_stock_snapshot(btn_sku):
+    """
+    Return the current stock of an item as a dict with current_amount, total_boxes,
+    total_units and average_units_per_box. Items with no adjustments are all zero.
+    """
+    with get_connection() as connection:
+        current_amount, total_boxes, total_units = _read_stock(connection, btn_sku)
+    return {
+        'current_amount': current_amount,
+        'total_boxes': total_boxes,
+        'total_units': total_units,
+        'average_units_per_box': _average_units_per_box(total_units, total_boxes),
+    }
+
+
+def _ledger_stocks(connection, btn_skus):
+    # (current_amount, total_boxes, total_units) of items from their whole ledger, in two
+    # queries whatever their number. The IN lists change length, so these run as plain statements
+    in_list = _placeholders(btn_skus)
+    latest = dict(_run(connection, f"""
+    SELECT BTN_SKU, amount_after_change
+    FROM (
+        SELECT BTN_SKU, amount_after_change,
+               ROW_NUMBER() OVER (PARTITION BY BTN_SKU ORDER BY Change_Timestamp DESC) AS row_num
+        FROM Current_Amount_Items
+        WHERE BTN_SKU IN ({in_list})
+    ) AS latest
+    WHERE row_num = 1;
+    """, tuple(btn_skus), prepared = False))
+    totals = {btn_sku: (total_units, total_boxes) for btn_sku, total_units, total_boxes in _run(connection, f"""
+    SELECT BTN_SKU, SUM(Amount_Change * units_per_box), SUM(Amount_Change)
+    FROM Current_Amount_Items
+    WHERE BTN_SKU IN ({in_list})
+    GROUP BY BTN_SKU;
+    """, tuple(btn_skus), prepared = False)}
+
+    stocks = {}
+    for btn_sku in btn_skus:
+        total_units, total_boxes = totals.get(btn_sku, (0, 0))
+        stocks[btn_sku] = (int(latest.get(btn_sku) or 0), int(total_boxes or 0), int(total_units or 0))
+    return stocks
+
+
+def _lock_stocks(connection, btn_skus):
+    """
+    (current_amount, total_boxes, total_units) by BTN_SKU, read with the items' snapshot rows
+    locked until the transaction ends. Items without a snapshot row get one from their ledger first.
+    """
+    # InnoDB locks the rows in key order, so two batches sharing items cannot lock them crosswise.
+    # Only the single item form keeps one query text, so only it stays prepared
+    rows = _run(connection, f"""
+    SELECT BTN_SKU, current_amount, total_boxes, total_units
+    FROM Current_Stock_Snapshot
+    WHERE BTN_SKU IN ({_placeholders(btn_skus)})
+    FOR UPDATE;
+    """, tuple(btn_skus), prepared = len(btn_skus) == 1)
+    stocks = {btn_sku: (int(current_amount), int(total_boxes), int(total_units))
+              for btn_sku, current_amount, total_boxes, total_units in rows}
+
+    missing = [btn_sku for btn_sku in btn_skus if btn_sku not in stocks]
+    if missing:
+        # INSERT IGNORE keeps the row of a terminal that created it first, the rows are locked
+        # and read again below either way, so the balance always comes from the committed row
+        seeds = _ledger_stocks(connection, missing)
+        cursor = connection.cursor()
+        try:
+            cursor.executemany("""
+            INSERT IGNORE INTO Current_Stock_Snapshot (BTN_SKU, current_amount, total_boxes, total_units, average_units_per_box)
+            VALUES (%s, %s, %s, %s, %s);
+            """, [(btn_sku, current_amount, total_boxes, total_units, _average_units_per_box(total_units, total_boxes))
+                  for btn_sku, (current_amount, total_boxes, total_units) in seeds.items()])
+        finally:
+            cursor.close()
+        stocks.update(_lock_stocks(connection, missing))
+    return stocks
+
+
+def _apply_adjustment(connection, btn_sku, amount_change, units_per_box, is_roll):
+    # Fetch current total before the change, for boxes or rolls
+    amount_before_change, previous_total_boxes, previous_total_units = _lock_stocks(connection, [btn_sku])[btn_sku]
+    # Calculate the total after applying the change
+    amount_after_change = amount_before_change + amount_change
+    new_total_boxes = previous_total_boxes + amount_change
+    # If you are adding/subtracting boxes, we calculate the change to the total units
+    new_total_units = previous_total_units + (amount_change * units_per_box)
+
+    # Recalculate the average units per box correctly
+    if new_total_boxes > 0:
+        new_average_units_per_box = round(new_total_units / new_total_boxes)
+    else:
+        new_average_units_per_box = 0
+
+    #### Prints to terminal for verification, do not edit! ####
+    print(f"BTN_SKU: {btn_sku}")
+    print(f"Amount Change (boxes/rolls): {amount_change}")
+    print(f"Units Per Box/Roll: {units_per_box}")
+    print(f"Amount Before Change (boxes/rolls): {amount_before_change}")
+    print(f"Amount After Change (boxes/rolls): {amount_after_change}")
+    print(f"New Total Units: {new_total_units}")
+    print(f"New Average Units Per Box: {new_average_units_per_box}")
+    print(f"Is Roll: {is_roll}")
+    ###########################################################
+
+    _run(connection, """
+    INSERT INTO Current_Amount_Items (BTN_SKU, Amount_Change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll)
+    VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, (btn_sku, amount_change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll))
+
+    # The row exists and is locked by now, so a plain update is enough
+    _run(connection, """
+    UPDATE Current_Stock_Snapshot
+    SET current_amount = %s, total_boxes = %s, total_units = %s, average_units_per_box = %s, is_roll = %s, last_change = NOW()
+    WHERE BTN_SKU = %s;
+    """, (amount_after_change, new_total_boxes, new_total_units,
+          _average_units_per_box(new_total_units, new_total_boxes), is_roll, btn_sku))
+
+    # Update the items_table and the usage roll-up to reflect the roll status
+    _run(connection, """
+    UPDATE items_table
+    SET is_roll = %s
+    WHERE BTN_SKU = %s;
+    """, (is_roll, btn_sku))
+    if _usage_table_exists(connection):
+        _run(connection, """
+        UPDATE Monthly_Usage
+        SET is_roll = %s
+        WHERE BTN_SKU = %s;
+        """, (is_roll, btn_sku))
+    if amount_change > 0:
+        _refresh_receipts(connection, [btn_sku])
+
+
+def adjust_item_amount(btn_sku, amount_change, units_per_box, is_roll):
+    """
+    Record an adjustment in the Current_Amount_Items ledger and update the item's snapshot
+    row and roll status, all in one transaction that holds the lock on the snapshot row.
+    """
+    _ensure_table()
+    run_in_transaction(_apply_adjustment, btn_sku, amount_change, units_per_box, is_roll)
+    invalidate('items_table', 'Current_Amount_Items', 'Monthly_Usage')
+
+
+def _apply_adjustments(connection, adjustments):
+    stocks = _lock_stocks(connection, [adjustment[0] for adjustment in adjustments])
+
+    ledger_rows, snapshot_rows, results = [], [], []
+    roll_status = {True: [], False: []}
+    for btn_sku, amount_change, units_per_box, is_roll in adjustments:
+        amount_before_change, previous_total_boxes, previous_total_units = stocks[btn_sku]
+        amount_after_change = amount_before_change + amount_change
+        new_total_boxes = previous_total_boxes + amount_change
+        new_total_units = previous_total_units + (amount_change * units_per_box)
+        average_units_per_box = _average_units_per_box(new_total_units, new_total_boxes)
+
+        ledger_rows.append((btn_sku, amount_change, amount_before_change, units_per_box,
+                            new_total_units, amount_after_change, is_roll))
+        snapshot_rows.append((btn_sku, amount_after_change, new_total_boxes, new_total_units,
+                              average_units_per_box, is_roll))
+        roll_status[bool(is_roll)].append(btn_sku)
+        results.append({
+            'btn_sku': btn_sku,
+            'amount_change': amount_change,
+            'amount_before_change': amount_before_change,
+            'amount_after_change': amount_after_change,
+            'average_units_per_box': average_units_per_box,
+        })
+
+    cursor = connection.cursor()
+    try:
+        # mysql-connector turns each executemany INSERT into one multi-row INSERT
+        cursor.executemany("""
+        INSERT INTO Current_Amount_Items (BTN_SKU, Amount_Change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll)
+        VALUES (%s, %s, %s, %s, %s, %s, %s);
+        """, ledger_rows)
+
+        # Every snapshot row exists and is locked by now, so this only ever updates
+        cursor.executemany("""
+        INSERT INTO Current_Stock_Snapshot (BTN_SKU, current_amount, total_boxes, total_units, average_units_per_box, is_roll, last_change)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW()) AS new
+        ON DUPLICATE KEY UPDATE
+            current_amount = new.current_amount,
+            total_boxes = new.total_boxes,
+            total_units = new.total_units,
+            average_units_per_box = new.average_units_per_box,
+            is_roll = new.is_roll,
+            last_change = new.last_change;
+        """, snapshot_rows)
+
+        # At most two updates per table, one for the items that are rolls and one for the rest
+        tables = ('items_table', 'Monthly_Usage') if _usage_table_exists(connection) else ('items_table',)
+        for is_roll, skus in roll_status.items():
+            if skus:
+                for table in tables:
+                    cursor.execute(f"""
+                    UPDATE {table}
+                    SET is_roll = %s
+                    WHERE BTN_SKU IN ({_placeholders(skus)});
+                    """, (is_roll,) + tuple(skus))
+    finally:
+        cursor.close()
+    _refresh_receipts(connection, [btn_sku for btn_sku, amount_change, _, _ in adjustments if amount_change > 0])
+    return results
+
+
+def adjust_item_amounts(adjustments):
+    """
+    Apply a batch of adjustments, a list of (BTN_SKU, amount_change, units_per_box, is_roll)
+    with every BTN_SKU at most once, in one transaction. The current stock of every item is read
+    up front with its snapshot row locked, the new balances are computed in one pass, and the
+    ledger rows and snapshot rows are each written with a single statement.
+    Nothing is written if any of it fails.
+
+    Returns one dict per adjustment, in order, with btn_sku, amount_change, amount_before_change,
+    amount_after_change and average_units_per_box.
+    """
+    btn_skus = [adjustment[0] for adjustment in adjustments]
+    if len(set(btn_skus)) != len(btn_skus):
+        # Ledger rows written together share a timestamp, so an item's order within a batch would be lost
+        raise ValueError("Each BTN_SKU can only be adjusted once per batch")
+    if not adjustments:
+        return []
+
+    _ensure_table()
+    results = run_in_transaction(_apply_adjustments, adjustments)
+    invalidate('items_table', 'Current_Amount_Items', 'Monthly_Usage')
+    return results
+
+
+def _rebuild_stocks(connection, btn_skus):
+    # The rows are locked first, in the same order an adjustment locks them, so an adjustment of
+    # these items waits for the batch and is never overwritten by it
+    _lock_stocks(connection, btn_skus)
+    in_list = _placeholders(btn_skus)
+    _run(connection, f"""
+    INSERT INTO Current_Stock_Snapshot (BTN_SKU, current_amount, total_boxes, total_units, average_units_per_box, is_roll, last_change)
+    SELECT * FROM (
+        SELECT totals.BTN_SKU,
+               COALESCE(latest.amount_after_change, 0) AS current_amount,
+               totals.total_boxes,
+               totals.total_units,
+               CASE WHEN totals.total_boxes > 0 THEN totals.total_units / totals.total_boxes ELSE 0 END AS average_units_per_box,
+               COALESCE(latest.is_roll, 0) AS is_roll,
+               totals.last_change
+        FROM (
+            SELECT BTN_SKU,
+                   COALESCE(SUM(Amount_Change), 0) AS total_boxes,
+                   COALESCE(SUM(Amount_Change * units_per_box), 0) AS total_units,
+                   MAX(Change_Timestamp) AS last_change
+            FROM Current_Amount_Items
+            WHERE BTN_SKU IN ({in_list})
+            GROUP BY BTN_SKU
+        ) AS totals
+        JOIN (
+            SELECT BTN_SKU, amount_after_change, is_roll,
+                   ROW_NUMBER() OVER (PARTITION BY BTN_SKU ORDER BY Change_Timestamp DESC) AS row_num
+            FROM Current_Amount_Items
+            WHERE BTN_SKU IN ({in_list})
+        ) AS latest ON latest.BTN_SKU = totals.BTN_SKU AND latest.row_num = 1
+    ) AS rebuilt
+    ON DUPLICATE KEY UPDATE
+        current_amount = rebuilt.current_amount,
+        total_boxes = rebuilt.total_boxes,
+        total_units = rebuilt.total_units,
+        average_units_per_box = rebuilt.average_units_per_box,
+        is_roll = rebuilt.is_roll,
+        last_change = rebuilt.last_change;
+    """, tuple(btn_skus) * 2, prepared = False)
+
+
+def rebuild_stock_snapshot(batch_size=REBUILD_BATCH_SKUS):
+    """
+    Regenerate Current_Stock_Snapshot from the whole ledger. Items are rewritten batch_size at a
+    time, each batch in its own transaction, so adjustments keep running during a rebuild and
+    only wait for the batch that holds their item. Returns the number of items written.
+    """
+    _ensure_table()
+    btn_skus = [row[0] for row in execute_read_query(
+        "SELECT DISTINCT BTN_SKU FROM Current_Amount_Items ORDER BY BTN_SKU;") or []]
+    for start in range(0, len(btn_skus), batch_size):
+        run_in_transaction(_rebuild_stocks, btn_skus[start:start + batch_size])
+    # Rows of items whose ledger is gone, checked again on delete in case one was adjusted meanwhile
+    orphans = sorted({row[0] for row in execute_read_query("SELECT BTN_SKU FROM Current_Stock_Snapshot;") or []} - set(btn_skus))
+    if orphans:
+        with get_connection() as connection:
+            _run(connection, f"""
+            DELETE FROM Current_Stock_Snapshot
+            WHERE BTN_SKU IN ({_placeholders(orphans)})
+            AND NOT EXISTS (SELECT 1 FROM Current_Amount_Items AS ledger WHERE ledger.BTN_SKU = Current_Stock_Snapshot.BTN_SKU);
+            """, tuple(orphans), prepared = False)
+            connection.commit()
+    # The month count prefill and the balances of this process read the snapshot
+    invalidate('items_table', 'Current_Amount_Items')
+    return len(btn_skus)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Maintain the Current_Stock_Snapshot table.")
+    parser.add_argument("--rebuild", action = "store_true", help = "regenerate the snapshot from the Current_Amount_Items ledger")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt stock snapshot for {rebuild_stock_snapshot()} items")
+    else:
+        parser.print_help()
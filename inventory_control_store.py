@@ -0,0 +1,387 @@
+"""
+Local Arrow copy of the inventory history for the analytics views.
+
+items_table, the Monthly_Usage roll-up and the Current_Amount_Items ledger are mirrored into
+ANALYTICS_STORE_DIR, one directory per table and one uncompressed Arrow IPC file per period
+(period=2024-01-01/, the month of Change_Timestamp for the ledger). Reads memory-map the files
+of the periods they ask for and filter them in Arrow, so the forecast, the comparison chart and
+the item type roll-ups no longer query MySQL for the history.
+
+A sync is incremental. items_table and Monthly_Usage keep an indexed updated_at column
+(migration 0005), so a sync only looks at the periods with rows written since the last one,
+compares a row count and checksum of each of those and reads again the ones that changed. Rows
+deleted from MySQL leave nothing to find that way, so every ANALYTICS_FULL_SYNC_SECONDS the
+checksums of all periods are compared instead. The ledger is only ever appended to, so only
+rows with a higher id than the last synced one are read.
+
+A sync runs before a read once a write in this process has invalidated one of the tables, and
+that read waits for it, so a user sees their own saves; otherwise it runs every
+ANALYTICS_SYNC_SECONDS without holding up the reads that find it running. Only one thread syncs
+at a time. If MySQL cannot be reached the copy is served as it is, and a read that is older
+than a write made here is not kept in the query cache.
+
+Every rewrite goes to a new file and manifest.json, replaced in one rename, names the current
+file of each period, so reads need no lock and a file that is still memory-mapped by a reader
+is never overwritten; old files are removed on the next sync. Sync or start over from scratch with:
+    python inventory_control_store.py --sync
+    python inventory_control_store.py --rebuild
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+from mysql.connector import Error
+from pyarrow import fs
+
+import inventory_control_db_config as db_config
+from inventory_control_cache import do_not_cache, query_cache
+from inventory_control_db import get_connection
+from inventory_control_metrics import configure_logging, timed
+
+logger = logging.getLogger(__name__)
+
+# Mirrored columns per table, period itself is kept in the partition directory names
+TABLE_COLUMNS = {
+    'items_table': [
+        ('id', pa.int64()), ('BTN_SKU', pa.string()), ('Description', pa.string()), ('item_type', pa.string()),
+        ('Count_Details', pa.string()), ('Vendor', pa.string()), ('Pallets', pa.int64()),
+        ('Bundles_Boxes_Spools', pa.int64()), ('Units_Pieces_Each', pa.int64()), ('Month', pa.string()),
+        ('is_roll', pa.int8()), ('Spools', pa.int8()), ('Amount_Used_Monthly', pa.int64()),
+    ],
+    'Monthly_Usage': [
+        ('BTN_SKU', pa.string()), ('Description', pa.string()), ('item_type', pa.string()), ('is_roll', pa.int8()),
+        ('end_count', pa.int64()), ('previous_count', pa.int64()), ('received', pa.int64()), ('used', pa.int64()),
+    ],
+    'Current_Amount_Items': [
+        ('id', pa.int64()), ('BTN_SKU', pa.string()), ('Amount_Change', pa.int64()), ('amount_before_change', pa.int64()),
+        ('units_per_box', pa.int64()), ('new_total_units', pa.int64()), ('amount_after_change', pa.int64()),
+        ('is_roll', pa.int8()), ('Change_Timestamp', pa.timestamp('s')),
+    ],
+}
+PERIOD_TABLES = ('items_table', 'Monthly_Usage')
+LEDGER_TABLE = 'Current_Amount_Items'
+MIRRORED_TABLES = PERIOD_TABLES + (LEDGER_TABLE,)
+PARTITIONING = ds.partitioning(pa.schema([('period', pa.date32())]), flavor = 'hive')
+
+# Rows written this long before a sync started are looked at again by the next one, so a row
+# whose transaction commits after the sync read past it is still picked up
+SETTLE_SECONDS = 300
+LEDGER_CHUNK_ROWS = 50000
+# A failed sync is not tried again before this, reads serve the copy as it is meanwhile
+SYNC_RETRY_SECONDS = 30
+
+# One sync at a time; _lock only guards the manifest file and the sync state below
+_sync_lock = threading.Lock()
+_lock = threading.Lock()
+_synced_at = None
+_synced_generation = None  # table -> cache generation the copy was last synced at
+_failed_at = None
+
+
+def _root():
+    return db_config.analytics_store_dir
+
+
+def _source():
+    # The copy belongs to one database, pointing the app at another one starts it over
+    return f"{db_config.host_name}/{db_config.db_name}"
+
+
+def _load_manifest():
+    path = os.path.join(_root(), 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get('source') == _source():
+            # Manifests written before the watermarks existed start with a full sync
+            manifest.setdefault('changed_since', {})
+            manifest.setdefault('checked_at', 0)
+            manifest.setdefault('ledger_last_id', 0)
+            return manifest
+    return {'source': _source(), 'tables': {}, 'changed_since': {}, 'checked_at': 0, 'ledger_last_id': 0, 'garbage': []}
+
+
+def _save_manifest(manifest):
+    os.makedirs(_root(), exist_ok = True)
+    path = os.path.join(_root(), 'manifest.json')
+    with _lock:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        os.replace(path + '.tmp', path)
+
+
+def _schema(table):
+    return pa.schema(TABLE_COLUMNS[table])
+
+
+def _to_array(values, column_type):
+    try:
+        return pa.array(values, type = column_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # A column that comes back as DECIMAL with a scale, or as text, is converted the way MySQL would
+        return pa.array(values).cast(column_type, safe = False)
+
+
+def _to_arrow(table, rows):
+    columns = list(zip(*rows)) if rows else [[] for _ in TABLE_COLUMNS[table]]
+    return pa.table([_to_array(values, column_type) for values, (_, column_type) in zip(columns, TABLE_COLUMNS[table])],
+                    schema = _schema(table))
+
+
+def _write_partition(table, period, data):
+    # A new file every time, the manifest decides which one is current
+    relative = os.path.join(table, f"period={period}", f"part-{uuid.uuid4().hex}.arrow")
+    path = os.path.join(_root(), relative)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    feather.write_feather(data, path, compression = 'uncompressed')
+    return relative
+
+
+def _read_partition(relative):
+    return feather.read_table(os.path.join(_root(), relative), memory_map = True)
+
+
+def _watermark(started):
+    return (started - datetime.timedelta(seconds = SETTLE_SECONDS)).isoformat(sep = ' ')
+
+
+def _collect_garbage(manifest):
+    kept = []
+    for relative in manifest['garbage']:
+        try:
+            os.remove(os.path.join(_root(), relative))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            kept.append(relative)  # still open somewhere, try again next time
+    manifest['garbage'] = kept
+
+
+def _replace_partition(manifest, table, period, relative, checksum=None):
+    partitions = manifest['tables'].setdefault(table, {})
+    old = partitions.get(period)
+    if old:
+        manifest['garbage'].append(old['file'])
+    partitions[period] = {'file': relative, 'checksum': checksum}
+
+
+def _sync_period_table(cursor, manifest, table, started, full):
+    """
+    Bring one period table's partitions up to date. A full sync compares the checksum of every
+    period; an incremental one only those of the periods with rows whose updated_at is past the
+    table's watermark, found through its index, so the scan does not grow with the history.
+    """
+    names = [name for name, _ in TABLE_COLUMNS[table]]
+    fields = ", ".join(f"COALESCE({name}, '')" for name in names)
+    since = manifest['changed_since'].get(table)
+    if full or since is None:
+        where, params = "period IS NOT NULL", ()
+    else:
+        cursor.execute(f"SELECT DISTINCT period FROM {table} WHERE updated_at >= %s AND period IS NOT NULL;", (since,))
+        touched = [row[0] for row in cursor.fetchall()]
+        if not touched:
+            manifest['changed_since'][table] = _watermark(started)
+            return 0
+        where, params = f"period IN ({', '.join(['%s'] * len(touched))})", tuple(touched)
+    cursor.execute(f"""
+    SELECT period, COUNT(*), BIT_XOR(CRC32(CONCAT_WS('|', {fields})))
+    FROM {table}
+    WHERE {where}
+    GROUP BY period;
+    """, params)
+    checksums = {period.isoformat(): [int(count), int(checksum)] for period, count, checksum in cursor.fetchall()}
+
+    partitions = manifest['tables'].setdefault(table, {})
+    changed = [period for period, checksum in checksums.items()
+               if period not in partitions or partitions[period]['checksum'] != checksum]
+    for period in changed:
+        cursor.execute(f"SELECT {', '.join(names)} FROM {table} WHERE period = %s;", (period,))
+        relative = _write_partition(table, period, _to_arrow(table, cursor.fetchall()))
+        _replace_partition(manifest, table, period, relative, checksums[period])
+    # Deleted rows leave no updated_at behind, periods that lost all their rows are only seen by a full sync
+    removed = [period for period in partitions if period not in checksums] if full or since is None else []
+    for period in removed:
+        manifest['garbage'].append(partitions.pop(period)['file'])
+    manifest['changed_since'][table] = _watermark(started)
+    return len(changed) + len(removed)
+
+
+def _merge_ledger_rows(manifest, rows):
+    by_period = {}
+    for row in rows:
+        by_period.setdefault(row[-1].date().replace(day = 1).isoformat(), []).append(row)
+    partitions = manifest['tables'].setdefault(LEDGER_TABLE, {})
+    for period, period_rows in by_period.items():
+        data = _to_arrow(LEDGER_TABLE, period_rows)
+        if period in partitions:
+            # Rows read again after the settle window replace their earlier copy
+            existing = _read_partition(partitions[period]['file'])
+            existing = existing.filter(pc.invert(pc.is_in(existing['id'], value_set = data['id'])))
+            data = pa.concat_tables([existing, data]).sort_by('id')
+        _replace_partition(manifest, LEDGER_TABLE, period, _write_partition(LEDGER_TABLE, period, data))
+    return len(by_period)
+
+
+def _sync_ledger(cursor, manifest, started):
+    settled_before = started - datetime.timedelta(seconds = SETTLE_SECONDS)
+    names = [name for name, _ in TABLE_COLUMNS[LEDGER_TABLE]]
+    cursor.execute(f"SELECT {', '.join(names)} FROM {LEDGER_TABLE} WHERE id > %s ORDER BY id;",
+                   (manifest['ledger_last_id'],))
+
+    # The watermark only moves past rows that are old enough and have no younger row before them
+    last_id, settled, changed = manifest['ledger_last_id'], True, 0
+    while True:
+        rows = cursor.fetchmany(LEDGER_CHUNK_ROWS)
+        if not rows:
+            break
+        for row in rows:
+            settled = settled and row[-1] < settled_before
+            if settled:
+                last_id = row[0]
+        changed += _merge_ledger_rows(manifest, rows)
+    manifest['ledger_last_id'] = last_id
+    return changed
+
+
+def _sync(full=False):
+    global _synced_at, _synced_generation, _failed_at
+    generation = query_cache.generation(MIRRORED_TABLES)
+    manifest = _load_manifest()
+    # Files replaced by an earlier sync, no reader that loaded an older manifest still opens them
+    _collect_garbage(manifest)
+    # Deleted rows are only noticed by comparing every period, which is done this often
+    full = full or time.time() - manifest['checked_at'] > db_config.analytics_full_sync_seconds
+    changed = 0
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT NOW();")
+            started = cursor.fetchone()[0]
+            for table in PERIOD_TABLES:
+                changed += _sync_period_table(cursor, manifest, table, started, full)
+            changed += _sync_ledger(cursor, manifest, started)
+        finally:
+            cursor.close()
+    if full:
+        manifest['checked_at'] = time.time()
+    _save_manifest(manifest)
+    with _lock:
+        _synced_at, _synced_generation, _failed_at = time.monotonic(), dict(zip(MIRRORED_TABLES, generation)), None
+    logger.info("Analytics store synced (%s), %d partitions changed", 'full' if full else 'incremental', changed)
+    return changed
+
+
+def sync(full=False):
+    """
+    Bring the local copy up to date with MySQL. full compares every period instead of the
+    ones written since the last sync. Returns the number of partitions written or removed.
+    """
+    with _sync_lock:
+        return _sync(full)
+
+
+def _behind(tables):
+    # Whether this process wrote to one of the tables after the copy was last synced
+    current = query_cache.generation(tables)
+    with _lock:
+        return _synced_generation is None or any(_synced_generation.get(table) != generation
+                                                 for table, generation in zip(tables, current))
+
+
+def _is_stale():
+    with _lock:
+        if _synced_at is None:
+            return True
+        now = time.monotonic()
+        if _failed_at is not None and now - _failed_at < SYNC_RETRY_SECONDS:
+            return False
+        interval_passed = now - _synced_at > db_config.analytics_sync_seconds
+    return interval_passed or _behind(MIRRORED_TABLES)
+
+
+def sync_if_stale():
+    """
+    Sync when a table was written to in this process since the last sync, or when
+    ANALYTICS_SYNC_SECONDS have passed. After a write, the read waits for the sync (or for the
+    one another thread is running) so it sees that write; an interval sync another thread is
+    running is not waited for, the copy is served as it is meanwhile.
+    """
+    global _synced_at, _failed_at
+    if not _is_stale():
+        return
+    if not _sync_lock.acquire(blocking = _behind(MIRRORED_TABLES)):
+        return
+    try:
+        if _is_stale():
+            _sync()
+    except (Error, pa.ArrowException, OSError) as err:
+        # Serve the copy as it is and try again after SYNC_RETRY_SECONDS
+        logger.error("Analytics store sync failed, serving the local copy: '%s'", err)
+        with _lock:
+            _synced_at = _failed_at = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+
+def read_table(table, columns=None, periods=None, filter=None):
+    """
+    Rows of table from the local copy as a DataFrame, synced first if it is stale. periods
+    limits the read to those period dates (only their files are opened), columns may include
+    period, and filter is a pyarrow.dataset expression such as ds.field('BTN_SKU').isin(skus).
+    """
+    sync_if_stale()
+    if _behind((table,)):
+        # The sync failed, so the copy is older than a write made here; caching what it returns
+        # would keep serving that for a whole CACHE_TTL after MySQL is back
+        do_not_cache()
+    with timed('pandas'):
+        with _lock:
+            partitions = _load_manifest()['tables'].get(table, {})
+        if periods is not None:
+            wanted = {period.isoformat() for period in periods}
+            partitions = {period: entry for period, entry in partitions.items() if period in wanted}
+        dataset = ds.dataset(
+            [os.path.join(_root(), entry['file']) for entry in partitions.values()],
+            schema = _schema(table).append(pa.field('period', pa.date32())),
+            format = 'ipc',
+            partitioning = PARTITIONING,
+            partition_base_dir = os.path.join(_root(), table),
+            filesystem = fs.LocalFileSystem(use_mmap = True),
+        )
+        return dataset.to_table(columns = columns, filter = filter).to_pandas()
+
+
+def rebuild():
+    """Remove the local copy and sync it again from scratch."""
+    global _synced_at
+    with _sync_lock:
+        if os.path.isdir(_root()):
+            shutil.rmtree(_root())
+        with _lock:
+            _synced_at = None
+        return _sync()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Maintain the local analytics copy of the inventory history.")
+    parser.add_argument("--sync", action = "store_true", help = "bring the copy up to date with MySQL")
+    parser.add_argument("--full", action = "store_true", help = "with --sync, compare every month instead of the ones written since the last sync")
+    parser.add_argument("--rebuild", action = "store_true", help = "remove the copy and read everything again")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt the analytics store in {_root()}, {rebuild()} partitions written")
+    elif args.sync:
+        print(f"Synced the analytics store in {_root()}, {sync(full = args.full)} partitions changed")
+    else:
+        parser.print_help()
@@ -0,0 +1,161 @@
+"""
+Monthly usage roll-up kept next to items_table.
+
+Monthly_Usage holds one row per item and counted month: the end of month count, the previous
+count of the item, the boxes/rolls received in between (the positive changes in the
+Current_Amount_Items ledger) and the usage derived from them,
+
+    used = previous_count + received - end_count
+
+computed in SQL with LAG over each item's counts. Every write path that inserts month counts
+refreshes the roll-up from the earliest inserted month on, in the same transaction, so the
+comparison chart and the forecast page read this small table instead of the raw history.
+
+Months are refreshed when their counts are inserted, and a receipt recorded through
+inventory_control_stock refreshes the item's current and previous month, so a month that was
+already counted picks it up in the same transaction. Ledger rows written any other way only show
+up after a rebuild:
+    python inventory_control_usage.py --rebuild
+"""
+import argparse
+
+from inventory_control_cache import invalidate
+from inventory_control_db import run_in_transaction
+from inventory_control_metrics import configure_logging
+
+MONTHLY_USAGE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS Monthly_Usage (
+    BTN_SKU VARCHAR(50) NOT NULL,
+    period DATE NOT NULL,
+    Description VARCHAR(255),
+    item_type VARCHAR(100),
+    is_roll TINYINT(1) NOT NULL DEFAULT 0,
+    end_count INT NOT NULL DEFAULT 0,
+    previous_count INT NULL,
+    received INT NOT NULL DEFAULT 0,
+    used INT NULL,
+    refreshed_at DATETIME NOT NULL,
+    PRIMARY KEY (BTN_SKU, period),
+    INDEX idx_usage_period_sku (period, BTN_SKU)
+);
+"""
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _refresh(cursor, from_period=None, btn_skus=None):
+    # The first count of every item and month from from_period on, like the comparison chart
+    # always showed, plus each item's latest roll-up row before from_period, so LAG finds the
+    # previous count without reading the older history again
+    sku_filter = f"AND BTN_SKU IN ({_placeholders(btn_skus)})" if btn_skus else ""
+    sku_params = tuple(btn_skus) if btn_skus else ()
+    counts = f"""
+        SELECT BTN_SKU, period, Description, item_type, is_roll, end_count, 1 AS refresh
+        FROM (
+            SELECT BTN_SKU, period, Description, item_type, COALESCE(is_roll, 0) AS is_roll,
+                   COALESCE(Bundles_Boxes_Spools, 0) AS end_count,
+                   ROW_NUMBER() OVER (PARTITION BY BTN_SKU, period ORDER BY id) AS row_num
+            FROM items_table
+            WHERE period IS NOT NULL {"AND period >= %s" if from_period else ""} {sku_filter}
+        ) AS monthly
+        WHERE row_num = 1
+    """
+    params = ((from_period,) if from_period else ()) + sku_params
+    if from_period:
+        counts += f"""
+        UNION ALL
+        SELECT BTN_SKU, period, Description, item_type, is_roll, end_count, 0 AS refresh
+        FROM (
+            SELECT BTN_SKU, period, Description, item_type, is_roll, end_count,
+                   ROW_NUMBER() OVER (PARTITION BY BTN_SKU ORDER BY period DESC) AS row_num
+            FROM Monthly_Usage
+            WHERE period < %s {sku_filter}
+        ) AS earlier
+        WHERE row_num = 1
+        """
+        params += (from_period,) + sku_params
+
+    # Receipts count toward the month they arrived in, from the month after the previous
+    # count up to the end of the counted month
+    cursor.execute(f"""
+    INSERT INTO Monthly_Usage (BTN_SKU, period, Description, item_type, is_roll, end_count, previous_count, received, used, refreshed_at)
+    SELECT * FROM (
+        SELECT counts.BTN_SKU, counts.period, counts.Description, counts.item_type, counts.is_roll,
+               counts.end_count, counts.previous_count, COALESCE(SUM(ledger.Amount_Change), 0) AS received,
+               counts.previous_count + COALESCE(SUM(ledger.Amount_Change), 0) - counts.end_count AS used, NOW() AS refreshed_at
+        FROM (
+            SELECT BTN_SKU, period, Description, item_type, is_roll, end_count, refresh,
+                   LAG(end_count) OVER (PARTITION BY BTN_SKU ORDER BY period) AS previous_count,
+                   LAG(period) OVER (PARTITION BY BTN_SKU ORDER BY period) AS previous_period
+            FROM ({counts}) AS all_counts
+        ) AS counts
+        LEFT JOIN Current_Amount_Items AS ledger
+            ON ledger.BTN_SKU = counts.BTN_SKU
+            AND ledger.Amount_Change > 0
+            AND ledger.Change_Timestamp >= counts.previous_period + INTERVAL 1 MONTH
+            AND ledger.Change_Timestamp < counts.period + INTERVAL 1 MONTH
+        WHERE counts.refresh = 1
+        GROUP BY counts.BTN_SKU, counts.period, counts.Description, counts.item_type, counts.is_roll,
+                 counts.end_count, counts.previous_count
+    ) AS refreshed
+    ON DUPLICATE KEY UPDATE
+        Description = refreshed.Description,
+        item_type = refreshed.item_type,
+        is_roll = refreshed.is_roll,
+        end_count = refreshed.end_count,
+        previous_count = refreshed.previous_count,
+        received = refreshed.received,
+        used = refreshed.used,
+        refreshed_at = refreshed.refreshed_at;
+    """, params)
+
+
+def refresh_monthly_usage(connection, from_period, btn_skus=None):
+    """
+    Recompute the Monthly_Usage rows of every month from from_period (a period date) on, for
+    btn_skus or every item, on connection and inside the caller's transaction. The rows before
+    from_period must be up to date, which they are when every insert refreshes from its
+    earliest month. The caller invalidates 'Monthly_Usage' after committing.
+    """
+    cursor = connection.cursor()
+    try:
+        _refresh(cursor, from_period, btn_skus)
+    finally:
+        cursor.close()
+
+
+def create_monthly_usage(cursor):
+    """Create Monthly_Usage and fill it from the whole history, used by the migration."""
+    cursor.execute(MONTHLY_USAGE_TABLE_QUERY)
+    cursor.execute("DELETE FROM Monthly_Usage;")
+    _refresh(cursor)
+
+
+def _rebuild(connection):
+    cursor = connection.cursor()
+    try:
+        create_monthly_usage(cursor)
+        cursor.execute("SELECT COUNT(*) FROM Monthly_Usage;")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def rebuild_monthly_usage():
+    """Regenerate Monthly_Usage from items_table and the ledger. Returns the number of rows written."""
+    rows = run_in_transaction(_rebuild)
+    invalidate('Monthly_Usage')
+    return rows
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description = "Maintain the Monthly_Usage roll-up table.")
+    parser.add_argument("--rebuild", action = "store_true", help = "regenerate the roll-up from items_table and the Current_Amount_Items ledger")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt monthly usage with {rebuild_monthly_usage()} rows")
+    else:
+        parser.print_help()
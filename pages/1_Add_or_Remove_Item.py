@@ -1,166 +1,56 @@
 import streamlit as st
 import pandas as pd
-import mysql.connector
 from mysql.connector import Error
 import datetime
-from dotenv import load_dotenv
-import os
-import time
-
-# Load environment variables
-load_dotenv()
+from inventory_control_db import execute_read_query
+from inventory_control_import import ADJUSTMENT_COLUMNS, prepare_adjustments_dataframe
+from inventory_control_metrics import begin_rerun, configure_logging, metrics_panel, timed
+from inventory_control_queries import count_adjustment_history, fetch_adjustment_history_page
+from inventory_control_stock import adjust_item_amount, adjust_item_amounts, get_stock_snapshot
 
 st.set_page_config(layout="wide")
+configure_logging()
+begin_rerun("Add or Remove Item")
 current_year = datetime.datetime.now().year
 years = list(range(current_year - 10, current_year + 1))  # Last 10 years and current year
 
-def create_connection():
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            passwd=os.getenv('DB_PASS'),
-            database=os.getenv('DB_NAME')
-        )
-        print("MySQL Database connection successful")
-        return connection
-    except mysql.connector.Error as err:
-        print(f"Error: '{err}'")
-        return None
-    
-conn = create_connection()
-
-# Execute read queries and return results
-def execute_read_query(connection, query, params=None):
-    cursor = connection.cursor()
-    try:
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        result = cursor.fetchall()  # Fetches all rows of a query result
-        return result
-    except Error as err:
-        print(f"Error: '{err}'")
-        return None
-
-def execute_query(connection, query, params=None):
-    cursor = connection.cursor()
-    try:
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        connection.commit()
-        print("Query successful")
-    except Error as err:
-        print(f"Error: '{err}'")
-
-def get_all_btn_sku_and_description(connection):
+def get_all_btn_sku_and_description():
     query = "SELECT BTN_SKU, Description FROM items_table;"
-    results = execute_read_query(connection, query)
+    results = execute_read_query(query)
     if results:
         return [f"{result[0]} - {result[1]}" for result in results]
     else:
         return []  # Return an empty list if there are no results
 
-def get_most_current_amount(connection, btn_sku):
-    query = """
-    SELECT amount_after_change 
-    FROM Current_Amount_Items 
-    WHERE BTN_SKU = %s 
-    ORDER BY Change_Timestamp DESC 
-    LIMIT 1;
-    """
-    results = execute_read_query(connection, query, (btn_sku,))
-    if results and results[0][0] is not None:
-        return results[0][0]  # Return the most recent amount_after_change
-    else:
-        return 0  # Return 0 if no records are found
-
-def get_total_units_and_boxes(connection, btn_sku):
-    query = """
-    SELECT SUM(Amount_Change * units_per_box) as total_units,
-           SUM(Amount_Change) as total_boxes
-    FROM Current_Amount_Items 
-    WHERE BTN_SKU = %s;
-    """
-    results = execute_read_query(connection, query, (btn_sku,))
-    if results and results[0] is not None:
-        return results[0][0], results[0][1]  # Return total units and total boxes
-    else:
-        return 0, 0  # Return 0 if no records are found
-
-def adjust_item_amount(connection, btn_sku, amount_change, units_per_box, is_roll):
-    # Fetch current total before the change, for boxes or rolls
-    current_total_amount = get_most_current_amount(connection, btn_sku)
-    amount_before_change = current_total_amount
-    # Calculate the total after applying the change
-    amount_after_change = amount_before_change + amount_change
-    # Fetch previous total units and boxes
-    previous_total_units, previous_total_boxes = get_total_units_and_boxes(connection, btn_sku)
-    
-    # Ensure to use the correct previous total boxes, not adding them repeatedly
-    new_total_boxes = previous_total_boxes + amount_change
-
-    # Calculate new total units correctly
-    # If you are adding/subtracting boxes, we calculate the change to the total units
-    new_total_units = previous_total_units + (amount_change * units_per_box)
-
-    # Recalculate the average units per box correctly
-    if new_total_boxes > 0:
-        new_average_units_per_box = round(new_total_units / new_total_boxes)
-    else:
-        new_average_units_per_box = 0
-
-    #### Prints to terminal for verification, do not edit! ####
-    print(f"BTN_SKU: {btn_sku}")
-    print(f"Amount Change (boxes/rolls): {amount_change}")
-    print(f"Units Per Box/Roll: {units_per_box}")
-    print(f"Amount Before Change (boxes/rolls): {amount_before_change}")
-    print(f"Amount After Change (boxes/rolls): {amount_after_change}")
-    print(f"New Total Units: {new_total_units}")
-    print(f"New Average Units Per Box: {new_average_units_per_box}")
-    print(f"Is Roll: {is_roll}")
-    ###########################################################
-
-    # Parameterized query to prevent SQL injection
-    query = """
-    INSERT INTO Current_Amount_Items (BTN_SKU, Amount_Change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s);
-    """
-    params = (btn_sku, amount_change, amount_before_change, units_per_box, new_total_units, amount_after_change, is_roll)
-    execute_query(connection, query, params)
-
-    # Update the items_table to reflect the roll status
-    update_items_table_query = """
-    UPDATE items_table
-    SET is_roll = %s
-    WHERE BTN_SKU = %s;
-    """
-    execute_query(connection, update_items_table_query, (is_roll, btn_sku))
-
-
-def get_adjustment_history(connection, btn_sku):
-    query = """
-    SELECT BTN_SKU, amount_before_change, Amount_Change, amount_after_change, units_per_box, new_total_units, Change_Timestamp, is_roll
-    FROM Current_Amount_Items  
-    WHERE BTN_SKU = %s
-    ORDER BY Change_Timestamp DESC;
-    """
-    return execute_read_query(connection, query, (btn_sku,))
-
-def display_history(connection, btn_sku):
-    history_data = get_adjustment_history(connection, btn_sku)
-    if history_data:
-        # Convert history data to a more readable format if necessary 
-        formatted_data = []
-        for record in history_data:
-            record = list(record)
-            record[-2] = record[-2].strftime("%Y-%m-%d %H:%M:%S")
-            record[-1] = "Yes" if record[-1] else "No"
-            formatted_data.append(record)
-        history_df = pd.DataFrame(formatted_data, columns=['BTN_SKU', 'Before', 'Adjustment', 'New Item Count', 'Average Units Per Box/Roll', 'Total Units', 'Timestamp', 'Is Roll'])
+def load_history_page():
+    history = st.session_state['history']
+    btn_sku, start_date, end_date, page_size = history['filters']
+    rows, history['cursor'] = fetch_adjustment_history_page(btn_sku, page_size, history['cursor'], start_date, end_date)
+    history['rows'].extend(rows)
+    history['done'] = history['cursor'] is None
+
+def start_history(filters):
+    btn_sku, start_date, end_date, _ = filters
+    st.session_state['history'] = {
+        'filters': filters,
+        'rows': [],
+        'cursor': None,
+        'done': False,
+        'total': count_adjustment_history(btn_sku, start_date, end_date),
+    }
+    load_history_page()
+
+def display_history(history):
+    btn_sku = history['filters'][0]
+    if history['rows']:
+        with timed('pandas'):
+            history_df = pd.DataFrame(history['rows'], columns=['BTN_SKU', 'Before', 'Adjustment', 'New Item Count', 'Average Units Per Box/Roll', 'Total Units', 'Timestamp', 'Is Roll'])
+            # Convert history data to a more readable format
+            history_df['Timestamp'] = pd.to_datetime(history_df['Timestamp']).dt.strftime("%Y-%m-%d %H:%M:%S")
+            history_df['Is Roll'] = history_df['Is Roll'].astype(bool).map({True: "Yes", False: "No"})
+        loaded = len(history_df)
+        total = max(history['total'], loaded)
+        st.progress(loaded / total, text=f"Loaded {loaded} of {total} adjustments")
         st.write(f"Adjustment History for BTN_SKU: {btn_sku}")
         st.dataframe(history_df, use_container_width=True)
     else:
@@ -170,17 +60,14 @@ title_html = """<h1 style= "margin-bottom: -55px;"> Inventory Adjustment </h1>""
 st.markdown(title_html, unsafe_allow_html=True)
 st.markdown("""<hr style = "height: 2px; border: none; color: green; background-color: green; "/> """, unsafe_allow_html=True)
 
-btn_skus_with_description = get_all_btn_sku_and_description(conn)  # Fetch all BTN_SKU values with descriptions
+btn_skus_with_description = get_all_btn_sku_and_description()  # Fetch all BTN_SKU values with descriptions
 selected_item = st.selectbox("Select BTN_SKU", btn_skus_with_description)
 btn_sku = selected_item.split(' - ')[0]  # Extract BTN_SKU from the selected string
 
 # Fetch the most current amount for the selected BTN_SKU
-current_amount = get_most_current_amount(conn, btn_sku)
-previous_total_units, previous_total_boxes = get_total_units_and_boxes(conn, btn_sku)
-if previous_total_units is not None and previous_total_boxes is not None and previous_total_boxes != 0:
-    current_average_units_per_box = previous_total_units / previous_total_boxes
-else:
-    current_average_units_per_box = 0
+stock = get_stock_snapshot(btn_sku)
+current_amount = stock['current_amount']
+current_average_units_per_box = stock['average_units_per_box']
 
 st.markdown("""
 <style>
@@ -225,7 +112,7 @@ with st.form("adjust_item_amount_form"):
         else:
             try:
                 # Adjust item amount and recalculate the average
-                adjust_item_amount(conn, btn_sku, amount_change, units_per_box, is_roll)
+                adjust_item_amount(btn_sku, amount_change, units_per_box, is_roll)
                 
                 if amount_change > 0:
                     st.success(f"Added {amount_change} {'rolls' if is_roll else 'boxes'} successfully!")
@@ -233,14 +120,9 @@ with st.form("adjust_item_amount_form"):
                     st.success(f"Removed {-amount_change} {'rolls' if is_roll else 'boxes'} successfully!")
                 
                 # Update current amount and total units after the adjustment
-                current_amount = get_most_current_amount(conn, btn_sku)
-                previous_total_units, previous_total_boxes = get_total_units_and_boxes(conn, btn_sku)
-                
-                # Properly calculate the new average after the change
-                if previous_total_boxes > 0:
-                    new_average_units_per_box = previous_total_units / previous_total_boxes
-                else:
-                    new_average_units_per_box = 0
+                stock = get_stock_snapshot(btn_sku)
+                current_amount = stock['current_amount']
+                new_average_units_per_box = stock['average_units_per_box']
                     
                 st.write(f"New Current Amount (boxes/rolls): {current_amount}")
                 st.write(f"New Average Units Per Box/Roll: {new_average_units_per_box}")
@@ -248,6 +130,60 @@ with st.form("adjust_item_amount_form"):
             except Error as e:
                 st.error(f"An error occurred: {e}")
 
+# Batch mode for receiving many items at once, every row is saved in one transaction
+with st.expander("Batch Adjustment (several items at once)"):
+    st.write("Enter one row per item, or upload a CSV file with the columns BTN_SKU, Amount_Change, units_per_box and is_roll.")
+    known_skus = sorted({item.split(' - ')[0] for item in btn_skus_with_description})
+    batch_file = st.file_uploader("Upload adjustments CSV", type=["csv"], key="batch_file")
+    if batch_file is not None:
+        batch_df = pd.read_csv(batch_file, dtype={'BTN_SKU': str})
+        first_row = 2  # file row, the header is row 1
+    else:
+        empty_batch = pd.DataFrame({
+            'BTN_SKU': pd.Series(dtype=str),
+            'Amount_Change': pd.Series(dtype=int),
+            'units_per_box': pd.Series(dtype=int),
+            'is_roll': pd.Series(dtype=bool),
+        })
+        batch_df = st.data_editor(empty_batch, num_rows="dynamic", use_container_width=True, key="batch_editor", column_config={
+            'BTN_SKU': st.column_config.SelectboxColumn("BTN_SKU", options=known_skus, required=True),
+            'Amount_Change': st.column_config.NumberColumn("Amount Change (boxes/rolls)", step=1, required=True),
+            'units_per_box': st.column_config.NumberColumn("Units Per Box/Roll", min_value=1, step=1, required=True),
+            'is_roll': st.column_config.CheckboxColumn("Is Roll", default=False),
+        })
+        first_row = 1
+    batch_df = batch_df.dropna(how='all')
+
+    adjustments, batch_errors = None, None
+    if not batch_df.empty:
+        with timed('pandas'):
+            try:
+                adjustments, batch_errors = prepare_adjustments_dataframe(batch_df, known_skus, first_row)
+            except ValueError as err:
+                st.error(str(err))
+
+    if batch_errors is not None and not batch_errors.empty:
+        st.error(f"{batch_errors['Row'].nunique()} rows cannot be saved. Fix them and try again:")
+        st.dataframe(batch_errors, use_container_width=True, hide_index=True)
+
+    if adjustments is not None and st.button(f"Apply {len(adjustments)} Adjustments", disabled=adjustments.empty or not batch_errors.empty):
+        try:
+            # Column wise tolist() gives native Python values, mysql-connector cannot bind numpy scalars
+            results = adjust_item_amounts(list(zip(*(adjustments[col].tolist() for col in ADJUSTMENT_COLUMNS))))
+            st.success(f"Adjusted {len(results)} items successfully!")
+            st.dataframe(pd.DataFrame(results).rename(columns={
+                'btn_sku': 'BTN_SKU',
+                'amount_change': 'Adjustment',
+                'amount_before_change': 'Before',
+                'amount_after_change': 'New Item Count',
+                'average_units_per_box': 'Average Units Per Box/Roll',
+            }), use_container_width=True, hide_index=True)
+        except ValueError as e:
+            # Input the validator let through, such as an item listed twice
+            st.error(f"No adjustments were saved: {e}")
+        except Error as e:
+            st.error(f"No adjustments were saved, the batch was rolled back: {e}")
+
 st.write("\n")
 st.write("\n")
 st.write("\n")
@@ -266,18 +202,23 @@ st.markdown("""
             background-color: green; "/> """, 
             unsafe_allow_html=True)
 
-st.markdown("***Changes are displayed from oldest at the top to most recent at the bottom of the log.***")
+st.markdown("***Most recent changes are displayed at the top of the log, older changes are loaded a page at a time.***")
 btn_sku_history_with_description = st.selectbox("Select BTN_SKU for History", btn_skus_with_description, key="history_selectbox_history", label_visibility="collapsed")
 btn_sku_history = btn_sku_history_with_description.split(' - ')[0]  # Extract BTN_SKU from the selected string
 
-display_history_button = st.button("Click to Display Adjustment History")
-if display_history_button:
-    with st.spinner('Loading Adjustment History...'):
-        progress_bar = st.progress(0)
-        for percent_complete in range(100):
-            progress_bar.progress(percent_complete + 1)
-            time.sleep(0.05)
-        
-        display_history(conn, btn_sku_history)
+history_col1, history_col2, history_col3 = st.columns(3)
+history_start = history_col1.date_input("From date", value=None, key="history_start")
+history_end = history_col2.date_input("To date", value=None, key="history_end")
+history_page_size = history_col3.number_input("Rows per page", min_value=10, max_value=500, value=50, step=10)
+history_filters = (btn_sku_history, history_start, history_end, history_page_size)
+
+st.button("Click to Display Adjustment History", on_click=start_history, args=(history_filters,))
+
+# Only show the loaded history while it still matches the selected item and filters
+history = st.session_state.get('history')
+if history and history['filters'] == history_filters:
+    display_history(history)
+    if not history['done']:
+        st.button("Load older changes", on_click=load_history_page)
 
-    progress_bar.progress(100)
+metrics_panel()
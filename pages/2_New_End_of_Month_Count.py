@@ -1,81 +1,96 @@
+import logging
 import pandas as pd
 import numpy as np
 import streamlit as st
-import mysql.connector
-from mysql.connector import Error
 from datetime import date 
-from dotenv import load_dotenv 
-import os
-
-# Load environment variables
-load_dotenv()
+from mysql.connector import Error
+from inventory_control_cache import invalidate
+from inventory_control_db import execute_read_query, get_connection, prepared_cursor, run_in_transaction
+from inventory_control_import import insert_month_counts, validate_month_counts
+from inventory_control_metrics import begin_rerun, configure_logging, fragment_rerun, metrics_panel, timed
+from inventory_control_queries import fetch_data, fetch_month_count_prefill, month_to_period
+from inventory_control_usage import refresh_monthly_usage
 
 # Set the page layout to wide mode
 st.set_page_config(layout="wide")
+configure_logging()
+begin_rerun("New End of Month Count")
+logger = logging.getLogger(__name__)
 
-def create_connection():
-    connection = None
-    try:
-        connection = mysql.connector.connect(
-            host = os.getenv('DB_HOST'),
-            user = os.getenv('DB_USER'),
-            passwd = os.getenv('DB_PASS'),
-            database = os.getenv('DB_NAME')
-        )
-        print("MySQL Database connection successful")
-    except Error as err:
-        print(f"Error: '{err}'")
-    return connection
-
-# Database configuration
-connection = create_connection()
-
-# Execute a modification query safely
-def execute_query_safe(connection, query, data):
-    cursor = connection.cursor()
+def _insert_monthly_row(connection, data):
+    query = """
+    INSERT INTO items_table (BTN_SKU, Description, item_type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, period, is_roll) 
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """
+    cursor = prepared_cursor(connection, query)
     try:
         cursor.execute(query, data)
-        connection.commit()
-        print("Query successful")
-    except Error as err:
-        print(f"Error: '{err}'")
     finally:
         cursor.close()
+    # The item's usage roll-up from this month on, in the same transaction as the count
+    refresh_monthly_usage(connection, data[9], [data[0]])
 
-def read_query_safe(connection, query, data=None):
-    cursor = connection.cursor()
-    result = None
+def insert_new_monthly_data(data):
     try:
-        if data:
-            cursor.execute(query, data)
-        else:
-            cursor.execute(query)
-        result = cursor.fetchall()
-        return result
+        run_in_transaction(_insert_monthly_row, data)
     except Error as err:
-        print(f"Error: '{err}'")
-    finally:
-        cursor.close()
+        logger.error("Error: '%s'", err)
+        return False
+    invalidate('items_table', 'Monthly_Usage')
+    return True
 
-def insert_new_monthly_data(connection, data):
-    query = """
-    INSERT INTO items_table (BTN_SKU, Description, item_type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, is_roll) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-    """
-    execute_query_safe(connection, query, data)
-
-def get_most_recent_data(connection, btn_sku):
+def get_most_recent_data(btn_sku):
     query = """
     SELECT amount_after_change, new_total_units
     FROM Current_Amount_Items
     WHERE BTN_SKU = %s
     ORDER BY Change_Timestamp DESC LIMIT 1;
     """
-    result = read_query_safe(connection, query, (btn_sku,))
+    result = execute_read_query(query, (btn_sku,), prepared=True)
     if result:
         return result[0]
     return 0, 0  # Default values if no records found
 
+@st.fragment
+@fragment_rerun("New End of Month Count")
+def month_count_grid(Month):
+    # Every item in one editable grid, prefilled with its details and current balance, saved in one transaction
+    period = month_to_period(Month)
+    prefill = fetch_month_count_prefill()
+    counted = fetch_data(Month)  # items that already have a count for this month
+    already_counted = set(counted['BTN_SKU']) if not counted.empty else set()
+
+    grid = prefill.assign(Pallets=0)
+    grid.insert(0, 'Include', ~grid['BTN_SKU'].isin(already_counted))
+    if already_counted:
+        st.warning(f"{len(already_counted)} items already have a count for {Month}, they are not saved again unless Include is ticked.")
+
+    edited = st.data_editor(grid, key=f"month_count_grid_{period}", hide_index=True, use_container_width=True,
+                            disabled=['BTN_SKU'], column_config={
+        'Include': st.column_config.CheckboxColumn("Include"),
+        'item_type': st.column_config.TextColumn("Type"),
+        'Count_Details': st.column_config.TextColumn("Count Details"),
+        'Pallets': st.column_config.NumberColumn("Pallets", min_value=0, max_value=10, step=1),
+        'Bundles_Boxes_Spools': st.column_config.NumberColumn("Bundles/Boxes/Spools", min_value=0, max_value=10000, step=1),
+        'Units_Pieces_Each': st.column_config.NumberColumn("Units/Pieces Each", min_value=0, step=1),
+        'is_roll': st.column_config.CheckboxColumn("Is Roll"),
+    })
+    rows = edited[edited['Include']].drop(columns='Include')
+
+    with timed('pandas'):
+        _, grid_errors = validate_month_counts(rows)
+    if not grid_errors.empty:
+        st.error(f"{grid_errors['Row'].nunique()} rows cannot be saved. Fix them in the grid:")
+        st.dataframe(grid_errors, use_container_width=True, hide_index=True)
+
+    if st.button(f"Submit {len(rows)} Counts for {Month}", disabled=rows.empty or not grid_errors.empty):
+        try:
+            with get_connection() as connection:
+                result = insert_month_counts(connection, rows, Month, period)
+            st.success(f"Saved {result['rows']} counts for {Month} in {result['seconds']:.2f} seconds!")
+        except Error as err:
+            st.error(f"No counts were saved, the month was rolled back: {err}")
+
 st.title('Enter Monthly Data')
 
 year = st.selectbox('Select Year', list(range(2020, 2031)), index = date.today().year - 2020)
@@ -91,9 +106,15 @@ Month = f"{month} {year}"
 if 'recent_changes' not in st.session_state:
     st.session_state['recent_changes'] = []
 
+entry_mode = st.radio("Count mode", ["One item at a time", "Whole month in a grid"], horizontal=True)
+if entry_mode == "Whole month in a grid":
+    month_count_grid(Month)
+    metrics_panel()
+    st.stop()
+
 btn_sku_query = "SELECT DISTINCT BTN_SKU FROM items_table ORDER BY BTN_SKU;"
-btn_sku_results = read_query_safe(connection, btn_sku_query)
-btn_sku_options = [result[0] for result in btn_sku_results]
+btn_sku_results = execute_read_query(btn_sku_query)
+btn_sku_options = [result[0] for result in btn_sku_results or []]
 
 selected_btn_sku = st.selectbox('Select BTN_SKU', btn_sku_options)
 
@@ -105,14 +126,14 @@ if selected_btn_sku:
     SELECT Description, item_type, Count_Details, Vendor 
     FROM items_table 
     WHERE BTN_SKU = %s
-    ORDER BY BTN_SKU DESC LIMIT 1;
+    ORDER BY period DESC LIMIT 1;
     """
-    details_results = read_query_safe(connection, details_query, (selected_btn_sku,))
+    details_results = execute_read_query(details_query, (selected_btn_sku,), prepared=True)
     if details_results:
         Description, Type, Count_Details, Vendor = details_results[0]
     
     # Fetch the most recent data for Bundles_Boxes_Spools and Units_Pieces_Each
-    Bundles_Boxes_Spools, Units_Pieces_Each = get_most_recent_data(connection, selected_btn_sku)
+    Bundles_Boxes_Spools, Units_Pieces_Each = get_most_recent_data(selected_btn_sku)
 
 # Display the auto-filled data
 st.text_input('Description', Description)
@@ -155,18 +176,11 @@ if st.button('Submit New Monthly Data'):
     if error_message:
         st.error(error_message)
     else:
-        connection = create_connection()
+        # Prepare data for insertion
+        data = (selected_btn_sku, Description, Type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, month_to_period(Month), is_roll)
         
-        if connection is not None:
-            # Prepare data for insertion
-            data = (selected_btn_sku, Description, Type, Count_Details, Vendor, Pallets, Bundles_Boxes_Spools, Units_Pieces_Each, Month, is_roll)
-            
-            # Use the insert_new_monthly_data function
-            insert_new_monthly_data(connection, data)
-            
-            connection.close()
-            print("Database connection closed.")
-            
+        # Use the insert_new_monthly_data function
+        if insert_new_monthly_data(data):
             # Record the change with a timestamp in the session state
             change_record = {
                 'BTN_SKU': selected_btn_sku,
@@ -176,7 +190,9 @@ if st.button('Submit New Monthly Data'):
             # add the new record to the session state list
             st.session_state['recent_changes'].insert(0, change_record)  # Insert at the beginning to show recent first
         else:
-            st.error("Failed to connect to the database.")
+            st.error("Failed to save the monthly data to the database.")
 
 st.subheader('Recent Changes Log')
 st.table(st.session_state['recent_changes'])
+
+metrics_panel()
@@ -0,0 +1,84 @@
+import streamlit as st
+import datetime
+import os
+import tempfile
+from inventory_control_export import EXPORT_ERRORS, FORMATS, export
+from inventory_control_metrics import begin_rerun, configure_logging, metrics_panel
+from inventory_control_queries import fetch_item_types, fetch_items_BTN_SKU
+
+configure_logging()
+begin_rerun("Export Data")
+
+st.title("Export Data")
+st.write("Download month counts or the adjustment history as a file. Rows are written to the file as they are read, "
+         "so a full year of adjustments can be exported without loading it on the page first.")
+
+SOURCES = {
+    "Monthly counts (items_table)": 'items_table',
+    "Adjustment history (Current_Amount_Items)": 'Current_Amount_Items',
+}
+FORMAT_LABELS = {'csv': "CSV", 'xlsx': "Excel", 'parquet': "Parquet"}
+MIME_TYPES = {
+    'csv': "text/csv",
+    'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    'parquet': "application/vnd.apache.parquet",
+}
+
+def read_export(path):
+    # Called by the download button when it is clicked, not on every rerun
+    with open(path, 'rb') as f:
+        return f.read()
+
+def remove_previous_export():
+    previous = st.session_state.pop('export', None)
+    if previous and os.path.exists(previous['path']):
+        os.remove(previous['path'])
+
+today = datetime.date.today()
+source_label = st.radio("Data", list(SOURCES), horizontal=True)
+table = SOURCES[source_label]
+
+col1, col2 = st.columns(2)
+dates = col1.date_input("Date range", value=(today.replace(month=1, day=1), today),
+                        help="Monthly counts are included by their month, adjustments by the day they were made.")
+file_format = col2.selectbox("Format", list(FORMATS), format_func=FORMAT_LABELS.get)
+btn_skus = st.multiselect("BTN_SKU (all items if empty)", fetch_items_BTN_SKU())
+item_types = st.multiselect("Item type (all types if empty)", fetch_item_types())
+
+# A date range is only complete once both ends are picked
+start_date, end_date = dates if len(dates) == 2 else (dates[0] if dates else None, None)
+
+if st.button("Prepare Export"):
+    remove_previous_export()
+    fd, path = tempfile.mkstemp(prefix="inventory_export_", suffix=FORMATS[file_format])
+    os.close(fd)
+    progress_bar = st.progress(0.0, text="Counting rows...")
+
+    def show_progress(written, total):
+        progress_bar.progress(written / total if total else 1.0, text=f"{written:,} of {total:,} rows written")
+
+    prepared = False
+    try:
+        rows = export(table, path, file_format, start_date, end_date, btn_skus, item_types, progress=show_progress)
+        st.session_state['export'] = {
+            'path': path,
+            'rows': rows,
+            'format': file_format,
+            'file_name': f"{table}_{start_date or 'start'}_{end_date or today}{FORMATS[file_format]}",
+        }
+        prepared = True
+    except EXPORT_ERRORS as err:
+        st.error(f"The export failed: {err}")
+    finally:
+        # Also when the run is stopped half way, by an error or by a click that reruns the page
+        if not prepared and os.path.exists(path):
+            os.remove(path)
+
+exported = st.session_state.get('export')
+if exported and os.path.exists(exported['path']):
+    size_mb = os.path.getsize(exported['path']) / 1024 / 1024
+    st.success(f"{exported['rows']:,} rows ready ({size_mb:.1f} MB).")
+    st.download_button(f"Download {FORMAT_LABELS[exported['format']]} file", data=lambda: read_export(exported['path']),
+                       file_name=exported['file_name'], mime=MIME_TYPES[exported['format']], on_click="ignore")
+
+metrics_panel()
@@ -0,0 +1,132 @@
+import contextlib
+import datetime
+import os
+import sqlite3
+import sys
+import zlib
+from types import SimpleNamespace
+
+import mysql.connector
+import pytest
+
+# The modules live at the repository root, next to the Streamlit entry point
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory_control_cache import query_cache  # noqa: E402
+
+sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(sep=' '))
+sqlite3.register_converter('DATE', lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+
+@pytest.fixture(autouse=True)
+def empty_query_cache():
+    # Cached results of one test must not answer the next one
+    query_cache.clear()
+    yield
+    query_cache.clear()
+
+
+class _BitXor:
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        self.value ^= value or 0
+
+    def finalize(self):
+        return self.value
+
+
+class _Cursor:
+    """The part of a mysql.connector cursor the analytics store uses, on SQLite, counting statements."""
+
+    def __init__(self, db, statements):
+        self._cursor = db.cursor()
+        self._statements = statements
+
+    def execute(self, query, params=()):
+        self._statements.append(query)
+        query = query.replace('%s', '?').replace("SELECT NOW();", 'SELECT CURRENT_TIMESTAMP AS "now [timestamp]";')
+        self._cursor.execute(query, params or ())
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+
+class AnalyticsDatabase:
+    """SQLite stand-in for the MySQL tables the analytics store mirrors."""
+
+    SCHEMA = """
+    CREATE TABLE items_table (
+        id INTEGER PRIMARY KEY, BTN_SKU TEXT, Description TEXT, item_type TEXT, Count_Details TEXT, Vendor TEXT,
+        Pallets INTEGER, Bundles_Boxes_Spools INTEGER, Units_Pieces_Each INTEGER, Month TEXT, period DATE,
+        is_roll INTEGER, Spools INTEGER, Amount_Used_Monthly INTEGER,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE Monthly_Usage (
+        BTN_SKU TEXT, period DATE, Description TEXT, item_type TEXT, is_roll INTEGER, end_count INTEGER,
+        previous_count INTEGER, received INTEGER, used INTEGER,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (BTN_SKU, period)
+    );
+    CREATE TABLE Current_Amount_Items (
+        id INTEGER PRIMARY KEY, BTN_SKU TEXT, Amount_Change INTEGER, amount_before_change INTEGER,
+        units_per_box INTEGER, new_total_units INTEGER, amount_after_change INTEGER, is_roll INTEGER,
+        Change_Timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    -- MySQL's ON UPDATE CURRENT_TIMESTAMP
+    CREATE TRIGGER items_updated_at AFTER UPDATE ON items_table BEGIN
+        UPDATE items_table SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER usage_updated_at AFTER UPDATE ON Monthly_Usage BEGIN
+        UPDATE Monthly_Usage SET updated_at = CURRENT_TIMESTAMP WHERE BTN_SKU = NEW.BTN_SKU AND period = NEW.period;
+    END;
+    """
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False,
+                                  detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        self.db.create_aggregate('BIT_XOR', 1, _BitXor)
+        self.db.create_function('CRC32', 1, lambda value: zlib.crc32(str(value).encode()))
+        self.db.create_function('CONCAT_WS', -1, lambda sep, *values: sep.join(str(value) for value in values if value is not None))
+        self.db.executescript(self.SCHEMA)
+        self.statements = []
+        self.down = False
+
+    def execute(self, query, params=()):
+        self.db.execute(query, params)
+        self.db.commit()
+
+    @contextlib.contextmanager
+    def connection(self):
+        if self.down:
+            raise mysql.connector.Error("Can't connect to MySQL server")
+        connection = SimpleNamespace(cursor=lambda: _Cursor(self.db, self.statements))
+        yield connection
+
+
+@pytest.fixture
+def analytics_db(tmp_path, monkeypatch):
+    """An AnalyticsDatabase the analytics store syncs from, with an empty store in tmp_path."""
+    import inventory_control_db_config as db_config
+    import inventory_control_store
+
+    database = AnalyticsDatabase()
+    monkeypatch.setattr(db_config, 'analytics_store_dir', str(tmp_path / 'analytics_store'))
+    monkeypatch.setattr(inventory_control_store, 'get_connection', database.connection)
+    monkeypatch.setattr(inventory_control_store, '_synced_at', None)
+    monkeypatch.setattr(inventory_control_store, '_synced_generation', None)
+    monkeypatch.setattr(inventory_control_store, '_failed_at', None)
+    yield database
+    database.db.close()
@@ -0,0 +1,81 @@
+import datetime
+
+import inventory_control_store
+from inventory_control_cache import invalidate
+from inventory_control_queries import fetch_monthly_comparison
+
+JANUARY = datetime.date(2024, 1, 1)
+
+
+def add_count(analytics_db, btn_sku, period, end_count):
+    analytics_db.execute(
+        "INSERT INTO Monthly_Usage (BTN_SKU, period, Description, item_type, is_roll, end_count) VALUES (?, ?, ?, ?, 0, ?)",
+        (btn_sku, period, f"{btn_sku} description", 'Boxes', end_count))
+
+
+def january_count(btn_sku):
+    df = fetch_monthly_comparison([btn_sku], ['January 2024'])
+    return df['Value'].iloc[0]
+
+
+def test_read_after_a_write_sees_it(analytics_db):
+    add_count(analytics_db, 'BSKU-5230', JANUARY, 12)
+    assert january_count('BSKU-5230') == 12
+
+    # A save commits and invalidates the tables it changed, the next read must not be the cached one
+    analytics_db.execute("UPDATE Monthly_Usage SET end_count = 20 WHERE BTN_SKU = 'BSKU-5230'")
+    invalidate('Monthly_Usage')
+    assert january_count('BSKU-5230') == 20
+
+    # Straight after the previous sync as well
+    analytics_db.execute("UPDATE Monthly_Usage SET end_count = 25 WHERE BTN_SKU = 'BSKU-5230'")
+    invalidate('Monthly_Usage')
+    assert january_count('BSKU-5230') == 25
+
+
+def test_copy_older_than_a_write_is_not_cached(analytics_db, monkeypatch):
+    add_count(analytics_db, 'BSKU-5230', JANUARY, 12)
+    assert january_count('BSKU-5230') == 12
+
+    analytics_db.execute("UPDATE Monthly_Usage SET end_count = 20 WHERE BTN_SKU = 'BSKU-5230'")
+    invalidate('Monthly_Usage')
+    analytics_db.down = True
+    assert january_count('BSKU-5230') == 12  # served from the copy while MySQL is unreachable
+
+    analytics_db.down = False
+    monkeypatch.setattr(inventory_control_store, 'SYNC_RETRY_SECONDS', 0)
+    assert january_count('BSKU-5230') == 20
+
+
+def test_sync_only_reads_the_periods_written_since_the_last_one(analytics_db):
+    for month in range(1, 13):
+        add_count(analytics_db, 'BSKU-5230', datetime.date(2024, month, 1), month)
+    assert inventory_control_store.sync() == 12
+
+    analytics_db.statements.clear()
+    analytics_db.execute("UPDATE Monthly_Usage SET end_count = 40 WHERE period = ?", (datetime.date(2024, 3, 1),))
+    # The other months were written within the settle window too, their checksums still match
+    assert inventory_control_store.sync() == 1
+    rereads = [query for query in analytics_db.statements if 'WHERE period = ' in query]
+    assert len(rereads) == 1
+
+
+def test_full_sync_drops_deleted_periods(analytics_db):
+    add_count(analytics_db, 'BSKU-5230', JANUARY, 12)
+    add_count(analytics_db, 'BSKU-5230', datetime.date(2024, 2, 1), 9)
+    inventory_control_store.sync()
+
+    analytics_db.execute("DELETE FROM Monthly_Usage WHERE period = ?", (JANUARY,))
+    assert inventory_control_store.sync() == 0
+    assert inventory_control_store.sync(full=True) == 1
+    assert list(inventory_control_store.read_table('Monthly_Usage', ['end_count'])['end_count']) == [9]
+
+
+def test_ledger_is_mirrored(analytics_db):
+    analytics_db.execute(
+        "INSERT INTO Current_Amount_Items (BTN_SKU, Amount_Change, amount_before_change, units_per_box, "
+        "new_total_units, amount_after_change, is_roll) VALUES ('BSKU-5230', 5, 10, 12, 180, 15, 0)")
+    inventory_control_store.sync()
+
+    ledger = inventory_control_store.read_table('Current_Amount_Items', ['BTN_SKU', 'Amount_Change', 'amount_after_change'])
+    assert ledger.to_dict('records') == [{'BTN_SKU': 'BSKU-5230', 'Amount_Change': 5, 'amount_after_change': 15}]
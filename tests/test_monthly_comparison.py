@@ -0,0 +1,92 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import inventory_control_store
+from inventory_control_cache import invalidate
+from inventory_control_queries import fetch_monthly_comparison
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Replace the analytics read with one that serves counts for a few pairs and records every call."""
+    calls = []
+    counts = pd.DataFrame({
+        'period': [datetime.date(2024, 1, 1), datetime.date(2024, 2, 1), datetime.date(2024, 1, 1)],
+        'BTN_SKU': ['BSKU-5230', 'BSKU-5230', 'BSKU-5350'],
+        'end_count': [12, 9, 40],
+        'is_roll': [0, 0, 1],
+    })
+
+    def read_table(table, columns=None, periods=None, filter=None):
+        calls.append((table, list(periods)))
+        return counts[counts['period'].isin(periods)][columns].reset_index(drop=True)
+
+    monkeypatch.setattr(inventory_control_store, 'read_table', read_table)
+    return calls
+
+
+@pytest.mark.parametrize('item_count, month_count', [(1, 1), (3, 2), (10, 12)])
+def test_one_read_per_selection(reads, item_count, month_count):
+    items = [f"BSKU-{5000 + i}" for i in range(item_count)]
+    months = [datetime.date(2024, month, 1).strftime("%B %Y") for month in range(1, month_count + 1)]
+
+    df = fetch_monthly_comparison(items, months)
+
+    assert len(reads) == 1
+    assert reads[0][0] == 'Monthly_Usage'
+    assert len(reads[0][1]) == month_count
+    assert len(df) == item_count * month_count
+
+
+def test_missing_months_are_zero_filled(reads):
+    df = fetch_monthly_comparison(['BSKU-5230', 'BSKU-5350'], ['January 2024', 'February 2024', 'March 2024'])
+
+    assert list(df.columns) == ['MonthYear', 'Item', 'Value', 'IsRoll']
+    values = {(row.MonthYear, row.Item): (row.Value, row.IsRoll) for row in df.itertuples()}
+    assert values == {
+        ('January 2024', 'BSKU-5230'): (12, False),
+        ('January 2024', 'BSKU-5350'): (40, True),
+        ('February 2024', 'BSKU-5230'): (9, False),
+        ('February 2024', 'BSKU-5350'): (0, False),
+        ('March 2024', 'BSKU-5230'): (0, False),
+        ('March 2024', 'BSKU-5350'): (0, False),
+    }
+    # Months then items, in the order they were selected
+    assert df['MonthYear'].tolist() == ['January 2024'] * 2 + ['February 2024'] * 2 + ['March 2024'] * 2
+
+
+def test_empty_selection_reads_nothing(reads):
+    assert fetch_monthly_comparison([], ['January 2024']).empty
+    assert fetch_monthly_comparison(['BSKU-5230'], []).empty
+    assert reads == []
+
+
+@pytest.mark.parametrize('item_count, month_count', [(3, 3), (50, 24)])
+def test_statements_do_not_grow_with_the_selection(analytics_db, item_count, month_count):
+    """Against a connection that counts statements, instead of a replaced read_table."""
+    items = [f"BSKU-{5000 + i}" for i in range(50)]
+    periods = [datetime.date(2023 + month // 12, month % 12 + 1, 1) for month in range(24)]
+    analytics_db.db.executemany(
+        "INSERT INTO Monthly_Usage (BTN_SKU, period, Description, item_type, is_roll, end_count) VALUES (?, ?, '', 'Boxes', 0, ?)",
+        [(item, period, 10) for item in items for period in periods])
+    analytics_db.db.commit()
+    inventory_control_store.sync()
+    selected_items = items[:item_count]
+    selected_months = [period.strftime("%B %Y") for period in periods[:month_count]]
+
+    # The copy is current, the comparison reads it without a statement to MySQL
+    analytics_db.statements.clear()
+    df = fetch_monthly_comparison(selected_items, selected_months)
+    assert analytics_db.statements == []
+    assert len(df) == item_count * month_count
+
+    # After a save the read syncs first: the server time, the months written per table, their
+    # checksums, the one changed month and new ledger rows, whatever the selection
+    analytics_db.execute("UPDATE Monthly_Usage SET end_count = -1 WHERE BTN_SKU = ? AND period = ?", (items[0], periods[0]))
+    invalidate('Monthly_Usage')
+    analytics_db.statements.clear()
+    df = fetch_monthly_comparison(selected_items, selected_months)
+    assert len(analytics_db.statements) == 6
+    assert df['Value'].iloc[0] == -1
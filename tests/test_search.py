@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from inventory_control_search import EXACT, FUZZY, PREFIX, SUBSTRING, SearchIndex
+
+
+@pytest.fixture(scope='module')
+def index():
+    items = [(f"BSKU-{number:05d}", f"PLU label roll {number}", datetime.date(2024, 1, 1)) for number in range(2000)]
+    items += [
+        ('BSKU-5230', 'Gala apple PLU 4133', datetime.date(2024, 3, 1)),
+        ('BSKU-5350', 'Honeycrisp apple PLU 3283', datetime.date(2024, 3, 1)),
+    ]
+    return SearchIndex(items)
+
+
+def skus(index, results):
+    return [index.items[doc_id][0] for _, _, doc_id in results]
+
+
+def test_exact_sku_returns_only_that_item(index):
+    results = index.search("BSKU-01234")
+    assert skus(index, results) == ['BSKU-01234']
+    assert results[0][1] == EXACT
+
+
+def test_fuzzy_matches_are_dropped_next_to_real_matches(index):
+    results = index.search("BSKU-0123")
+    assert all(match > FUZZY for _, match, _ in results)
+    assert set(skus(index, results)) == {f"BSKU-{number:05d}" for number in range(1230, 1240)}
+
+
+def test_fuzzy_matches_are_kept_when_nothing_else_matches(index):
+    results = index.search("honeycrsp")
+    assert skus(index, results)[:1] == ['BSKU-5350']
+    assert results[0][1] == FUZZY
+
+
+def test_short_query_finds_a_unique_substring(index):
+    results = index.search("ga")
+    assert skus(index, results) == ['BSKU-5230']
+    assert results[0][1] == PREFIX
+
+
+@pytest.mark.parametrize('query', ["52", "23"])
+def test_short_queries_match_inside_the_sku(index, query):
+    results = index.search(query, limit=len(index.items))
+    assert 'BSKU-5230' in skus(index, results)
+    assert all(query in index.texts[doc_id] for _, _, doc_id in results)
+    assert {match for _, match, _ in results} <= {PREFIX, SUBSTRING}
+
+
+def test_short_query_without_matches(index):
+    assert index.search("x3") == []
+
+
+def test_substring_match_is_found_past_many_near_misses():
+    # Near misses start with the query, so they share more of its trigrams than the real match
+    # inside a word does, and there are more of them than candidates were once kept
+    items = [(f"BSKU-{number:04d}", f"abcdex{number}", None) for number in range(150)]
+    items.append(('BSKU-9999', 'zzabcdefzz', None))
+    results = SearchIndex(items).search("abcdef", limit=20)
+    assert [(match, doc_id) for _, match, doc_id in results] == [(SUBSTRING, 150)]